@@ -1,5 +1,5 @@
 import os
-import json
+import sys
 import logging
 import docker
 from datetime import datetime, timedelta
@@ -9,6 +9,11 @@ from cassandra.policies import DCAwareRoundRobinPolicy
 from hdfs import InsecureClient
 from collections import defaultdict
 
+# Moduli condivisi con il Batch Layer (volume ./hadoop-job)
+sys.path.append(os.environ.get('HADOOP_JOB_DIR', '/hadoop-job'))
+import codec
+import discard_log
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - FLASK - %(message)s')
 log = logging.getLogger(__name__)
 
@@ -24,6 +29,7 @@ HDFS_USER = os.environ.get('HDFS_USER', 'root')
 HDFS_DAILY_OUTPUT = '/iot-output/daily-averages' 
 HDFS_STATS_DIR = '/iot-stats/daily-aggregate'
 HDFS_DISCARD_STATS_PATH = '/models/discard_stats.json'
+HDFS_DISCARD_DELTA_DIR = '/models/discard_deltas'
 HDFS_SUMMARY_DIR = '/iot-stats/daily-summary'
 
 def get_hdfs_client():
@@ -117,7 +123,7 @@ def get_batch_data():
                 if line.startswith(f"{sensor_id}-"):
                     parts = line.split('\t', 1)
                     if len(parts) > 1:
-                        metrics = json.loads(parts[1])
+                        metrics = codec.loads(parts[1])
                         return jsonify({today: metrics})
     except Exception: pass
     return jsonify({"status": "Calcolo in corso..."})
@@ -130,7 +136,7 @@ def get_aggregate_stats():
     path = f"{HDFS_STATS_DIR}/date={today}/aggregate_stats.json"
     try:
         with client.read(path, encoding='utf-8') as r:
-            data = json.load(r)
+            data = codec.loads(r.read())
             response.update(data)
     except: pass
     return jsonify(response)
@@ -140,12 +146,23 @@ def get_discard_stats():
     client = get_hdfs_client()
     response = {"total": 0}
     try:
+        # Totale esatto = snapshot compattato + delta non ancora compattati.
+        # Prima i delta, poi lo snapshot: se la compattazione gira in mezzo, lo snapshot
+        # letto dopo include i delta gia' letti e il loro watermark li esclude dalla somma
+        deltas = []
+        for name in client.list(HDFS_DISCARD_DELTA_DIR) if client.status(HDFS_DISCARD_DELTA_DIR, strict=False) else []:
+            if not name.startswith(discard_log.DELTA_PREFIX): continue
+            try:
+                with client.read(f"{HDFS_DISCARD_DELTA_DIR}/{name}", encoding='utf-8') as r:
+                    deltas.append(discard_log.parse_delta(r.read()))
+            except Exception: pass # Delta compattato nel frattempo: e' nello snapshot
+
+        snapshot = discard_log.parse_snapshot('')
         if client.status(HDFS_DISCARD_STATS_PATH, strict=False):
             with client.read(HDFS_DISCARD_STATS_PATH, encoding='utf-8') as r:
-                content = r.read()
-                if content:
-                    data = json.loads(content)
-                    response["total"] = data.get("total", 0)
+                snapshot = discard_log.parse_snapshot(r.read())
+
+        response["total"] = discard_log.current_total(snapshot, deltas)
     except: pass
     return jsonify(response)
 
@@ -13,46 +13,59 @@ Output (stdout): Un singolo JSON aggregato con i totali di TUTTI i batch.
 """
 
 import sys
-import json
-
-total_clean = 0
-total_discarded = 0
-
-# Legge tutte le righe provenienti da "hdfs dfs -cat .../*/part-00000"
-for line in sys.stdin:
-    try:
-        line = line.strip()
-        if not line:
-            continue
-
-        # L'output del reducer è nel formato: CHIAVE \t JSON
-        # Esempio: "A1-2023-10-27 \t {...}"
-        parts = line.split('\t', 1)
-        if len(parts) < 2:
-            continue
+
+import codec
+
+
+def count_lines(lines, total_clean=0, total_discarded=0):
+    """Somma puliti e scartati delle righe "CHIAVE\t{json}" del reducer."""
+    # Legge tutte le righe provenienti da "hdfs dfs -cat .../*/part-*" (tutti i reducer)
+    for line in lines:
+        try:
+            line = line.strip()
+            if not line:
+                continue
+
+            # L'output del reducer è nel formato: CHIAVE \t JSON
+            # Esempio: "A1-2023-10-27 \t {...}"
+            parts = line.split('\t', 1)
+            if len(parts) < 2:
+                continue
+                
+            json_str = parts[1]
+            metrics = codec.loads(json_str)
+            
+            # Somma i contatori parziali di questo micro-batch
+            # (dalle statistiche sufficienti se presenti, stessi valori)
+            stats = metrics.get('stats')
+            if stats is not None:
+                total_clean += stats.get('n', 0)
+                total_discarded += stats.get('discarded', 0)
+            else:
+                total_clean += metrics.get('count', 0) 
+                total_discarded += metrics.get('discarded_count', 0)
             
-        json_str = parts[1]
-        metrics = json.loads(json_str)
-        
-        # Somma i contatori parziali di questo micro-batch
-        total_clean += metrics.get('count', 0) 
-        total_discarded += metrics.get('discarded_count', 0)
-        
-    except (ValueError, json.JSONDecodeError):
-        # Ignora righe che non sono JSON valido (es. log di hadoop spuri)
-        pass
-    except Exception:
-        pass
-
-# Calcola il totale processato cumulativo
-total_processed = total_clean + total_discarded
-
-# Prepara l'output finale per la Dashboard
-output = {
-    "total_clean": total_clean,
-    "total_discarded": total_discarded,
-    "total_processed": total_processed
-}
-
-# Stampa un singolo oggetto JSON su stdout
-print(json.dumps(output, indent=2))
\ No newline at end of file
+        except ValueError:
+            # Ignora righe che non sono JSON valido (es. log di hadoop spuri)
+            pass
+        except Exception:
+            pass
+    return total_clean, total_discarded
+
+
+def format_aggregate(total_clean, total_discarded):
+    # Calcola il totale processato cumulativo
+    total_processed = total_clean + total_discarded
+
+    # Prepara l'output finale per la Dashboard
+    output = {
+        "total_clean": total_clean,
+        "total_discarded": total_discarded,
+        "total_processed": total_processed
+    }
+    return codec.dumps(output, pretty=True)
+
+
+if __name__ == "__main__":
+    # Stampa un singolo oggetto JSON su stdout
+    print(format_aggregate(*count_lines(sys.stdin)))
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+batch_format.py - Formato colonnare compresso per i micro-batch (IOTC)
+
+Ogni blocco occupa UNA riga di testo, cosi' resta compatibile con
+TextInputFormat di Hadoop Streaming e con "hdfs dfs -cat" concatenati:
+
+  IOTC1 \t base64( zlib( HEADER_LEN | HEADER_JSON | COLONNE ) )
+
+L'header JSON descrive il blocco (auto-descrittivo):
+  {"rows": N, "columns": [{"name": "sensor_id", "type": "dict", "values": [...]}, ...]}
+
+Tipi di colonna (little-endian):
+  dict    -> indici uint16 in "values"
+  int64   -> interi con segno a 64 bit (timestamp in microsecondi epoch UTC)
+  float64 -> double IEEE 754
+
+Compatibile Python 3.5 (niente f-string): gira sui NodeManager.
+"""
+
+import sys
+import json
+import zlib
+import base64
+import struct
+from array import array
+from datetime import datetime, timedelta
+
+MAGIC = 'IOTC1'
+FILE_EXT = 'iotc'
+BLOCK_ROWS = 4096  # Righe massime per blocco
+
+EPOCH = datetime(1970, 1, 1)
+US_PER_DAY = 86400 * 1000000
+
+# Schema fisso dei record del producer: (nome, tipo)
+SCHEMA = [
+    ("sensor_id", "dict"),
+    ("timestamp", "int64"),
+    ("temp", "float64"),
+    ("source", "dict"),
+]
+
+_TYPECODES = {"dict": "H", "int64": "q", "float64": "d"}
+_SWAP = sys.byteorder != 'little'
+
+
+def datetime_to_us(dt):
+    """Datetime naive UTC -> microsecondi epoch (intero esatto)."""
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def us_to_datetime(ts_us):
+    """Microsecondi epoch -> datetime naive UTC."""
+    return EPOCH + timedelta(microseconds=ts_us)
+
+
+def is_block(line):
+    return line.startswith(MAGIC)
+
+
+def _pack_column(typ, values):
+    arr = array(_TYPECODES[typ], values)
+    if _SWAP:
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _unpack_column(typ, raw):
+    arr = array(_TYPECODES[typ])
+    arr.frombytes(raw)
+    if _SWAP:
+        arr.byteswap()
+    return arr
+
+
+def encode_block(rows):
+    """
+    Codifica una lista di tuple (sensor_id, timestamp_us, temp, source)
+    in una riga IOTC (senza newline finale).
+    """
+    columns = list(zip(*rows)) if rows else [()] * len(SCHEMA)
+    meta = []
+    payload = []
+
+    for (name, typ), values in zip(SCHEMA, columns):
+        col = {"name": name, "type": typ}
+        if typ == "dict":
+            # Dizionario locale al blocco (poche chiavi: sensori/sorgenti)
+            index = {}
+            codes = []
+            for v in values:
+                code = index.get(v)
+                if code is None:
+                    code = index[v] = len(index)
+                codes.append(code)
+            col["values"] = list(index)
+            values = codes
+        meta.append(col)
+        payload.append(_pack_column(typ, values))
+
+    header = json.dumps({"rows": len(rows), "columns": meta}, separators=(',', ':')).encode('utf-8')
+    body = struct.pack('<I', len(header)) + header + b''.join(payload)
+    return MAGIC + '\t' + base64.b64encode(zlib.compress(body, 6)).decode('ascii')
+
+
+def decode_block(line):
+    """
+    Decodifica una riga IOTC. Ritorna un dict {nome_colonna: sequenza}.
+    Le colonne "dict" sono gia' espanse nei valori originali.
+    """
+    encoded = line.split('\t', 1)[1].strip()
+    body = zlib.decompress(base64.b64decode(encoded))
+
+    (header_len,) = struct.unpack_from('<I', body, 0)
+    offset = 4 + header_len
+    header = json.loads(body[4:offset].decode('utf-8'))
+    rows = header["rows"]
+
+    out = {}
+    for col in header["columns"]:
+        typ = col["type"]
+        size = array(_TYPECODES[typ]).itemsize * rows
+        data = _unpack_column(typ, body[offset:offset + size])
+        offset += size
+        if typ == "dict":
+            values = col["values"]
+            data = [values[c] for c in data]
+        out[col["name"]] = data
+    return out
+
+
+def iter_block(line):
+    """Itera le tuple (sensor_id, timestamp_us, temp, source) di un blocco."""
+    cols = decode_block(line)
+    return zip(*(cols[name] for name, _ in SCHEMA))
+
+
+def encode_batch(rows):
+    """Codifica un intero batch in righe IOTC da BLOCK_ROWS righe."""
+    lines = []
+    for i in range(0, len(rows), BLOCK_ROWS):
+        lines.append(encode_block(rows[i:i + BLOCK_ROWS]) + '\n')
+    return "".join(lines)
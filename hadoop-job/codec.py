@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+codec.py - Codifica dei record condivisa da tutti gli stadi
+(producer, mapper, reducer, unify/aggregate, train_model, dashboard).
+
+JSON: usa orjson se installato, altrimenti il modulo json della stdlib.
+Con orjson l'output e' compatto (niente spazi dopo ',' e ':'): i
+consumatori leggono JSON, non confrontano stringhe.
+
+Timestamp: parser a layout fisso per 'YYYY-MM-DDTHH:MM:SS[.ffffff]'
+(l'output di datetime.isoformat() del producer, UTC naive), con cache
+per data: la conversione giorno -> epoch si fa una volta per data,
+non per riga. Compatibile Python 3.5 (gira nei container Hadoop).
+"""
+
+import calendar
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+US_PER_S = 1000000
+US_PER_DAY = 86400 * US_PER_S
+
+
+# --- JSON ---
+def _std_dumps(obj, pretty=False):
+    return json.dumps(obj, indent=2) if pretty else json.dumps(obj)
+
+
+if orjson is not None:
+    def _orjson_loads(s):
+        return orjson.loads(s)
+
+    def _orjson_dumps(obj, pretty=False):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0).decode('utf-8')
+
+    BACKENDS = {'json': (json.loads, _std_dumps), 'orjson': (_orjson_loads, _orjson_dumps)}
+    BACKEND = 'orjson'
+else:
+    BACKENDS = {'json': (json.loads, _std_dumps)}
+    BACKEND = 'json'
+
+loads, dumps = BACKENDS[BACKEND]
+
+
+# --- Timestamp ISO-8601 ---
+_day_cache = {}
+_DAY_CACHE_MAX = 4096
+
+
+def _day_us(day):
+    base = _day_cache.get(day)
+    if base is None:
+        if len(day) != 10 or day[4] != '-' or day[7] != '-' or not (day[0:4] + day[5:7] + day[8:10]).isdigit():
+            raise ValueError("Data non valida: {}".format(day))
+        year, month, mday = int(day[0:4]), int(day[5:7]), int(day[8:10])
+        # Come strptime: niente date inesistenti (timegm le normalizzerebbe in silenzio)
+        if year < 1 or not 1 <= month <= 12 or not 1 <= mday <= calendar.monthrange(year, month)[1]:
+            raise ValueError("Data non valida: {}".format(day))
+        base = calendar.timegm((year, month, mday, 0, 0, 0)) * US_PER_S
+        if len(_day_cache) >= _DAY_CACHE_MAX:
+            _day_cache.clear()
+        _day_cache[day] = base
+    return base
+
+
+def iso_to_us(s):
+    """'YYYY-MM-DDTHH:MM:SS[.ffffff]' (UTC) -> epoch in microsecondi. ValueError se malformato."""
+    n = len(s)
+    if n < 19 or s[10] != 'T' or s[13] != ':' or s[16] != ':':
+        raise ValueError("Timestamp non valido: {}".format(s))
+    if not (s[11:13] + s[14:16] + s[17:19]).isdigit():
+        raise ValueError("Timestamp non valido: {}".format(s))
+    hour, minute, second = int(s[11:13]), int(s[14:16]), int(s[17:19])
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError("Timestamp non valido: {}".format(s))
+    us = _day_us(s[:10]) + (hour * 3600 + minute * 60 + second) * US_PER_S
+    if n > 19:
+        if s[19] != '.' or n > 26 or not s[20:].isdigit():
+            raise ValueError("Timestamp non valido: {}".format(s))
+        us += int(s[20:].ljust(6, '0'))
+    return us
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+codec_benchmark.py - Microbenchmark del codec per stadio
+
+Confronta, su record sintetici, il codice precedente (json stdlib +
+strptime) con codec.py, sia con il backend stdlib sia con il backend
+veloce (se installato). Stampa i tempi per operazione e lo speedup.
+
+Uso: python3 codec_benchmark.py [--rows 20000]
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+import codec
+
+
+def make_records(n):
+    rnd = random.Random(42)
+    start = datetime(2024, 5, 1, 23, 50)
+    out = []
+    for i in range(n):
+        ts = start + timedelta(milliseconds=37 * i)
+        out.append({"sensor_id": "ABC"[i % 3] + "1", "timestamp": ts.isoformat(),
+                    "temp": round(60000 + rnd.gauss(0, 50), 2), "source": "Binance"})
+    return out
+
+
+REDUCER_METRICS = {"open": 60012.5, "close": 60031.25, "min": 59950.1, "max": 60100.75, "count": 1200,
+                   "total_count": 1210, "discarded_count": 10, "discarded_pct": 0.8264462809917356,
+                   "daily_change": 18.75, "daily_change_pct": 0.03, "range_pct": 0.25,
+                   "volatility": 31.4, "trend": 1}
+
+
+# --- Stadi: versione precedente ---
+def old_producer(records):
+    return "".join(json.dumps(r) + '\n' for r in records)
+
+
+def old_mapper(lines):
+    out = []
+    for line in lines:
+        data = json.loads(line)
+        ts = data["timestamp"]
+        if '.' in ts:
+            dt = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S.%f")
+        else:
+            dt = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S")
+        out.append("{}-{}\t{}|{}".format(data["sensor_id"], dt.strftime('%Y-%m-%d'), float(data["temp"]), int(dt.timestamp())))
+    return out
+
+
+def old_reducer(n):
+    return [json.dumps(REDUCER_METRICS) for _ in range(n)]
+
+
+def old_downstream(lines):
+    return [json.loads(l) for l in lines]
+
+
+# --- Stadi: codec ---
+def new_stages(loads, dumps):
+    def producer(records):
+        return "".join(dumps(r) + '\n' for r in records)
+
+    def mapper(lines):
+        out = []
+        for line in lines:
+            data = loads(line)
+            ts = data["timestamp"]
+            out.append("{}-{}\t{}|{}".format(data["sensor_id"], ts[:10], float(data["temp"]),
+                                             codec.iso_to_us(ts) // codec.US_PER_S))
+        return out
+
+    def reducer(n):
+        return [dumps(REDUCER_METRICS) for _ in range(n)]
+
+    def downstream(lines):
+        return [loads(l) for l in lines]
+
+    return producer, mapper, reducer, downstream
+
+
+def timeit(fn, arg, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    p = argparse.ArgumentParser(description="Microbenchmark del codec condiviso")
+    p.add_argument('--rows', type=int, default=20000)
+    args = p.parse_args()
+
+    records = make_records(args.rows)
+    lines = [json.dumps(r) for r in records]
+    reducer_lines = old_reducer(args.rows)
+
+    stages = [("producer serialize", records), ("mapper parse", lines),
+              ("reducer dumps", args.rows), ("unify/aggregate/dashboard loads", reducer_lines)]
+    variants = [("stdlib+strptime", (old_producer, old_mapper, old_reducer, old_downstream))]
+    for name in sorted(codec.BACKENDS):
+        variants.append(("codec[{}]".format(name), new_stages(*codec.BACKENDS[name])))
+
+    print("Backend attivo: {}  ({} righe)".format(codec.BACKEND, args.rows))
+    print("{:<34}".format("stadio") + "".join("{:>22}".format(v[0]) for v in variants))
+    for i, (stage, arg) in enumerate(stages):
+        times = [timeit(fns[i], arg) for _, fns in variants]
+        cells = ["{:>9.2f} us/op x{:<5.1f}".format(t / args.rows * 1e6, times[0] / t) for t in times]
+        print("{:<34}".format(stage) + "".join("{:>22}".format(c) for c in cells))
+
+    # Le due versioni del mapper devono produrre la stessa uscita
+    assert old_mapper(lines[:1000]) == new_stages(*codec.BACKENDS[codec.BACKEND])[1](lines[:1000])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+combiner.py - Combiner del job micro-batch
+
+Fonde i parziali (partials.py) con la stessa chiave prodotti dai map task
+dello stesso nodo e riemette un parziale: nessun filtro, nessuna metrica
+finale (le fa il reducer). Eventuali punti grezzi passano invariati (il
+filtro del modello lo applica il reducer), nell'ordine delle chiavi:
+l'output del combiner deve restare ordinato come il suo input.
+"""
+import sys
+
+from partials import PREFIX, Partial
+
+def main():
+    current_key = None
+    current = None
+
+    for line in sys.stdin:
+        try:
+            key, value = line.rstrip('\n').split('\t', 1)
+            if value.startswith(PREFIX):
+                partial, raw = Partial.from_value(value), False
+            else:
+                partial, raw = None, True
+        except Exception:
+            continue  # Riga malformata
+
+        if key != current_key and current_key is not None:
+            # Prima il parziale in sospeso: chiave minore di quella della riga corrente
+            print("{}\t{}".format(current_key, current.to_value()))
+            current_key, current = None, None
+
+        if raw:
+            sys.stdout.write(line)  # Punto grezzo: passa invariato
+        elif current_key is None:
+            current_key, current = key, partial
+        else:
+            current.merge(partial)
+
+    if current_key is not None:
+        print("{}\t{}".format(current_key, current.to_value()))
+
+if __name__ == "__main__":
+    main()
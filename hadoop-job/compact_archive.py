@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+compact_archive.py - Compattazione dell'archivio in segmenti indicizzati
+
+Ogni micro-batch archivia decine di file piccoli (batch_<ms>[_wN].<ext>):
+migliaia di file al giorno pesano sul NameNode e rallentano ogni -cat.
+La compattazione unisce i batch di un'ora chiusa di una partizione in un
+segmento gzip con le righe originali (JSONL o blocchi IOTC, invariate):
+
+  /iot-data/archive/date=D/segment_<YYYY-MM-DDTHH>_<ms primo batch>.gz
+  /iot-data/archive/date=D/segment_<...>.idx.json   indice accanto al segmento
+      {"segment": nome, "path": percorso HDFS, "rows": N, "sensors": [...],
+       "ts_min": iso, "ts_max": iso, "sources": [batch inclusi]}
+
+Chi legge usa "hdfs dfs -text" sul glob {batch_*,segment_*.gz}: -text
+decomprime i .gz e passa invariati i batch non compattati (lo stesso vale
+per l'input di Hadoop Streaming, che riconosce l'estensione).
+
+Il nome del segmento dipende solo dai batch inclusi, quindi rifare una
+compattazione interrotta lo sovrascrive. Ordine delle scritture: indice,
+segmento (caricato con nome temporaneo e poi rinominato), cancellazione
+dei batch. Se il run cade prima della cancellazione, `plan` trova i batch
+elencati da un indice il cui segmento esiste e li fa solo cancellare.
+
+Comandi:
+  compact_archive.py plan --listing FILE [--now EPOCH] < indici esistenti
+      FILE: percorsi dell'archivio (uno per riga). Stampa righe
+      "rm FILE..." e "segment DIR NOME FILE...".
+  compact_archive.py archived --listing FILE < indici esistenti
+      Nomi dei batch gia' archiviati, singoli o dentro un segmento completo
+      (il job li usa per scartare i batch ricaricati in incoming dal replay).
+  compact_archive.py write --segment S --index I --path PERCORSO FILE... < righe dei batch
+      S/I: file locali; PERCORSO: destinazione HDFS del segmento.
+
+Compatibile Python 3.5 (gira nel container Hadoop).
+"""
+
+import argparse
+import gzip
+import os
+import sys
+import time
+from datetime import datetime
+
+import batch_format
+import codec
+
+GRACE_SECONDS = 600   # Un'ora si compatta solo 10 minuti dopo la sua fine
+MIN_FILES = 2         # Un gruppo di un solo file resta com'e'
+SEGMENT_PREFIX = 'segment_'
+
+
+def batch_ms(path):
+    """Millisecondi di creazione dal nome batch_<ms>[_wN].<ext>, None se non e' un batch."""
+    name = os.path.basename(path)
+    if not name.startswith('batch_'):
+        return None
+    digits = name[len('batch_'):].split('_', 1)[0].split('.', 1)[0]
+    return int(digits) if digits.isdigit() else None
+
+
+def covered_batches(paths, indexes):
+    """Percorsi dei batch inclusi in un segmento presente nell'archivio."""
+    present = set(paths)
+    covered = set()
+    for idx in indexes:
+        # Un indice vale solo se il suo segmento e' stato rinominato al posto giusto
+        seg_path = idx.get("path")
+        if seg_path in present:
+            seg_dir = os.path.dirname(seg_path)
+            covered.update(os.path.join(seg_dir, s) for s in idx.get("sources", []))
+    return covered
+
+
+def archived_names(paths, indexes):
+    """Nomi dei batch archiviati: file batch_* presenti piu' quelli gia' compattati."""
+    names = set(os.path.basename(p) for p in paths if batch_ms(p) is not None)
+    names.update(os.path.basename(p) for p in covered_batches(paths, indexes))
+    return names
+
+
+def plan(paths, indexes, now):
+    """(file da cancellare, [(dir, nome segmento, [file])]) per i batch da compattare."""
+    covered = covered_batches(paths, indexes)
+
+    leftovers = sorted(p for p in paths if p in covered)
+    groups = {}
+    for p in paths:
+        ms = batch_ms(p)
+        if ms is None or p in covered:
+            continue
+        hour = ms // 3600000 * 3600
+        if hour + 3600 + GRACE_SECONDS > now:
+            continue  # Ora non ancora chiusa
+        groups.setdefault((os.path.dirname(p), hour), []).append(p)
+
+    segments = []
+    for (directory, hour), files in sorted(groups.items()):
+        if len(files) < MIN_FILES:
+            continue
+        files.sort(key=lambda p: (batch_ms(p), p))
+        name = "{}{}_{}.gz".format(SEGMENT_PREFIX, datetime.utcfromtimestamp(hour).strftime('%Y-%m-%dT%H'),
+                                   batch_ms(files[0]))
+        segments.append((directory, name, files))
+    return leftovers, segments
+
+
+def write_segment(lines, segment_path, hdfs_path, sources):
+    """Scrive il segmento gzip e ritorna il suo indice."""
+    rows = 0
+    sensors = set()
+    ts_min = ts_max = None
+
+    with gzip.open(segment_path, 'wt', encoding='utf-8') as out:
+        for line in lines:
+            stripped = line.strip()
+            if not stripped:
+                continue
+            out.write(stripped + '\n')
+            try:
+                if batch_format.is_block(stripped):
+                    points = [(sid, ts_us) for sid, ts_us, _t, _s in batch_format.iter_block(stripped)]
+                else:
+                    data = codec.loads(stripped)
+                    points = [(data["sensor_id"], codec.iso_to_us(data["timestamp"]))]
+            except Exception:
+                continue  # Riga malformata: resta nel segmento, fuori dall'indice
+            for sid, ts_us in points:
+                rows += 1
+                sensors.add(sid)
+                if ts_min is None or ts_us < ts_min: ts_min = ts_us
+                if ts_max is None or ts_us > ts_max: ts_max = ts_us
+
+    def iso(ts_us):
+        return batch_format.us_to_datetime(ts_us).isoformat() if ts_us is not None else None
+
+    return {"segment": os.path.basename(hdfs_path), "path": hdfs_path, "rows": rows, "sensors": sorted(sensors),
+            "ts_min": iso(ts_min), "ts_max": iso(ts_max),
+            "sources": [os.path.basename(s) for s in sources]}
+
+
+def main():
+    p = argparse.ArgumentParser(description="Compattazione dell'archivio in segmenti")
+    sub = p.add_subparsers(dest='cmd')
+    p_plan = sub.add_parser('plan')
+    p_plan.add_argument('--listing', required=True)
+    p_plan.add_argument('--now', type=int, default=None)
+    p_archived = sub.add_parser('archived')
+    p_archived.add_argument('--listing', required=True)
+    p_write = sub.add_parser('write')
+    p_write.add_argument('--segment', required=True)
+    p_write.add_argument('--index', required=True)
+    p_write.add_argument('--path', required=True)
+    p_write.add_argument('sources', nargs='*')
+    args = p.parse_args()
+
+    if args.cmd in ('plan', 'archived'):
+        with open(args.listing) as f:
+            paths = [l.strip() for l in f if l.strip()]
+        indexes = []
+        for line in sys.stdin:
+            try:
+                if line.strip(): indexes.append(codec.loads(line))
+            except ValueError:
+                pass
+
+    if args.cmd == 'archived':
+        for name in sorted(archived_names(paths, indexes)):
+            print(name)
+
+    elif args.cmd == 'plan':
+        now = args.now if args.now is not None else int(time.time())
+        leftovers, segments = plan(paths, indexes, now)
+        if leftovers:
+            print("rm " + " ".join(leftovers))
+        for directory, name, files in segments:
+            print("segment {} {} {}".format(directory, name, " ".join(files)))
+
+    elif args.cmd == 'write':
+        index = write_segment(sys.stdin, args.segment, args.path, args.sources)
+        with open(args.index, 'w') as f:
+            f.write(codec.dumps(index) + '\n')
+
+    else:
+        p.print_help()
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+daily_state.py - Stato giornaliero incrementale per sensore
+
+Invece di rifare unify_batches/aggregate_stats su tutti i batch del giorno
+a ogni micro-batch, il job tiene uno stato persistente e ci fonde solo
+l'output dei batch nuovi. daily_stats.json e aggregate_stats.json si
+riscrivono dallo stato, in tempo costante.
+
+Layout su HDFS (uno stato per giorno):
+  /iot-stats/daily-state/date=YYYY-MM-DD/state.json
+      {"applied": ["batch_HH-MM-SS", ...],
+       "sensors": {sensor_id: accumulatori di unify_batches},
+       "total_clean": N, "total_discarded": M}
+
+Un batch si fonde una sola volta: il nome finisce in "applied" insieme ai
+suoi dati. A ogni run si fondono TUTTI i batch completati (con _SUCCESS)
+non ancora in "applied", in ordine di nome (= ordine cronologico): se un
+run si interrompe a meta', il successivo recupera i batch rimasti fuori.
+Lo stato si pubblica come state.json.tmp e poi si rinomina; se il rename
+non e' avvenuto, si riparte da state.json.tmp.
+
+Comandi (stato locale in --state, riscritto in modo atomico):
+  daily_state.py pending --state S DIR...   batch completati da fondere
+  daily_state.py merge --state S --batch NOME < part file del batch
+  daily_state.py render --state S --daily D --aggregate A
+
+Compatibile Python 3.5 (gira nel container Hadoop).
+"""
+
+import argparse
+import os
+import sys
+
+import codec
+from aggregate_stats import count_lines, format_aggregate
+from unify_batches import format_daily, merge_lines
+
+
+def new_state():
+    return {"applied": [], "sensors": {}, "total_clean": 0, "total_discarded": 0}
+
+
+def load_state(path):
+    """Stato salvato; vuoto se il file manca o e' vuoto (primo batch del giorno)."""
+    try:
+        with open(path, 'r') as f:
+            text = f.read()
+    except (IOError, OSError):
+        return new_state()
+    if not text.strip():
+        return new_state()
+    state = new_state()
+    state.update(codec.loads(text))
+    return state
+
+
+def save_state(path, state):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(codec.dumps(state))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+
+
+def pending_batches(state, batch_dirs):
+    """Directory dei batch non ancora fusi, in ordine di nome."""
+    applied = set(state["applied"])
+    dirs = {}
+    for d in batch_dirs:
+        name = os.path.basename(d.rstrip('/'))
+        if name and name not in applied:
+            dirs[name] = d
+    return [dirs[name] for name in sorted(dirs)]
+
+
+def merge_batch(state, batch, lines):
+    """Fonde l'output di un batch nello stato; un batch gia' fuso viene ignorato."""
+    if batch in state["applied"]:
+        return False
+    lines = list(lines)
+    merge_lines(state["sensors"], lines)
+    state["total_clean"], state["total_discarded"] = count_lines(
+        lines, state["total_clean"], state["total_discarded"])
+    state["applied"].append(batch)
+    return True
+
+
+def main():
+    p = argparse.ArgumentParser(description="Stato giornaliero incrementale")
+    sub = p.add_subparsers(dest='cmd')
+    p_pending = sub.add_parser('pending')
+    p_pending.add_argument('--state', required=True)
+    p_pending.add_argument('dirs', nargs='*')
+    p_merge = sub.add_parser('merge')
+    p_merge.add_argument('--state', required=True)
+    p_merge.add_argument('--batch', required=True)
+    p_render = sub.add_parser('render')
+    p_render.add_argument('--state', required=True)
+    p_render.add_argument('--daily', required=True)
+    p_render.add_argument('--aggregate', required=True)
+    args = p.parse_args()
+
+    state = load_state(args.state)
+
+    if args.cmd == 'pending':
+        for d in pending_batches(state, args.dirs):
+            print(d)
+
+    elif args.cmd == 'merge':
+        if merge_batch(state, args.batch, sys.stdin):
+            save_state(args.state, state)
+
+    elif args.cmd == 'render':
+        if not state["applied"]:
+            return  # Nessun batch oggi: non si pubblica nulla
+        with open(args.aggregate, 'w') as f:
+            f.write(format_aggregate(state["total_clean"], state["total_discarded"]) + '\n')
+        with open(args.daily, 'w') as f:
+            for line in format_daily(state["sensors"]):
+                f.write(line + '\n')
+
+    else:
+        p.print_help()
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
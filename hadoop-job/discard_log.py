@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+discard_log.py - Contatore degli scarti come log di delta append-only
+
+Layout su HDFS:
+  /models/discard_stats.json               snapshot compattato
+      {"total": N, "watermarks": {producer_id: {"seq": S, "ts": epoch}}}
+  /models/discard_deltas/delta_<producer>_<seq>.json
+      {"producer": producer_id, "seq": S, "count": K, "ts": epoch}
+
+Ogni producer crea file nuovi (nessuna lettura prima della scrittura,
+nessun append), con seq crescente per producer_id; un delta non confermato
+si riscrive allo stesso percorso con lo stesso seq e conteggio, quindi
+resta un solo file per seq. La compattazione
+(discard_log.py eseguito dal batch job) somma i delta nello snapshot e
+registra per ogni producer il seq piu' alto incluso (watermark); solo
+DOPO aver scritto lo snapshot cancella i delta compattati.
+
+Totale esatto = snapshot.total + delta con seq > watermark del producer.
+Un delta non ancora cancellato (crash a meta' compattazione) resta sotto
+il watermark e non viene contato due volte.
+
+Compatibile Python 3.5 (usato anche dal batch job).
+"""
+
+import sys
+import json
+import time
+
+DELTA_PREFIX = 'delta_'
+WATERMARK_RETENTION = 86400  # Watermark di producer inattivi da piu' di 1 giorno
+
+
+def delta_name(producer_id, seq):
+    return '{}{}_{:012d}.json'.format(DELTA_PREFIX, producer_id, seq)
+
+
+def make_delta(producer_id, seq, count, ts=None):
+    return json.dumps({"producer": producer_id, "seq": seq, "count": count,
+                       "ts": int(ts if ts is not None else time.time())}) + '\n'
+
+
+def parse_snapshot(text):
+    """Accetta anche il vecchio formato {"total": N}."""
+    snapshot = {"total": 0, "watermarks": {}}
+    if text and text.strip():
+        data = json.loads(text)
+        snapshot["total"] = int(data.get("total", 0))
+        snapshot["watermarks"] = dict(data.get("watermarks", {}))
+    return snapshot
+
+
+def parse_delta(text):
+    try:
+        d = json.loads(text)
+        return {"producer": str(d["producer"]), "seq": int(d["seq"]),
+                "count": int(d["count"]), "ts": int(d.get("ts", 0))}
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _pending(snapshot, deltas):
+    """Delta non ancora inclusi nello snapshot, senza duplicati (producer, seq)."""
+    watermarks = snapshot["watermarks"]
+    unique = {}
+    for d in deltas:
+        if d is None: continue
+        if d["seq"] > watermarks.get(d["producer"], {}).get("seq", 0):
+            unique[(d["producer"], d["seq"])] = d
+    return list(unique.values())
+
+
+def current_total(snapshot, deltas):
+    """Totale esatto letto dai consumer: snapshot + delta pendenti."""
+    return snapshot["total"] + sum(d["count"] for d in _pending(snapshot, deltas))
+
+
+def fold(snapshot, deltas, now=None):
+    """Ritorna il nuovo snapshot con i delta pendenti inclusi."""
+    now = int(now if now is not None else time.time())
+    pending = _pending(snapshot, deltas)
+
+    watermarks = dict(snapshot["watermarks"])
+    total = snapshot["total"]
+    for d in pending:
+        total += d["count"]
+        wm = watermarks.get(d["producer"], {"seq": 0})
+        if d["seq"] > wm["seq"]:
+            watermarks[d["producer"]] = {"seq": d["seq"], "ts": now}
+
+    active = set(d["producer"] for d in deltas if d)
+    watermarks = dict((p, wm) for p, wm in watermarks.items()
+                      if p in active or now - wm.get("ts", now) < WATERMARK_RETENTION)
+
+    return {"total": total, "watermarks": watermarks}
+
+
+def main():
+    """
+    Compattazione da stdin: righe snapshot ({"total": ...}) e righe delta
+    ({"producer": ...}) in qualsiasi ordine. Stampa il nuovo snapshot.
+    """
+    snapshot_lines = []
+    deltas = []
+    for line in sys.stdin:
+        line = line.strip()
+        if not line: continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None  # Riga illeggibile: trattata come snapshot, la compattazione fallisce
+        if isinstance(record, dict) and "producer" in record:
+            deltas.append(parse_delta(line))
+        else:
+            snapshot_lines.append(line)
+
+    snapshot = parse_snapshot(snapshot_lines[-1] if snapshot_lines else '')
+    print(json.dumps(fold(snapshot, deltas)))
+
+
+if __name__ == "__main__":
+    main()
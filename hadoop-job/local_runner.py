@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+local_runner.py - Esecuzione locale del job micro-batch (senza YARN)
+
+Per i micro-batch piccoli l'avvio di JVM e YARN costa piu' del calcolo:
+qui mapper, shuffle e reducer girano nel processo stesso, con la stessa
+logica dei file del job Streaming (mapper.Aggregator, partials.Partial,
+reducer.format_output).
+
+Input grande: le righe si dividono a blocchi su un pool di processi, ogni
+blocco produce i suoi parziali e il processo principale li fonde (il
+combiner). Grazie all'aggregazione nel mapper lo shuffle e' O(chiavi):
+basta un ordinamento in memoria, non serve un sort esterno.
+
+Output con lo stesso layout del job Hadoop: DIR/part-NNNNN (un file per
+reducer, chiavi ordinate, ogni sensore in un solo file) e DIR/_SUCCESS
+scritto per ultimo.
+
+Uso: hdfs dfs -cat FILE... | local_runner.py --output DIR [--reducers N]
+     [--model model.json] [--workers W]
+
+Compatibile Python 3.5 (gira nel container Hadoop).
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import zlib
+from itertools import islice
+
+from mapper import Aggregator
+from partials import Partial, load_model
+from reducer import format_output
+
+CHUNK_LINES = 50000      # Righe per blocco del pool
+POOL_MIN_CHUNKS = 2      # Sotto questa soglia il pool non conviene
+
+_model = None
+
+
+def _init_worker(model):
+    global _model
+    _model = model
+
+
+def _map_chunk(lines):
+    """Parziali serializzati di un blocco (girano nel worker del pool)."""
+    aggregator = Aggregator(_model).add_lines(lines)
+    return [(key, p.to_value()) for key, p in aggregator.partials.items()]
+
+
+def partition(key, reducers):
+    """Reducer della chiave: si partiziona sul solo sensore, come nel job Streaming."""
+    return zlib.crc32(key.split('-', 1)[0].encode('utf-8')) % reducers
+
+
+def run(lines, model, workers=1):
+    """{chiave: Partial} di tutto l'input."""
+    chunks = iter(lambda: list(islice(lines, CHUNK_LINES)), [])
+    first = [c for c in islice(chunks, POOL_MIN_CHUNKS)]
+
+    if workers <= 1 or len(first) < POOL_MIN_CHUNKS:
+        aggregator = Aggregator(model)
+        for chunk in first:
+            aggregator.add_lines(chunk)
+        for chunk in chunks:
+            aggregator.add_lines(chunk)
+        return aggregator.partials
+
+    merged = {}
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(model,))
+    try:
+        def all_chunks():
+            for chunk in first:
+                yield chunk
+            for chunk in chunks:
+                yield chunk
+
+        # imap (ordinato): i blocchi si fondono nell'ordine dell'input, che decide le parita' di timestamp
+        for partials in pool.imap(_map_chunk, all_chunks()):
+            for key, value in partials:
+                partial = Partial.from_value(value)
+                if key in merged:
+                    merged[key].merge(partial)
+                else:
+                    merged[key] = partial
+    finally:
+        pool.close()
+        pool.join()
+    return merged
+
+
+def write_output(partials, output_dir, reducers):
+    os.makedirs(output_dir)
+    by_part = [[] for _ in range(reducers)]
+    for key in partials:
+        by_part[partition(key, reducers)].append(key)
+
+    for i, keys in enumerate(by_part):
+        with open(os.path.join(output_dir, 'part-{:05d}'.format(i)), 'w') as f:
+            for key in sorted(keys):
+                partial = partials[key]
+                if partial.count == 0:
+                    print("Dati scartati per {}: Totali={}, Puliti=0".format(key, partial.total), file=sys.stderr)
+                f.write(format_output(key, partial) + '\n')
+
+    # Per ultimo, come Hadoop: chi legge considera completo solo un output con _SUCCESS
+    open(os.path.join(output_dir, '_SUCCESS'), 'w').close()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Job micro-batch eseguito in locale")
+    p.add_argument('--output', required=True, help="Directory di output (non deve esistere)")
+    p.add_argument('--reducers', type=int, default=1)
+    p.add_argument('--model', default='model.json')
+    p.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    args = p.parse_args()
+
+    try:
+        model = load_model(args.model)
+    except Exception as e:
+        print("ATTENZIONE: {} non disponibile ({}). Dati non puliti.".format(args.model, e), file=sys.stderr)
+        model = {}
+
+    partials = run(sys.stdin, model, args.workers)
+    write_output(partials, args.output, max(1, args.reducers))
+
+
+if __name__ == "__main__":
+    main()
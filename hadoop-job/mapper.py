@@ -2,49 +2,102 @@
 """
 mapper.py - Versione Semplificata
 Accetta TUTTI i dati in input senza filtri temporali.
+Legge sia i batch JSONL (archivi vecchi) sia i blocchi colonnari IOTC.
+
+Aggregazione in memoria: applica il filtro del modello (model.json) e
+accumula un parziale per chiave sensore-data, emesso a fine input
+(vedi partials.py). Lo shuffle trasporta O(chiavi) righe, non O(trade).
 """
 import sys
-import json
-from datetime import datetime
 
-def main():
-    for line in sys.stdin:
-        try:
-            line = line.strip()
-            if not line: continue
-            
-            data = json.loads(line)
-            
-            # Estrazione dati base
-            sensor_id = data.get("sensor_id")
-            temp = data.get("temp")
-            timestamp_str = data.get("timestamp")
-
-            if sensor_id and temp is not None and timestamp_str:
-                # Parsing minimale per estrarre la data
-                # Supporta sia con che senza microsecondi
-                if '.' in timestamp_str:
-                    dt = datetime.strptime(timestamp_str, "%Y-%m-%dT%H:%M:%S.%f")
-                else:
-                    dt = datetime.strptime(timestamp_str, "%Y-%m-%dT%H:%M:%S")
-                
-                # UNIX Timestamp per ordinamento
-                timestamp_unix = int(dt.timestamp())
-                
-                # Data per la chiave (YYYY-MM-DD)
-                date_str = dt.strftime('%Y-%m-%d')
-                
-                # Chiave composta per il partizionamento
-                output_key = "{}-{}".format(sensor_id, date_str)
+import batch_format
+import codec
+from partials import Partial, bounds_for, load_model
+
+class Aggregator(object):
+    """Parziali per chiave "sensore-data" (usato anche da local_runner.py)."""
+
+    def __init__(self, model):
+        self.model = model
+        self.partials = {}  # "sensore-data" -> Partial
+        self.bounds_cache = {}
+        self.date_cache = {}
+
+    def add_point(self, sensor_id, date_str, temp, ts):
+        key = "{}-{}".format(sensor_id, date_str)
+        partial = self.partials.get(key)
+        if partial is None:
+            partial = self.partials[key] = Partial()
+
+        if sensor_id not in self.bounds_cache:
+            self.bounds_cache[sensor_id] = bounds_for(self.model, sensor_id)
+        bounds = self.bounds_cache[sensor_id]
+        if bounds and (temp < bounds[0] or temp > bounds[1]):
+            partial.add_discarded()
+        else:
+            partial.add(temp, ts)
+
+    def add_block(self, line):
+        """
+        Aggrega i punti di un blocco IOTC.
+        Il timestamp e' gia' un intero epoch (microsecondi): niente strptime per riga.
+        """
+        date_cache = self.date_cache
+        for sensor_id, ts_us, temp, _source in batch_format.iter_block(line):
+            day = ts_us // batch_format.US_PER_DAY
+            date_str = date_cache.get(day)
+            if date_str is None:
+                date_str = batch_format.us_to_datetime(ts_us).strftime('%Y-%m-%d')
+                date_cache[day] = date_str
+
+            self.add_point(sensor_id, date_str, float(temp), ts_us)
+
+    def add_lines(self, lines):
+        for line in lines:
+            try:
+                line = line.strip()
+                if not line: continue
+
+                # Blocco colonnare compresso
+                if batch_format.is_block(line):
+                    self.add_block(line)
+                    continue
                 
-                # Valore: Temp + Timestamp
-                output_value = "{}|{}".format(float(temp), timestamp_unix)
+                data = codec.loads(line)
                 
-                print("{}\t{}".format(output_key, output_value))
+                # Estrazione dati base
+                sensor_id = data.get("sensor_id")
+                temp = data.get("temp")
+                timestamp_str = data.get("timestamp")
+
+                if sensor_id and temp is not None and timestamp_str:
+                    # Parser a layout fisso (con o senza microsecondi), cache per data
+                    # Epoch UTC in microsecondi per open/close (come i blocchi IOTC)
+                    ts_us = codec.iso_to_us(timestamp_str)
+                    
+                    # Data per la chiave (YYYY-MM-DD): gia' nel prefisso del timestamp
+                    date_str = timestamp_str[:10]
+                    
+                    # Chiave composta per il partizionamento: sensore-data
+                    self.add_point(sensor_id, date_str, float(temp), ts_us)
+
+            except Exception:
+                # Ignora righe malformate
+                pass
+        return self
+
+def main():
+    try:
+        anomaly_model = load_model()
+    except Exception as e:
+        print("ATTENZIONE: model.json non disponibile ({}). Dati non puliti.".format(e), file=sys.stderr)
+        anomaly_model = {}
+
+    aggregator = Aggregator(anomaly_model).add_lines(sys.stdin)
 
-        except Exception:
-            # Ignora righe malformate
-            pass
+    # Un parziale per chiave
+    for key, partial in aggregator.partials.items():
+        print("{}\t{}".format(key, partial.to_value()))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+partials.py - Stato parziale fondibile per chiave sensore-data
+
+Usato da mapper (aggregazione in memoria), combiner e reducer: lo shuffle
+trasporta un parziale per chiave e per map task invece di un punto per trade.
+
+Un parziale contiene: conteggio, somma, M2 (somma dei quadrati degli scarti
+dalla media, fusa con la formula di Chan: stabile anche con prezzi ~1e5),
+min, max, primo e ultimo prezzo con i loro timestamp (epoch in
+microsecondi, come nei blocchi IOTC), scartati e totali.
+
+Formato sulla riga (valore dopo il TAB):
+  P|count|sum|m2|min|max|first_ts|first|last_ts|last|discarded|total
+
+Le stesse statistiche sufficienti escono dal reducer nel campo "stats"
+del JSON ({"n", "sum", "m2", "min", "max", "first_ts", "first", "last_ts",
+"last", "discarded", "total"}): unify_batches, aggregate_stats e ogni
+rollup su piu' giorni le fondono con `merge_stats`, in modo esatto e in
+qualsiasi ordine. Solo a parita' di timestamp al microsecondo decide
+l'ordine di ingresso, come in `add`: l'apertura resta del parziale
+arrivato prima, la chiusura passa a quello arrivato dopo.
+Timestamp in secondi (stati e punti grezzi precedenti ai microsecondi)
+vengono convertiti alla lettura (`ts_to_us`).
+Compatibile Python 3.5 (gira nei container Hadoop).
+"""
+
+import math
+
+import codec
+
+PREFIX = 'P|'
+STD_DEV_MIN = 0.0001  # Sotto questa soglia il modello non filtra
+LEGACY_TS_LIMIT = 10 ** 11  # Sotto: epoch in secondi (in microsecondi e' il 2 gennaio 1970)
+
+
+def ts_to_us(ts):
+    """Timestamp in microsecondi; accetta anche l'epoch in secondi del formato precedente."""
+    ts = int(ts)
+    return ts if ts >= LEGACY_TS_LIMIT else ts * 1000000
+
+
+def load_model(path='model.json'):
+    """Modello di pulizia {sensor_id: {mean, std_dev}}; {} se assente."""
+    with open(path, 'r') as f:
+        return codec.loads(f.read())
+
+
+def bounds_for(model, sensor_id):
+    """(lower, upper) a 3 sigma, oppure None se il sensore non va filtrato."""
+    params = model.get(sensor_id)
+    if not params:
+        return None
+    std_dev = params['std_dev']
+    if std_dev > STD_DEV_MIN:
+        return (params['mean'] - 3 * std_dev, params['mean'] + 3 * std_dev)
+    return None
+
+
+class Partial(object):
+    __slots__ = ('count', 'sum', 'm2', 'min', 'max', 'first_ts', 'first', 'last_ts', 'last',
+                 'discarded', 'total')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.first_ts = None
+        self.first = None
+        self.last_ts = None
+        self.last = None
+        self.discarded = 0
+        self.total = 0
+
+    # --- Aggiornamento ---
+    def add(self, temp, ts):
+        """Aggiunge un punto pulito (Welford)."""
+        self.total += 1
+        self.count += 1
+        if self.count == 1:
+            self.sum = temp
+            self.m2 = 0.0
+            self.min = self.max = temp
+            self.first_ts = self.last_ts = ts
+            self.first = self.last = temp
+            return
+        old_mean = self.sum / (self.count - 1)
+        self.sum += temp
+        self.m2 += (temp - old_mean) * (temp - self.sum / self.count)
+        if temp < self.min: self.min = temp
+        if temp > self.max: self.max = temp
+        if ts < self.first_ts:
+            self.first_ts, self.first = ts, temp
+        if ts >= self.last_ts:
+            self.last_ts, self.last = ts, temp
+
+    def add_discarded(self):
+        self.total += 1
+        self.discarded += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.discarded += other.discarded
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            for f in ('count', 'sum', 'm2', 'min', 'max', 'first_ts', 'first', 'last_ts', 'last'):
+                setattr(self, f, getattr(other, f))
+            return self
+        n_a, n_b = self.count, other.count
+        delta = other.sum / n_b - self.sum / n_a
+        self.m2 += other.m2 + delta * delta * n_a * n_b / (n_a + n_b)
+        self.count = n_a + n_b
+        self.sum += other.sum
+        if other.min < self.min: self.min = other.min
+        if other.max > self.max: self.max = other.max
+        # Parita' di timestamp: ordine di ingresso, come in add()
+        if other.first_ts < self.first_ts:
+            self.first_ts, self.first = other.first_ts, other.first
+        if other.last_ts >= self.last_ts:
+            self.last_ts, self.last = other.last_ts, other.last
+        return self
+
+    # --- Serializzazione ---
+    def to_value(self):
+        if self.count == 0:
+            return "{}0|0|0|||||||{}|{}".format(PREFIX, self.discarded, self.total)
+        return "{}{}|{!r}|{!r}|{!r}|{!r}|{}|{!r}|{}|{!r}|{}|{}".format(
+            PREFIX, self.count, self.sum, self.m2, self.min, self.max,
+            self.first_ts, self.first, self.last_ts, self.last, self.discarded, self.total)
+
+    @classmethod
+    def from_value(cls, value):
+        f = value[len(PREFIX):].split('|')
+        p = cls()
+        p.count = int(f[0])
+        p.discarded = int(f[9])
+        p.total = int(f[10])
+        if p.count:
+            p.sum, p.m2, p.min, p.max = float(f[1]), float(f[2]), float(f[3]), float(f[4])
+            p.first_ts, p.first = ts_to_us(f[5]), float(f[6])
+            p.last_ts, p.last = ts_to_us(f[7]), float(f[8])
+        return p
+
+    def to_stats(self):
+        """Statistiche sufficienti in forma di dict (campo "stats" del reducer)."""
+        return {"n": self.count, "sum": self.sum, "m2": self.m2, "min": self.min, "max": self.max,
+                "first_ts": self.first_ts, "first": self.first, "last_ts": self.last_ts,
+                "last": self.last, "discarded": self.discarded, "total": self.total}
+
+    @classmethod
+    def from_stats(cls, d):
+        p = cls()
+        p.count = int(d["n"])
+        p.discarded = int(d.get("discarded", 0))
+        p.total = int(d.get("total", p.count + p.discarded))
+        if p.count:
+            p.sum, p.m2 = float(d["sum"]), float(d["m2"])
+            p.min, p.max = float(d["min"]), float(d["max"])
+            p.first_ts, p.first = ts_to_us(d["first_ts"]), float(d["first"])
+            p.last_ts, p.last = ts_to_us(d["last_ts"]), float(d["last"])
+        return p
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def std_dev(self):
+        """Deviazione standard campionaria (0 con un solo punto, None senza punti)."""
+        if self.count == 0:
+            return None
+        return math.sqrt(max(0.0, self.m2) / (self.count - 1)) if self.count > 1 else 0
+
+    # --- Metriche finali (stesso output del reducer a punti) ---
+    def metrics(self):
+        total_count = self.total
+        discarded_count = self.discarded
+        if self.count == 0:
+            return {
+                "open": None,
+                "close": None,
+                "min": None,
+                "max": None,
+                "count": 0,
+                "total_count": total_count,
+                "discarded_count": discarded_count,
+                "discarded_pct": round((discarded_count / total_count) * 100, 2) if total_count > 0 else 0,
+                "daily_change": None,
+                "daily_change_pct": None,
+                "range_pct": None,
+                "volatility": None,
+                "trend": 0
+            }
+
+        open_price, close_price = self.first, self.last
+        count = self.count
+        discarded_pct = (discarded_count / total_count) * 100 if total_count > 0 else 0
+        daily_change = close_price - open_price
+        daily_change_pct = (daily_change / open_price) * 100 if open_price > 0 else 0
+        range_pct = ((self.max - self.min) / open_price) * 100 if open_price > 0 else 0
+        volatility = self.std_dev()
+
+        trend = 0
+        if daily_change > 0: trend = 1
+        elif daily_change < 0: trend = -1
+
+        return {
+            "open": round(open_price, 2),
+            "close": round(close_price, 2),
+            "min": round(self.min, 2),
+            "max": round(self.max, 2),
+            "count": count,
+            "total_count": total_count,
+            "discarded_count": discarded_count,
+            "discarded_pct": discarded_pct,
+            "daily_change": round(daily_change, 2),
+            "daily_change_pct": round(daily_change_pct, 2),
+            "range_pct": round(range_pct, 2),
+            "volatility": round(volatility, 2),
+            "trend": trend
+        }
+
+
+def merge_stats(stats_list):
+    """Fonde una sequenza di dict "stats" in un Partial, nell'ordine dato (conta solo a parita' di timestamp)."""
+    total = Partial()
+    for d in stats_list:
+        total.merge(Partial.from_stats(d))
+    return total
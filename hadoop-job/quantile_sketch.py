@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+quantile_sketch.py - Sketch dei quantili fondibile (stile t-digest)
+
+Il digest e' una lista di centroidi [media, conteggio, M2] ordinati per
+media. Ogni centroide porta anche i momenti (M2 = somma dei quadrati
+degli scarti, fusa con la formula di Chan), quindi dallo stesso digest si
+ricavano sia i quantili sia media e deviazione standard dei soli valori
+dentro un intervallo (il filtro IQR del training).
+
+La dimensione di un centroide e' limitata da 4*n*q*(1-q)/compression:
+centroidi piccoli sulle code, grandi al centro. Con pochi punti
+(n <~ compression/2) restano tutti singoli e i risultati sono esatti.
+Due digest si fondono in qualsiasi ordine.
+
+Compatibile Python 3.5 (gira nel container Hadoop).
+"""
+
+COMPRESSION = 100
+
+
+def _combine(a, b):
+    """Fonde due centroidi [media, conteggio, M2] (Chan)."""
+    n = a[1] + b[1]
+    delta = b[0] - a[0]
+    mean = a[0] + delta * b[1] / n
+    m2 = a[2] + b[2] + delta * delta * a[1] * b[1] / n
+    return [mean, n, m2]
+
+
+class Digest(object):
+    __slots__ = ('compression', 'centroids', 'count')
+
+    def __init__(self, centroids=None, compression=COMPRESSION):
+        self.compression = compression
+        self.centroids = centroids or []
+        self.count = sum(c[1] for c in self.centroids)
+
+    @classmethod
+    def from_values(cls, values, compression=COMPRESSION):
+        d = cls([[float(v), 1, 0.0] for v in values], compression)
+        d._compress()
+        return d
+
+    def merge(self, other):
+        if other.count:
+            self.centroids = self.centroids + other.centroids
+            self.count += other.count
+            self._compress()
+        return self
+
+    def _compress(self):
+        n = float(self.count)
+        out = []
+        before = 0  # Conteggio a sinistra dell'ultimo centroide di out
+        for c in sorted(self.centroids, key=lambda c: c[0]):
+            if out:
+                last = out[-1]
+                size = last[1] + c[1]
+                q = (before + size / 2.0) / n
+                if size <= max(1.0, 4 * n * q * (1 - q) / self.compression):
+                    out[-1] = _combine(last, c)
+                    continue
+                before += last[1]
+            out.append(list(c))
+        self.centroids = out
+
+    # --- Interrogazioni ---
+    def quantile(self, q):
+        """Valore al quantile q; con centroidi singoli e' l'elemento int(n*q) dei valori ordinati."""
+        cs = self.centroids
+        if not cs:
+            return None
+        target = q * self.count
+        cum = 0
+        for i, (mean, count, _m2) in enumerate(cs):
+            if target < cum + count:
+                if count == 1:
+                    return mean
+                # Il centroide copre l'intervallo tra i punti medi con i vicini
+                lo = cs[i - 1][0] if i > 0 else mean
+                hi = cs[i + 1][0] if i + 1 < len(cs) else mean
+                left, right = (lo + mean) / 2.0, (mean + hi) / 2.0
+                return left + (right - left) * (target - cum) / count
+            cum += count
+        return cs[-1][0]
+
+    def moments(self, lower=None, upper=None):
+        """(conteggio, media, M2) dei centroidi con media in [lower, upper] (tutti se None)."""
+        acc = None
+        for c in self.centroids:
+            if lower is not None and c[0] < lower: continue
+            if upper is not None and c[0] > upper: continue
+            acc = list(c) if acc is None else _combine(acc, c)
+        return (acc[1], acc[0], acc[2]) if acc else (0, 0.0, 0.0)
+
+    # --- Serializzazione ---
+    def to_list(self):
+        return self.centroids
+
+    @classmethod
+    def from_list(cls, centroids, compression=COMPRESSION):
+        return cls([[float(m), int(c), float(m2)] for m, c, m2 in centroids], compression)
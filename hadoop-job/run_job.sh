@@ -13,89 +13,302 @@ ARCHIVE_DIR_BASE="/iot-data/archive"
 INCREMENTAL_OUT="/iot-output/incremental"
 DAILY_SUMMARY_DIR="/iot-stats/daily-summary"
 AGGREGATE_STATS_DIR="/iot-stats/daily-aggregate"
+# Stato giornaliero incrementale per sensore (daily_state.py)
+DAILY_STATE_DIR="/iot-stats/daily-state"
+DAILY_STATE_LOCAL="/tmp/daily_state.json"
 
 MODEL_FILE_HDFS="/models/model.json"
 MODEL_LOCAL="/app/model.json"
+# Marker di versione letto dai producer (poll economico)
+MODEL_VERSION_HDFS="/models/model.version"
+MODEL_VERSION_LOCAL="/tmp/model.version"
+MODEL_SHA_LOCAL="/tmp/model.sha256"
+# Stato del training incrementale (digest per sensore e bucket temporale)
+TRAIN_STATE_HDFS="/models/train_state.json"
+TRAIN_STATE_LOCAL="/tmp/train_state.json"
+
+# Contatore scarti: snapshot + delta append-only dei producer
+DISCARD_SNAPSHOT_HDFS="/models/discard_stats.json"
+DISCARD_DELTA_DIR="/models/discard_deltas"
+
+# Batch del producer: JSONL (batch_*.jsonl) o colonnari IOTC (batch_*.iotc)
+BATCH_GLOB="batch_*"
+# Archivio: batch non ancora compattati + segmenti gzip (compact_archive.py), letti con -text
+ARCHIVE_GLOB="{batch_*,segment_*.gz}"
+COMPACT_INTERVAL=900
+COMPACT_MARKER_LOCAL="/tmp/last_compaction"
+
+# Motore del job: 'auto' = locale (local_runner.py) sotto LOCAL_MAX_BYTES di input, altrimenti YARN
+MR_ENGINE="${MR_ENGINE:-auto}"
+LOCAL_MAX_BYTES="${LOCAL_MAX_BYTES:-67108864}"
+LOCAL_OUT="/tmp/batch_local_out"
+
+# Reducer del job: 'auto' = uno per sensore del modello, fino a MR_REDUCERS_MAX
+MR_REDUCERS="${MR_REDUCERS:-auto}"
+MR_REDUCERS_MAX="${MR_REDUCERS_MAX:-8}"
 
 TODAY_DATE=$(date +%Y-%m-%d)
 YESTERDAY_DATE=$(date -d "yesterday" +%Y-%m-%d)
 CURRENT_TIME=$(date +%H-%M-%S)
+# Partizioni dell'archivio lette dal controllo dei replay e dalla compattazione
+ARCHIVE_PARTS="$ARCHIVE_DIR_BASE/date={$YESTERDAY_DATE,$TODAY_DATE}"
 
 log() { echo "$(date +'%Y-%m-%d %H:%M:%S') - $1"; }
 
 # --- 0. CHECK MICRO-BATCH ---
-if ! $HDFS_CMD dfs -fs $HDFS_URI -test -e "$INCOMING_DIR/*.jsonl"; then
+if ! $HDFS_CMD dfs -fs $HDFS_URI -test -e "$INCOMING_DIR/$BATCH_GLOB"; then
     exit 0
 fi
 
 log "🚀 Avvio Micro-Batch $CURRENT_TIME su dati nuovi..."
 
-# --- FASE 1: TRAINING ---
+# --- FASE 1: TRAINING INCREMENTALE ---
+# Lo stato (digest per sensore e bucket di 5 min, train_model.py) vive su HDFS:
+# si fondono solo i file di incoming non ancora inclusi
+rm -f $TRAIN_STATE_LOCAL
+$HDFS_CMD dfs -fs $HDFS_URI -cat "$TRAIN_STATE_HDFS" > $TRAIN_STATE_LOCAL 2>/dev/null || \
+$HDFS_CMD dfs -fs $HDFS_URI -cat "$TRAIN_STATE_HDFS.tmp" > $TRAIN_STATE_LOCAL 2>/dev/null || \
+rm -f $TRAIN_STATE_LOCAL
+
+# Elenco fissato qui: training, job e archiviazione lavorano SOLO su questi file;
+# quelli arrivati dopo restano in incoming per il run successivo
+INCOMING_LS=$($HDFS_CMD dfs -fs $HDFS_URI -ls "$INCOMING_DIR/$BATCH_GLOB")
+
+# Batch gia' archiviati (singoli o in un segmento): il replay dello spool dopo un crash
+# del producer puo' ricaricarli in incoming. Si cancellano senza rielaborarli
+$HDFS_CMD dfs -fs $HDFS_URI -ls "$ARCHIVE_PARTS/*" 2>/dev/null | awk '{print $8}' | grep . > /tmp/archive_listing.txt
+$HDFS_CMD dfs -fs $HDFS_URI -cat "$ARCHIVE_PARTS/segment_*.idx.json" 2>/dev/null | \
+    python3 /app/compact_archive.py archived --listing /tmp/archive_listing.txt > /tmp/archived_batches.txt
+split_archived() {
+    echo "$INCOMING_LS" | awk -v list=/tmp/archived_batches.txt -v want="$1" '
+        BEGIN { while ((getline n < list) > 0) done[n] = 1 }
+        $8 != "" { n = $8; sub(/.*\//, "", n); if ((n in done) == want) print }'
+}
+REPLAYED_FILES=$(split_archived 1 | awk '{print $8}')
+if [ -n "$REPLAYED_FILES" ]; then
+    $HDFS_CMD dfs -fs $HDFS_URI -rm -skipTrash $REPLAYED_FILES > /dev/null
+    log "♻️ Batch gia' archiviati rimossi da incoming: $(echo $REPLAYED_FILES | wc -w)"
+fi
+INCOMING_LS=$(split_archived 0)
+
+INCOMING_FILES=$(echo "$INCOMING_LS" | awk '{print $8}' | grep .)
+INCOMING_BYTES=$(echo "$INCOMING_LS" | awk '{s += $5} END {print s + 0}')
+if [ -z "$INCOMING_FILES" ]; then
+    log "⚠️ Nessun batch nuovo in incoming, run saltato."
+    exit 0
+fi
+PENDING_FILES=$(python3 /app/train_model.py --state $TRAIN_STATE_LOCAL --pending $INCOMING_FILES)
+
 {
-  $HDFS_CMD dfs -fs $HDFS_URI -cat "$ARCHIVE_DIR_BASE/date=$YESTERDAY_DATE/*.jsonl" 2>/dev/null
-  $HDFS_CMD dfs -fs $HDFS_URI -cat "$ARCHIVE_DIR_BASE/date=$TODAY_DATE/*.jsonl" 2>/dev/null
-  $HDFS_CMD dfs -fs $HDFS_URI -cat "$INCOMING_DIR/*.jsonl" 2>/dev/null
-} | python3 /app/train_model.py > $MODEL_LOCAL
+  # Primo avvio (nessuno stato): si parte dall'archivio recente, una volta sola
+  if [ ! -s "$TRAIN_STATE_LOCAL" ]; then
+    $HDFS_CMD dfs -fs $HDFS_URI -text "$ARCHIVE_DIR_BASE/date=$YESTERDAY_DATE/$ARCHIVE_GLOB" 2>/dev/null
+    $HDFS_CMD dfs -fs $HDFS_URI -text "$ARCHIVE_DIR_BASE/date=$TODAY_DATE/$ARCHIVE_GLOB" 2>/dev/null
+  fi
+  if [ -n "$PENDING_FILES" ]; then
+    $HDFS_CMD dfs -fs $HDFS_URI -cat $PENDING_FILES
+  fi
+} | python3 /app/train_model.py --state $TRAIN_STATE_LOCAL --applied $INCOMING_FILES > $MODEL_LOCAL.new
+TRAIN_RC="${PIPESTATUS[0]}${PIPESTATUS[1]}"
 
-if [ -s "$MODEL_LOCAL" ]; then
-    $HDFS_CMD dfs -fs $HDFS_URI -put -f $MODEL_LOCAL $MODEL_FILE_HDFS
+# Stato e modello si pubblicano solo se la lettura dei file nuovi e' andata a buon fine;
+# altrimenti il job usa il modello del run precedente
+TRAIN_OK=0
+if [ "$TRAIN_RC" = "00" ] && [ -s "$TRAIN_STATE_LOCAL" ] && [ -s "$MODEL_LOCAL.new" ]; then
+    TRAIN_OK=1
+    mv -f $MODEL_LOCAL.new $MODEL_LOCAL
+    $HDFS_CMD dfs -fs $HDFS_URI -put -f $TRAIN_STATE_LOCAL "$TRAIN_STATE_HDFS.tmp" && \
+    $HDFS_CMD dfs -fs $HDFS_URI -rm -f -skipTrash "$TRAIN_STATE_HDFS" > /dev/null && \
+    $HDFS_CMD dfs -fs $HDFS_URI -mv "$TRAIN_STATE_HDFS.tmp" "$TRAIN_STATE_HDFS"
+else
+    rm -f $MODEL_LOCAL.new
+    log "⚠️ Training non completo (rc=$TRAIN_RC): stato e modello non pubblicati."
+fi
+
+if [ "$TRAIN_OK" = "1" ] && [ -s "$MODEL_LOCAL" ]; then
+    MODEL_SHA=$(sha256sum "$MODEL_LOCAL" | awk '{print $1}')
+
+    # Pubblica solo se il modello è cambiato (o se il marker su HDFS manca)
+    if [ "$MODEL_SHA" != "$(cat $MODEL_SHA_LOCAL 2>/dev/null)" ] || \
+       ! $HDFS_CMD dfs -fs $HDFS_URI -test -e "$MODEL_VERSION_HDFS"; then
+        # Prima il modello, poi il marker: il marker punta sempre a un modello completo
+        $HDFS_CMD dfs -fs $HDFS_URI -put -f $MODEL_LOCAL $MODEL_FILE_HDFS && \
+        echo "{\"version\": $(date +%s), \"sha256\": \"$MODEL_SHA\"}" > $MODEL_VERSION_LOCAL && \
+        $HDFS_CMD dfs -fs $HDFS_URI -put -f $MODEL_VERSION_LOCAL $MODEL_VERSION_HDFS && \
+        echo "$MODEL_SHA" > $MODEL_SHA_LOCAL
+    fi
 fi
 
 # --- FASE 2: MAPREDUCE (SOLO SU INCOMING) ---
+# Il mapper filtra e aggrega in memoria, il combiner fonde i parziali: lo shuffle e' O(chiavi x map task)
 BATCH_OUTPUT_DIR="$INCREMENTAL_OUT/date=$TODAY_DATE/batch_$CURRENT_TIME"
 
-$HADOOP_CMD jar $HADOOP_HOME/share/hadoop/tools/lib/hadoop-streaming-*.jar \
-    -D mapred.job.name="MicroBatch $CURRENT_TIME" \
-    -D mapreduce.job.reduces=1 \
-    -fs $HDFS_URI \
-    -files /app/mapper.py,/app/reducer.py,$MODEL_LOCAL \
-    -mapper "python3 /app/mapper.py" \
-    -reducer "python3 /app/reducer.py" \
-    -input "$INCOMING_DIR/*.jsonl" \
-    -output "$BATCH_OUTPUT_DIR" > /dev/null 2>&1
-
-# --- VARIABILE PER TUTTI I RISULTATI DI OGGI ---
-ALL_BATCHES_RESULTS="$INCREMENTAL_OUT/date=$TODAY_DATE/*/part-00000"
-
-# --- FASE 3: UNIFICAZIONE METRICHE (FIXED) ---
-log "∑ Unificazione risultati giornalieri..."
+if [ "$MR_REDUCERS" = "auto" ]; then
+    NUM_REDUCERS=$(python3 -c "import json,sys; print(len(json.load(open(sys.argv[1]))))" "$MODEL_LOCAL" 2>/dev/null)
+    [ -n "$NUM_REDUCERS" ] && [ "$NUM_REDUCERS" -gt 0 ] || NUM_REDUCERS=1
+    [ "$NUM_REDUCERS" -gt "$MR_REDUCERS_MAX" ] && NUM_REDUCERS=$MR_REDUCERS_MAX
+else
+    NUM_REDUCERS=$MR_REDUCERS
+fi
+
+ENGINE=$MR_ENGINE
+if [ "$ENGINE" = "auto" ]; then
+    if [ "$INCOMING_BYTES" -le "$LOCAL_MAX_BYTES" ]; then ENGINE=local; else ENGINE=yarn; fi
+fi
+
+if [ "$ENGINE" = "local" ]; then
+    # Stesso job nel processo locale: niente avvio di YARN. L'output si carica in
+    # una cartella temporanea e poi si rinomina, cosi' _SUCCESS compare solo a output completo
+    log "⚙️ Job locale ($INCOMING_BYTES byte, $NUM_REDUCERS reducer)"
+    BATCH_TMP_DIR="$INCREMENTAL_OUT/_tmp/batch_$CURRENT_TIME"
+    rm -rf $LOCAL_OUT
+    # pipefail: una lettura interrotta non deve produrre un output "completo"
+    ( set -o pipefail; $HDFS_CMD dfs -fs $HDFS_URI -cat $INCOMING_FILES | \
+        python3 /app/local_runner.py --model $MODEL_LOCAL --reducers $NUM_REDUCERS --output $LOCAL_OUT ) && \
+    $HDFS_CMD dfs -fs $HDFS_URI -mkdir -p "$INCREMENTAL_OUT/_tmp" "$INCREMENTAL_OUT/date=$TODAY_DATE" && \
+    $HDFS_CMD dfs -fs $HDFS_URI -put $LOCAL_OUT "$BATCH_TMP_DIR" && \
+    $HDFS_CMD dfs -fs $HDFS_URI -mv "$BATCH_TMP_DIR" "$BATCH_OUTPUT_DIR"
+else
+    # Chiave "SENSORE-YYYY-MM-DD": si partiziona sul primo campo (il sensore), cosi'
+    # ogni sensore finisce in un solo part file e resta in ordine di batch a valle
+    $HADOOP_CMD jar $HADOOP_HOME/share/hadoop/tools/lib/hadoop-streaming-*.jar \
+        -D mapred.job.name="MicroBatch $CURRENT_TIME" \
+        -D mapreduce.job.reduces=$NUM_REDUCERS \
+        -D mapreduce.map.output.key.field.separator=- \
+        -D mapreduce.partition.keypartitioner.options=-k1,1 \
+        -fs $HDFS_URI \
+        -files /app/mapper.py,/app/combiner.py,/app/reducer.py,/app/partials.py,/app/batch_format.py,/app/codec.py,$MODEL_LOCAL \
+        -mapper "python3 /app/mapper.py" \
+        -combiner "python3 /app/combiner.py" \
+        -reducer "python3 /app/reducer.py" \
+        -partitioner org.apache.hadoop.mapred.lib.KeyFieldBasedPartitioner \
+        -input "$(echo $INCOMING_FILES | tr ' ' ',')" \
+        -output "$BATCH_OUTPUT_DIR" > /dev/null 2>&1
+fi
+JOB_RC=$?
+
+# Job riuscito solo con _SUCCESS al suo posto: altrimenti i file restano in incoming
+# e il run successivo li rielabora (il training li ha gia' in "applied", non li rifonde)
+JOB_OK=0
+if [ "$JOB_RC" = "0" ] && $HDFS_CMD dfs -fs $HDFS_URI -test -e "$BATCH_OUTPUT_DIR/_SUCCESS"; then
+    JOB_OK=1
+else
+    log "❌ Job $ENGINE fallito (rc=$JOB_RC): i file restano in incoming per il prossimo run."
+fi
+
+# --- FASE 3: STATO GIORNALIERO INCREMENTALE ---
+# Si fondono nello stato solo i batch completati non ancora inclusi (di norma
+# quello appena prodotto); le statistiche del giorno si riscrivono dallo stato.
+log "∑ Aggiornamento stato giornaliero..."
+STATE_DIR_HDFS="$DAILY_STATE_DIR/date=$TODAY_DATE"
+STATE_HDFS="$STATE_DIR_HDFS/state.json"
+rm -f $DAILY_STATE_LOCAL /tmp/daily_unified.json /tmp/agg.json
+
+# Ultimo stato pubblicato; se il run precedente e' caduto tra rm e mv c'e' solo il .tmp
+$HDFS_CMD dfs -fs $HDFS_URI -cat "$STATE_HDFS" > $DAILY_STATE_LOCAL 2>/dev/null || \
+$HDFS_CMD dfs -fs $HDFS_URI -cat "$STATE_HDFS.tmp" > $DAILY_STATE_LOCAL 2>/dev/null || \
+rm -f $DAILY_STATE_LOCAL
+
+COMPLETED_BATCHES=$($HDFS_CMD dfs -fs $HDFS_URI -ls "$INCREMENTAL_OUT/date=$TODAY_DATE/*/_SUCCESS" 2>/dev/null | awk '{print $8}' | xargs -r -n1 dirname)
+STATE_CHANGED=0
+for dir in $(python3 /app/daily_state.py pending --state $DAILY_STATE_LOCAL $COMPLETED_BATCHES); do
+    # Prima tutto il batch su disco: una lettura interrotta non deve finire nello stato
+    $HDFS_CMD dfs -fs $HDFS_URI -cat "$dir/part-*" > /tmp/batch_parts.txt || break
+    python3 /app/daily_state.py merge --state $DAILY_STATE_LOCAL --batch "$(basename $dir)" < /tmp/batch_parts.txt || break
+    STATE_CHANGED=1
+done
+
+if [ "$STATE_CHANGED" = "1" ]; then
+    $HDFS_CMD dfs -fs $HDFS_URI -mkdir -p $STATE_DIR_HDFS
+    $HDFS_CMD dfs -fs $HDFS_URI -put -f $DAILY_STATE_LOCAL "$STATE_HDFS.tmp" && \
+    $HDFS_CMD dfs -fs $HDFS_URI -rm -f -skipTrash "$STATE_HDFS" > /dev/null && \
+    $HDFS_CMD dfs -fs $HDFS_URI -mv "$STATE_HDFS.tmp" "$STATE_HDFS"
+fi
+
+python3 /app/daily_state.py render --state $DAILY_STATE_LOCAL --daily /tmp/daily_unified.json --aggregate /tmp/agg.json
+
 SUMMARY_OUTPUT_PATH="$DAILY_SUMMARY_DIR/date=$TODAY_DATE"
 $HDFS_CMD dfs -fs $HDFS_URI -mkdir -p $SUMMARY_OUTPUT_PATH
 
-if $HDFS_CMD dfs -fs $HDFS_URI -test -e "$ALL_BATCHES_RESULTS"; then
-    # --- FIX IMPORTANTE: Scrittura diretta su file (No Variable Capture) ---
-    # Usiamo python3 -u per evitare buffering e > per scrivere su disco
-    $HDFS_CMD dfs -fs $HDFS_URI -cat "$ALL_BATCHES_RESULTS" | python3 -u /app/unify_batches.py > /tmp/daily_unified.json
-    
-    # Controlla se il file locale non è vuoto (-s)
-    if [ -s /tmp/daily_unified.json ]; then
-        $HDFS_CMD dfs -fs $HDFS_URI -put -f /tmp/daily_unified.json "$SUMMARY_OUTPUT_PATH/daily_stats.json"
-        log "✅ Daily Stats generate."
-    else
-        log "⚠️ Daily Stats vuote (Errore Python o Input vuoto)."
-    fi
+# Controlla se il file locale non è vuoto (-s)
+if [ -s /tmp/daily_unified.json ]; then
+    $HDFS_CMD dfs -fs $HDFS_URI -put -f /tmp/daily_unified.json "$SUMMARY_OUTPUT_PATH/daily_stats.json"
+    log "✅ Daily Stats generate."
+else
+    log "⚠️ Daily Stats vuote (Errore Python o Input vuoto)."
 fi
 
-# --- FASE 3.5: AGGREGAZIONE STATISTICHE (FIXED) ---
+# --- FASE 3.5: AGGREGAZIONE STATISTICHE ---
 STATS_OUTPUT_PATH="$AGGREGATE_STATS_DIR/date=$TODAY_DATE"
 $HDFS_CMD dfs -fs $HDFS_URI -mkdir -p $STATS_OUTPUT_PATH
 
-if $HDFS_CMD dfs -fs $HDFS_URI -test -e "$ALL_BATCHES_RESULTS"; then
-    # Anche qui, scrittura diretta
-    $HDFS_CMD dfs -fs $HDFS_URI -cat "$ALL_BATCHES_RESULTS" | python3 -u /app/aggregate_stats.py > /tmp/agg.json
-    
-    if [ -s /tmp/agg.json ]; then
-        $HDFS_CMD dfs -fs $HDFS_URI -put -f /tmp/agg.json "$STATS_OUTPUT_PATH/aggregate_stats.json"
-        log "✅ Aggregate Stats generate."
-    fi
+if [ -s /tmp/agg.json ]; then
+    $HDFS_CMD dfs -fs $HDFS_URI -put -f /tmp/agg.json "$STATS_OUTPUT_PATH/aggregate_stats.json"
+    log "✅ Aggregate Stats generate."
 fi
 
 # --- FASE 4: ARCHIVIAZIONE ---
 DEST_ARCHIVE="$ARCHIVE_DIR_BASE/date=$TODAY_DATE"
 $HDFS_CMD dfs -fs $HDFS_URI -mkdir -p $DEST_ARCHIVE
 
-for file in $($HDFS_CMD dfs -fs $HDFS_URI -ls "$INCOMING_DIR/*.jsonl" | awk '{print $8}'); do
-    $HDFS_CMD dfs -fs $HDFS_URI -mv "$file" "$DEST_ARCHIVE/"
-done
+# Solo i file elaborati dal job (elenco della FASE 1), in un solo comando;
+# se il job e' fallito restano in incoming
+if [ "$JOB_OK" = "1" ]; then
+    $HDFS_CMD dfs -fs $HDFS_URI -mv $INCOMING_FILES "$DEST_ARCHIVE/"
+fi
+
+# --- FASE 4.5: COMPATTAZIONE ARCHIVIO ---
+# Le ore chiuse di ieri/oggi diventano segmenti gzip con indice (al piu' ogni COMPACT_INTERVAL s)
+LAST_COMPACTION=$(cat $COMPACT_MARKER_LOCAL 2>/dev/null || echo 0)
+if [ $(( $(date +%s) - LAST_COMPACTION )) -ge $COMPACT_INTERVAL ]; then
+    $HDFS_CMD dfs -fs $HDFS_URI -ls "$ARCHIVE_PARTS/*" 2>/dev/null | awk '{print $8}' | grep . > /tmp/archive_listing.txt
+
+    $HDFS_CMD dfs -fs $HDFS_URI -cat "$ARCHIVE_PARTS/segment_*.idx.json" 2>/dev/null | \
+        python3 /app/compact_archive.py plan --listing /tmp/archive_listing.txt | \
+    while read -r action rest; do
+        case "$action" in
+            rm)
+                # Batch gia' in un segmento completo (run precedente caduto prima della cancellazione)
+                $HDFS_CMD dfs -fs $HDFS_URI -rm -skipTrash $rest > /dev/null
+                ;;
+            segment)
+                set -- $rest; seg_dir=$1; seg_name=$2; shift 2
+                # Indice, poi segmento con nome nascosto e rename, poi cancellazione dei batch
+                ( set -o pipefail; $HDFS_CMD dfs -fs $HDFS_URI -cat "$@" | \
+                    python3 /app/compact_archive.py write --segment /tmp/segment.gz --index /tmp/segment.idx.json \
+                        --path "$seg_dir/$seg_name" "$@" ) && \
+                $HDFS_CMD dfs -fs $HDFS_URI -put -f /tmp/segment.idx.json "$seg_dir/${seg_name%.gz}.idx.json" && \
+                $HDFS_CMD dfs -fs $HDFS_URI -put -f /tmp/segment.gz "$seg_dir/_$seg_name" && \
+                $HDFS_CMD dfs -fs $HDFS_URI -mv "$seg_dir/_$seg_name" "$seg_dir/$seg_name" && \
+                $HDFS_CMD dfs -fs $HDFS_URI -rm -skipTrash "$@" > /dev/null && \
+                log "🗜️ Segmento $seg_name ($# batch)"
+                ;;
+        esac
+    done
+    date +%s > $COMPACT_MARKER_LOCAL
+fi
+
+# --- FASE 5: COMPATTAZIONE DELTA SCARTI ---
+# Lista fissata PRIMA della lettura: i delta arrivati dopo restano pendenti
+DELTA_FILES=$($HDFS_CMD dfs -fs $HDFS_URI -ls "$DISCARD_DELTA_DIR/delta_*.json" 2>/dev/null | awk '{print $8}')
 
-log "✅ Micro-Batch completato e archiviato."
\ No newline at end of file
+if [ -n "$DELTA_FILES" ]; then
+    {
+      $HDFS_CMD dfs -fs $HDFS_URI -cat "$DISCARD_SNAPSHOT_HDFS" 2>/dev/null; echo
+      $HDFS_CMD dfs -fs $HDFS_URI -cat $DELTA_FILES
+    } | python3 /app/discard_log.py > /tmp/discard_stats.json
+
+    # Prima lo snapshot (con i watermark), poi la cancellazione dei delta inclusi
+    if [ -s /tmp/discard_stats.json ] && \
+       $HDFS_CMD dfs -fs $HDFS_URI -put -f /tmp/discard_stats.json "$DISCARD_SNAPSHOT_HDFS"; then
+        $HDFS_CMD dfs -fs $HDFS_URI -rm -skipTrash $DELTA_FILES > /dev/null
+        log "✅ Delta scarti compattati."
+    fi
+fi
+
+if [ "$JOB_OK" = "1" ]; then
+    log "✅ Micro-Batch completato e archiviato."
+else
+    log "⚠️ Micro-Batch non archiviato: i file si rielaborano al prossimo run."
+    exit 1
+fi
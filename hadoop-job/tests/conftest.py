@@ -0,0 +1,6 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Moduli del job importabili come dal working dir di Hadoop Streaming
+sys.path.insert(0, os.path.join(HERE, '..'))
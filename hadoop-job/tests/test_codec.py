@@ -0,0 +1,21 @@
+from datetime import datetime
+
+import pytest
+
+import codec
+from batch_format import datetime_to_us
+
+
+@pytest.mark.parametrize('ts', ['2024-02-29T23:59:59.999999', '2024-01-01T00:00:00', '1970-01-01T00:00:00.5'])
+def test_iso_to_us_matches_datetime(ts):
+    assert codec.iso_to_us(ts) == datetime_to_us(datetime.fromisoformat(ts))
+
+
+@pytest.mark.parametrize('ts', ['2024-13-45T00:00:00', '2024-02-30T00:00:00', '2023-02-29T00:00:00',
+                                '2024-00-10T00:00:00', '2024-01-01T24:00:00', '2024-01-01T00:60:00',
+                                '2024-01-01T00:00:60', '2024-01-01T-1:00:00', '+024-01-01T00:00:00',
+                                '2024-01-01T00:00:00.', '2024-01-01T00:00:00.12x', '2024-01-01 00:00:00'])
+def test_iso_to_us_rejects_invalid_timestamps(ts):
+    # Come strptime: il mapper scarta la riga invece di inventare un timestamp
+    with pytest.raises(ValueError):
+        codec.iso_to_us(ts)
@@ -0,0 +1,70 @@
+import copy
+
+from daily_state import load_state, merge_batch, new_state, pending_batches, save_state
+from partials import Partial
+from reducer import format_output
+from unify_batches import format_daily, merge_lines
+
+TS = 1700000000000000
+
+
+def batch_lines(points, discarded=0):
+    """Part file di un batch: una riga del reducer per sensore."""
+    lines = []
+    for sid, prices in sorted(points.items()):
+        p = Partial()
+        for i, price in enumerate(prices):
+            p.add(price, TS + i)
+        for _ in range(discarded):
+            p.add_discarded()
+        lines.append(format_output('{}-2024-01-01'.format(sid), p) + '\n')
+    return lines
+
+
+BATCHES = [
+    ('batch_10-00-00', batch_lines({'A1': [100.0, 101.0], 'B1': [5.0]})),
+    ('batch_10-01-00', batch_lines({'A1': [102.0, 99.0, 100.5]}, discarded=1)),
+    ('batch_10-02-00', batch_lines({'A1': [98.0], 'B1': [5.5, 6.0]})),
+]
+
+
+def test_remerging_an_applied_batch_is_a_noop():
+    state = new_state()
+    for name, lines in BATCHES:
+        assert merge_batch(state, name, lines)
+    before = copy.deepcopy(state)
+
+    for name, lines in BATCHES:
+        assert not merge_batch(state, name, lines)
+    assert state == before
+
+
+def test_incremental_state_equals_full_unify():
+    state = new_state()
+    for name, lines in BATCHES:
+        merge_batch(state, name, lines)
+
+    full = merge_lines({}, [l for _name, lines in BATCHES for l in lines])
+    assert list(format_daily(state["sensors"])) == list(format_daily(full))
+    assert state["applied"] == [name for name, _lines in BATCHES]
+
+
+def test_replay_after_restart(tmp_path):
+    path = str(tmp_path / 'state.json')
+    state = load_state(path)
+    assert state == new_state()
+    merge_batch(state, *BATCHES[0])
+    save_state(path, state)
+
+    # Riavvio a meta' giornata: il batch gia' fuso non si rifonde, i rimanenti si'
+    dirs = ['/iot-output/2024-01-01/' + name for name, _lines in reversed(BATCHES)]
+    state = load_state(path)
+    assert pending_batches(state, dirs) == sorted(dirs)[1:]
+    for name, lines in BATCHES:
+        merge_batch(state, name, lines)
+    save_state(path, state)
+
+    reference = new_state()
+    for name, lines in BATCHES:
+        merge_batch(reference, name, lines)
+    assert load_state(path) == reference
@@ -0,0 +1,108 @@
+import json
+import os
+import random
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+import batch_format
+import local_runner
+from partials import load_model
+
+JOB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MODEL = {"A1": {"mean": 100.0, "std_dev": 2.0}, "B1": {"mean": 50.0, "std_dev": 0.00001}}
+
+
+def make_input():
+    """Righe JSONL e blocchi IOTC su due giorni, con anomalie e timestamp ripetuti."""
+    rnd = random.Random(7)
+    start = datetime(2024, 1, 1, 23, 59)
+    rows = []
+    for i in range(600):
+        ts = start + timedelta(seconds=i // 4)  # Quattro punti per secondo: parita' al microsecondo
+        sid = ('A1', 'B1', 'C1')[i % 3]
+        temp = {'A1': 100.0, 'B1': 50.0, 'C1': 10.0}[sid] + rnd.uniform(-3, 3)
+        if i % 50 == 0:
+            temp *= 1.5  # Fuori dai 3 sigma di A1
+        rows.append((sid, batch_format.datetime_to_us(ts), temp, 'Binance'))
+
+    lines = []
+    for i in range(0, len(rows), 40):
+        chunk = rows[i:i + 40]
+        if (i // 40) % 2:
+            lines.append(batch_format.encode_block(chunk) + '\n')
+        else:
+            for sid, ts_us, temp, src in chunk:
+                lines.append(json.dumps({"sensor_id": sid, "temp": temp, "source": src,
+                                         "timestamp": batch_format.us_to_datetime(ts_us).isoformat()}) + '\n')
+    lines.append('riga malformata\n')
+    return lines
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    """Working dir del task: model.json accanto agli script, come nel job Streaming."""
+    with open(str(tmp_path / 'model.json'), 'w') as f:
+        json.dump(MODEL, f)
+    return tmp_path
+
+
+def run_script(name, lines, cwd, *args):
+    out = subprocess.run([sys.executable, os.path.join(JOB_DIR, name)] + list(args), input=''.join(lines),
+                         stdout=subprocess.PIPE, universal_newlines=True, check=True, cwd=str(cwd))
+    return out.stdout.splitlines(True)
+
+
+def streaming_job(chunks, cwd):
+    """mapper (un task per blocco) | shuffle | reducer."""
+    mapped = [l for chunk in chunks for l in run_script('mapper.py', chunk, cwd)]
+    # Shuffle: ordinamento stabile per chiave, i parziali della stessa chiave restano in ordine di map task
+    shuffled = sorted(mapped, key=lambda l: l.split('\t', 1)[0])
+    return run_script('reducer.py', shuffled, cwd)
+
+
+def read_output(output_dir):
+    parts = sorted(n for n in os.listdir(output_dir) if n.startswith('part-'))
+    by_part = []
+    for name in parts:
+        with open(os.path.join(output_dir, name)) as f:
+            by_part.append(f.readlines())
+    return by_part
+
+
+def test_cli_matches_mapper_sort_reducer(workdir):
+    lines = make_input()
+    output = str(workdir / 'out')
+    run_script('local_runner.py', lines, workdir, '--output', output, '--reducers', '3', '--workers', '1')
+
+    assert os.path.exists(os.path.join(output, '_SUCCESS'))
+    by_part = read_output(output)
+    assert len(by_part) == 3
+    for part in by_part:
+        keys = [l.split('\t', 1)[0] for l in part]
+        assert keys == sorted(keys)
+    # Ogni sensore in un solo part file
+    owners = {}
+    for i, part in enumerate(by_part):
+        for l in part:
+            assert owners.setdefault(l.split('-', 1)[0], i) == i
+
+    expected = streaming_job([lines], workdir)
+    assert sorted(l for part in by_part for l in part) == expected
+    assert len(expected) == 6
+
+
+def test_pool_matches_one_map_task_per_chunk(workdir, monkeypatch):
+    lines = make_input()
+    monkeypatch.setattr(local_runner, 'CHUNK_LINES', 100)
+    chunks = [lines[i:i + 100] for i in range(0, len(lines), 100)]
+    assert len(chunks) > local_runner.POOL_MIN_CHUNKS
+
+    model = load_model(str(workdir / 'model.json'))
+    output = str(workdir / 'out')
+    local_runner.write_output(local_runner.run(iter(lines), model, workers=2), output, 1)
+
+    # Stessi blocchi e stesso ordine di fusione: uscita identica al byte
+    assert read_output(output) == [streaming_job(chunks, workdir)]
@@ -0,0 +1,97 @@
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+from partials import Partial, merge_stats
+
+JOB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Prezzi ~1e5 e timestamp ripetuti: M2 stabile e parita' decise dall'ordine di ingresso
+POINTS = [(100000.0 + random.Random(i).uniform(-50, 50), 1700000000000000 + (i // 3) * 1000000)
+          for i in range(30)]
+
+
+def sequential(points):
+    p = Partial()
+    for temp, ts in points:
+        p.add(temp, ts)
+    return p
+
+
+def split_merge(points, cuts):
+    total = Partial()
+    for a, b in zip([0] + cuts, cuts + [len(points)]):
+        total.merge(sequential(points[a:b]))
+    return total
+
+
+def assert_same(a, b):
+    assert (a.count, a.min, a.max, a.first_ts, a.first, a.last_ts, a.last, a.discarded, a.total) == \
+        (b.count, b.min, b.max, b.first_ts, b.first, b.last_ts, b.last, b.discarded, b.total)
+    assert a.sum == pytest.approx(b.sum, rel=1e-12)
+    assert a.m2 == pytest.approx(b.m2, rel=1e-9)
+
+
+@pytest.mark.parametrize('cuts', [[1], [15], [29], [3, 4, 5], [7, 14, 21, 28], list(range(1, 30))])
+def test_merge_of_any_split_equals_sequential_add(cuts):
+    assert_same(split_merge(POINTS, cuts), sequential(POINTS))
+
+
+def test_timestamp_ties_follow_input_order():
+    ts = 1700000000000000
+    points = [(1.0, ts), (2.0, ts), (3.0, ts)]
+    for p in (sequential(points), split_merge(points, [1, 2])):
+        # Apertura al primo arrivato, chiusura all'ultimo
+        assert (p.first, p.last) == (1.0, 3.0)
+
+
+def test_merge_with_empty_and_discarded_partials():
+    discarded = Partial()
+    discarded.add_discarded()
+    total = Partial().merge(discarded).merge(sequential(POINTS[:5])).merge(Partial())
+    assert (total.count, total.discarded, total.total) == (5, 1, 6)
+    assert total.first == POINTS[0][0]
+
+
+def test_value_and_stats_roundtrip():
+    p = sequential(POINTS)
+    p.add_discarded()
+    assert_same(Partial.from_value(p.to_value()), p)
+    assert_same(Partial.from_stats(p.to_stats()), p)
+    assert Partial.from_value(Partial().to_value()).count == 0
+
+    halves = [sequential(POINTS[:10]).to_stats(), sequential(POINTS[10:]).to_stats()]
+    assert_same(merge_stats(halves), sequential(POINTS))
+
+
+def test_legacy_second_timestamps_are_read_as_microseconds():
+    p = Partial.from_value('P|1|5.0|0.0|5.0|5.0|1700000000|5.0|1700000000|5.0|0|1')
+    assert p.first_ts == p.last_ts == 1700000000000000
+
+
+def run_combiner(lines):
+    out = subprocess.run([sys.executable, os.path.join(JOB_DIR, 'combiner.py')], input=''.join(lines),
+                         stdout=subprocess.PIPE, universal_newlines=True, check=True, cwd=JOB_DIR)
+    return out.stdout.splitlines()
+
+
+def test_combiner_merges_sorted_partials_and_keeps_order():
+    lines = []
+    for key, chunk in (('A1-2024-01-01', POINTS[:10]), ('A1-2024-01-01', POINTS[10:20]),
+                       ('A1-2024-01-02', POINTS[20:]), ('B1-2024-01-01', POINTS[:2])):
+        lines.append('{}\t{}\n'.format(key, sequential(chunk).to_value()))
+    lines.insert(3, 'A1-2024-01-02\t100000.0|1700000000\n')  # Punto grezzo in mezzo
+    lines.append('riga malformata\n')
+
+    out = run_combiner(lines)
+    keys = [l.split('\t', 1)[0] for l in out]
+    assert keys == sorted(keys)
+    assert keys == ['A1-2024-01-01', 'A1-2024-01-02', 'A1-2024-01-02', 'B1-2024-01-01']
+    assert out[1] == 'A1-2024-01-02\t100000.0|1700000000'
+
+    # Combiner + fusione a valle = aggregazione diretta
+    assert_same(Partial.from_value(out[0].split('\t', 1)[1]), sequential(POINTS[:20]))
+    assert_same(Partial.from_value(out[2].split('\t', 1)[1]), sequential(POINTS[20:]))
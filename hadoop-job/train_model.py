@@ -1,88 +1,162 @@
 #!/usr/bin/env python3
+"""
+train_model.py - Addestramento incrementale del modello di pulizia
+
+Il modello ({sensor_id: {mean, std_dev}}) si calcola sugli ultimi 60
+minuti: filtro IQR (Q1/Q3) e poi media e deviazione standard dei valori
+rimasti. Invece di rileggere ogni volta due giorni di archivio, lo stato
+(--state, persistito su HDFS dal job) tiene per sensore un digest
+fondibile (quantile_sketch.py) per ogni bucket di BUCKET_SECONDS:
+
+  {"buckets": {sensor_id: {bucket_start_epoch: [[media, conteggio, M2], ...]}},
+   "files": [file di incoming gia' inclusi]}
+
+Ogni run fonde solo i dati nuovi su stdin e scarta i bucket usciti dalla
+finestra: il costo e' proporzionale ai dati nuovi.
+
+Uso:
+  train_model.py [--state S] [--applied FILE...] < dati > model.json
+  train_model.py --state S --pending FILE...      file non ancora inclusi
+--applied registra nello stato l'elenco corrente di incoming (i file gia'
+inclusi che non compaiono piu' sono stati archiviati e si dimenticano).
+Senza --state addestra sui soli dati di stdin.
+"""
+import argparse
+import os
 import sys
-import json
-import math
+import time
 from datetime import datetime, timedelta
-import statistics
 
-def main():
-    temps_by_sensor = {} 
-    
-    # --- MODIFICA 1: Finestra temporale più ampia (60 minuti) ---
-    # Questo evita che piccoli ritardi nel batching facciano trovare 0 dati
-    now = datetime.utcnow()
-    time_window_ago = now - timedelta(minutes=60)
-    
-    sys.stderr.write("Addestramento: Window Start: {}\n".format(time_window_ago.isoformat()))
+import batch_format
+import codec
+from quantile_sketch import Digest
+
+WINDOW_MINUTES = 60
+BUCKET_SECONDS = 300
+
+
+def load_state(path):
+    state = {"buckets": {}, "files": []}
+    if path:
+        try:
+            with open(path, 'r') as f:
+                text = f.read()
+            if text.strip():
+                state.update(codec.loads(text))
+        except (IOError, OSError):
+            pass
+        except ValueError:
+            sys.stderr.write("Stato di training illeggibile, si riparte da zero\n")
+    return state
+
+
+def save_state(path, state):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(codec.dumps(state))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+
+
+def read_new_points(lines, window_start_us):
+    """{(sensor_id, bucket_start): [temp, ...]} dei punti dentro la finestra."""
+    points = {}
+    bucket_us = BUCKET_SECONDS * codec.US_PER_S
+
+    def add(sensor_id, ts_us, temp):
+        key = (sensor_id, ts_us // bucket_us * BUCKET_SECONDS)
+        points.setdefault(key, []).append(float(temp))
 
     lines_read = 0
     valid_data_count = 0
 
-    for line in sys.stdin:
+    for line in lines:
         lines_read += 1
         try:
             line = line.strip()
             if not line: continue
-            
-            data = json.loads(line)
+
+            # Blocco colonnare: confronto diretto sui timestamp interi
+            if batch_format.is_block(line):
+                for sensor_id, ts_us, temp, _source in batch_format.iter_block(line):
+                    if ts_us >= window_start_us:
+                        add(sensor_id, ts_us, temp)
+                        valid_data_count += 1
+                continue
+
+            data = codec.loads(line)
             sensor_id = data.get("sensor_id")
             temp = data.get("temp")
             timestamp_str = data.get("timestamp")
 
             if sensor_id and temp is not None and timestamp_str:
-                # Gestione robusta timestamp
+                # Gestione robusta timestamp (layout fisso, cache per data)
                 try:
-                    if '.' in timestamp_str:
-                        data_timestamp = datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%S.%f')
-                    else:
-                        data_timestamp = datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%S')
-                except:
+                    data_ts_us = codec.iso_to_us(timestamp_str)
+                except ValueError:
                     continue
-                
+
                 # Filtra solo dati recenti
-                if data_timestamp >= time_window_ago:
-                    if sensor_id not in temps_by_sensor:
-                        temps_by_sensor[sensor_id] = []
-                    temps_by_sensor[sensor_id].append(float(temp))
+                if data_ts_us >= window_start_us:
+                    add(sensor_id, data_ts_us, temp)
                     valid_data_count += 1
 
         except Exception:
-            pass 
+            pass
 
-    sys.stderr.write("Righe lette: {}, Dati validi (ultimi 60m): {}\n".format(lines_read, valid_data_count))
-    
-    # Se non abbiamo dati validi, stampa JSON vuoto e esci
-    if not temps_by_sensor:
-        print("{}") 
-        return
+    sys.stderr.write("Righe nuove lette: {}, Dati validi (ultimi {}m): {}\n".format(
+        lines_read, WINDOW_MINUTES, valid_data_count))
+    return points
+
+
+def fold(state, points, window_start):
+    """Fonde i punti nuovi nei bucket e scarta i bucket fuori finestra."""
+    buckets = state["buckets"]
+    for (sensor_id, start), temps in points.items():
+        per_sensor = buckets.setdefault(sensor_id, {})
+        key = str(start)
+        digest = Digest.from_values(temps)
+        if key in per_sensor:
+            digest.merge(Digest.from_list(per_sensor[key]))
+        per_sensor[key] = digest.to_list()
+
+    for sensor_id in list(buckets):
+        per_sensor = buckets[sensor_id]
+        for key in list(per_sensor):
+            if int(key) + BUCKET_SECONDS <= window_start:
+                del per_sensor[key]
+        if not per_sensor:
+            del buckets[sensor_id]
 
+
+def build_model(state):
     model = {}
 
-    for sensor_id, temps in temps_by_sensor.items():
-        n = len(temps)
-        
+    for sensor_id, per_sensor in state["buckets"].items():
+        digest = Digest()
+        for centroids in per_sensor.values():
+            digest.merge(Digest.from_list(centroids))
+        n = digest.count
+
         # Richiede almeno 3 punti dati per un modello minimo
-        if n > 2: 
-            # --- FILTRO IQR SEMPLIFICATO ---
-            temps.sort()
-            q1_idx = int(n * 0.25)
-            q3_idx = int(n * 0.75)
-            q1 = temps[q1_idx]
-            q3 = temps[q3_idx]
+        if n > 2:
+            # --- FILTRO IQR SEMPLIFICATO (quantili dal digest) ---
+            q1 = digest.quantile(0.25)
+            q3 = digest.quantile(0.75)
             iqr = q3 - q1
-            
+
             lower = q1 - (1.5 * iqr)
             upper = q3 + (1.5 * iqr)
-            
-            cleaned = [t for t in temps if lower <= t <= upper]
-            
+
+            count, mean_val, m2 = digest.moments(lower, upper)
+
             # Fallback se il filtro è troppo aggressivo
-            if len(cleaned) < 2: cleaned = temps
+            if count < 2: count, mean_val, m2 = digest.moments()
+
+            if count > 0:
+                std_dev_val = (m2 / (count - 1)) ** 0.5 if count > 1 else 0.0
 
-            if len(cleaned) > 0:
-                mean_val = statistics.mean(cleaned)
-                std_dev_val = statistics.stdev(cleaned) if len(cleaned) > 1 else 0.0
-                
                 # Evita deviazione standard zero
                 if std_dev_val == 0: std_dev_val = mean_val * 0.001
 
@@ -91,8 +165,50 @@ def main():
                     "std_dev": round(std_dev_val, 4)
                 }
 
+    return model
+
+
+def main():
+    p = argparse.ArgumentParser(description="Addestramento incrementale del modello di pulizia")
+    p.add_argument('--state', help="Stato dei bucket (letto e riscritto)")
+    p.add_argument('--applied', nargs='*', help="File di incoming inclusi dopo questo run")
+    p.add_argument('--pending', nargs='*', help="Stampa i file non ancora inclusi ed esce")
+    args = p.parse_args()
+
+    state = load_state(args.state)
+
+    if args.pending is not None:
+        done = set(state["files"])
+        for name in args.pending:
+            if name not in done:
+                print(name)
+        return
+
+    # --- Finestra temporale ampia (60 minuti) ---
+    # Questo evita che piccoli ritardi nel batching facciano trovare 0 dati
+    now = datetime.utcnow()
+    time_window_ago = now - timedelta(minutes=WINDOW_MINUTES)
+
+    sys.stderr.write("Addestramento: Window Start: {}\n".format(time_window_ago.isoformat()))
+
+    window_start_us = batch_format.datetime_to_us(time_window_ago)
+
+    fold(state, read_new_points(sys.stdin, window_start_us), window_start_us // codec.US_PER_S)
+    model = build_model(state)
+
+    if args.state:
+        if args.applied is not None:
+            state["files"] = sorted(args.applied)
+        state["updated"] = int(time.time())
+        save_state(args.state, state)
+
+    # Se non abbiamo dati validi, stampa JSON vuoto e esci
+    if not model:
+        print("{}")
+        return
+
     # Stampa il modello finale
-    print(json.dumps(model, indent=2))
+    print(codec.dumps(model, pretty=True))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,9 +2,34 @@
 """
 unify_batches.py
 Calcola le statistiche giornaliere aggregate, inclusa la Media Pesata (Avg Price).
+
+Input: i part file di tutti i batch del giorno ("*/part-*").
+
+Se ogni batch del sensore porta il campo "stats" (statistiche sufficienti,
+partials.py) il giornaliero e' esatto: media = sum/n, volatilita' =
+deviazione standard su tutti i punti, open/close dal primo/ultimo
+timestamp (a parita' al microsecondo, nell'ordine dei batch); la riga di uscita riporta a sua volta "stats" per
+rollup su piu' giorni. Altrimenti (output di batch precedenti) resta la
+stima storica: media OHLC pesata e volatilita' media pesata, con open/close
+nell'ordine delle righe (il job partiziona per sensore, quindi ogni
+sensore sta in un solo part file per batch e il glob ordinato di HDFS lo
+presenta in ordine di batch).
 """
 import sys
-import json
+
+import codec
+from partials import Partial
+
+def new_daily_entry():
+    return {
+        "open": None, "close": None, 
+        "min": None, "max": None,
+        "count": 0, "discarded_count": 0, "total_count": 0,
+        "volatility": 0.0,
+        "weighted_sum": 0.0, # Nuovo accumulatore per la media
+        "stats": None,       # Statistiche sufficienti fuse (partials.Partial.to_stats)
+        "legacy_batches": 0  # Batch senza "stats": il giornaliero resta stimato
+    }
 
 def update_daily_stats(daily, batch):
     # Aggiorna Min/Max Assoluti
@@ -39,10 +64,58 @@ def update_daily_stats(daily, batch):
     
     return daily
 
-def main():
-    daily_stats = {} 
+def format_daily(daily_stats):
+    """Righe finali "SENSORE-DAILY\t{json}" dagli accumulatori per sensore."""
+    for sensor_id, stats in daily_stats.items():
+        exact = None
+        if stats.get('stats') is not None and not stats.get('legacy_batches'):
+            exact = Partial.from_stats(stats['stats'])
+            if exact.count == 0:
+                continue # Tutto scartato: nessun prezzo da riportare
+            open_p, close_p, min_p, max_p = exact.first, exact.last, exact.min, exact.max
+            mean_val, volatility = exact.mean(), exact.std_dev()
+            count, discarded, total_cnt = exact.count, exact.discarded, exact.total
+        else:
+            open_p, close_p, min_p, max_p = stats['open'], stats['close'], stats['min'], stats['max']
+            volatility = stats['volatility']
+            count, discarded, total_cnt = stats['count'], stats['discarded_count'], stats.get('total_count', 0)
+
+            # Calcolo media finale (stima OHLC)
+            mean_val = 0.0
+            if count > 0:
+                mean_val = stats['weighted_sum'] / count
+
+        if open_p and open_p > 0:
+            change = close_p - open_p
+            change_pct = (change / open_p) * 100
+            range_pct = ((max_p - min_p) / open_p) * 100
+        else:
+            change = 0; change_pct = 0; range_pct = 0
+
+        disc_pct = (discarded / total_cnt * 100) if total_cnt > 0 else 0
 
-    for line in sys.stdin:
+        output = {
+            "open": round(open_p, 2),
+            "close": round(close_p, 2),
+            "min": round(min_p, 2),
+            "max": round(max_p, 2),
+            "mean": round(mean_val, 2), # Nuovo campo Mean
+            "count": count,
+            "discarded_count": discarded,
+            "daily_change": round(change, 2),
+            "daily_change_pct": round(change_pct, 2),
+            "volatility": round(volatility, 2),
+            "range_pct": round(range_pct, 2),
+            "discarded_pct": round(disc_pct, 2)
+        }
+        if exact is not None:
+            output["stats"] = exact.to_stats()
+        
+        yield "{}-DAILY\t{}".format(sensor_id, codec.dumps(output))
+
+def merge_lines(daily_stats, lines):
+    """Fonde negli accumulatori per sensore le righe "CHIAVE\t{json}" del reducer."""
+    for line in lines:
         try:
             line = line.strip()
             if not line: continue
@@ -51,55 +124,32 @@ def main():
             if len(parts) < 2: continue
             
             key = parts[0].split('-')[0] 
-            metrics = json.loads(parts[1])
+            metrics = codec.loads(parts[1])
 
             if key not in daily_stats:
-                daily_stats[key] = {
-                    "open": None, "close": None, 
-                    "min": None, "max": None,
-                    "count": 0, "discarded_count": 0, "total_count": 0,
-                    "volatility": 0.0,
-                    "weighted_sum": 0.0 # Nuovo accumulatore per la media
-                }
+                daily_stats[key] = new_daily_entry()
+            entry = daily_stats[key]
+
+            # Prima la fusione esatta: la stima storica sotto puo' fallire (batch tutto scartato)
+            if 'stats' in metrics:
+                # Batch in ordine di arrivo: a parita' di timestamp la chiusura e' del piu' recente
+                merged = Partial() if entry.get('stats') is None else Partial.from_stats(entry['stats'])
+                merged.merge(Partial.from_stats(metrics['stats']))
+                entry['stats'] = merged.to_stats()
+            else:
+                entry['legacy_batches'] = entry.get('legacy_batches', 0) + 1
 
-            daily_stats[key] = update_daily_stats(daily_stats[key], metrics)
+            daily_stats[key] = update_daily_stats(entry, metrics)
 
         except Exception:
             pass
+    return daily_stats
 
-    # Calcoli Finali
-    for sensor_id, stats in daily_stats.items():
-        if stats['open'] and stats['open'] > 0:
-            change = stats['close'] - stats['open']
-            change_pct = (change / stats['open']) * 100
-            range_pct = ((stats['max'] - stats['min']) / stats['open']) * 100
-        else:
-            change = 0; change_pct = 0; range_pct = 0
-
-        total_cnt = stats.get('total_count', 0)
-        disc_pct = (stats['discarded_count'] / total_cnt * 100) if total_cnt > 0 else 0
-
-        # Calcolo media finale
-        mean_val = 0.0
-        if stats['count'] > 0:
-            mean_val = stats['weighted_sum'] / stats['count']
+def main():
+    daily_stats = merge_lines({}, sys.stdin)
 
-        output = {
-            "open": round(stats['open'], 2),
-            "close": round(stats['close'], 2),
-            "min": round(stats['min'], 2),
-            "max": round(stats['max'], 2),
-            "mean": round(mean_val, 2), # Nuovo campo Mean
-            "count": stats['count'],
-            "discarded_count": stats['discarded_count'],
-            "daily_change": round(change, 2),
-            "daily_change_pct": round(change_pct, 2),
-            "volatility": round(stats['volatility'], 2),
-            "range_pct": round(range_pct, 2),
-            "discarded_pct": round(disc_pct, 2)
-        }
-        
-        print("{}-DAILY\t{}".format(sensor_id, json.dumps(output)))
+    for line in format_daily(daily_stats):
+        print(line)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
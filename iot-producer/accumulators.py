@@ -0,0 +1,85 @@
+"""
+accumulators.py - Accumulatori in streaming per lo Speed Layer
+
+Ogni sensore ha un PriceAccumulator con memoria O(1) (count, somma,
+min, max, primo/ultimo prezzo, somma dei quadrati) al posto della lista
+di tutti i prezzi della finestra.
+
+ShardedAccumulators distribuisce i sensori su piu' shard, ciascuno con il
+proprio lock; a fine finestra `swap()` sostituisce ogni shard con uno vuoto
+(scambio di riferimento, senza copiare liste).
+"""
+
+import threading
+
+
+class PriceAccumulator:
+    __slots__ = ("count", "total", "sum_sq", "min", "max", "first", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.sum_sq = 0.0
+        self.min = None
+        self.max = None
+        self.first = None
+        self.last = None
+
+    def add(self, price):
+        if self.count == 0:
+            self.first = self.min = self.max = price
+        elif price < self.min:
+            self.min = price
+        elif price > self.max:
+            self.max = price
+        self.count += 1
+        self.total += price
+        self.sum_sq += price * price
+        self.last = price
+
+    def mean(self):
+        # Stessa somma sequenziale di sum(prices) / len(prices)
+        return self.total / self.count if self.count else None
+
+    def variance(self):
+        """Varianza campionaria (n-1)."""
+        if self.count < 2:
+            return 0.0
+        m = self.total / self.count
+        return max(0.0, (self.sum_sq - self.count * m * m) / (self.count - 1))
+
+
+class ShardedAccumulators:
+
+    def __init__(self, shards=8):
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+        self._n = shards
+
+    def _shard(self, sid):
+        return hash(sid) % self._n
+
+    def add(self, sid, price):
+        i = self._shard(sid)
+        accs, lock = self._shards[i]
+        with lock:
+            # Rilegge il dict sotto lock: swap() potrebbe averlo sostituito
+            accs = self._shards[i][0]
+            acc = accs.get(sid)
+            if acc is None:
+                acc = accs[sid] = PriceAccumulator()
+            acc.add(price)
+
+    def swap(self):
+        """
+        Chiude la finestra: ritorna {sid: PriceAccumulator} e riparte da vuoto.
+        """
+        out = {}
+        for i, (_, lock) in enumerate(self._shards):
+            with lock:
+                accs = self._shards[i][0]
+                self._shards[i] = ({}, lock)
+            out.update(accs)
+        return out
+
+    def clear(self):
+        self.swap()
@@ -0,0 +1,179 @@
+"""
+benchmark.py - Benchmark di throughput del producer, senza rete
+
+Esegue process_queue e process_aggregates di producer_unified alimentati da
+una sorgente offline (replay_source). I batch HDFS finiscono solo nello
+spool locale (nessun uploader) e le scritture Cassandra in un sink che le
+conta, così si misura il solo percorso caldo del producer.
+
+Uso:
+  python benchmark.py --symbols 50 --rate 20000 --duration 30
+  python benchmark.py --symbols 50 --rate 5000 --burst-factor 10 --burst-period 10 --burst-duration 2
+  python benchmark.py --replay '/data/archive/date=*/*'           # massima velocità
+
+Stampa una riga JSON al secondo (throughput, profondità coda) e un riepilogo finale
+con l'attesa in coda (queue_wait_*) e la latenza end-to-end emissione -> spool
+(emit_to_spool_*, comprende l'attesa del flush a dimensione/tempo del batch).
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault('HADOOP_JOB_DIR', os.path.join(HERE, '..', 'hadoop-job'))
+sys.path.append(os.environ['HADOOP_JOB_DIR'])
+
+from hdfs_spool import HdfsSpool
+from replay_source import ReplaySource, BurstShape, iter_archive, iter_synthetic
+
+
+class SpoolLatency:
+    """
+    Latenza end-to-end emissione -> spool: avvolge serialize_batch (chiamata
+    da flush subito prima di hdfs_spool.append) e misura per ogni riga
+    l'età del timestamp, che ReplaySource (restamp) fissa all'emissione.
+    """
+
+    def __init__(self, serialize):
+        self.serialize = serialize
+        self.rows = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def __call__(self, rows):
+        now = datetime.utcnow()
+        for _sid, ts, _price, _src in rows:
+            age = (now - ts).total_seconds()
+            self.sum += age
+            if age > self.max: self.max = age
+        self.rows += len(rows)
+        return self.serialize(rows)
+
+    def summary(self):
+        return {
+            "emit_to_spool_avg_ms": round(self.sum / self.rows * 1000, 2) if self.rows else 0.0,
+            "emit_to_spool_max_ms": round(self.max * 1000, 2),
+        }
+
+
+class CountingWriter:
+    """Sink al posto di CassandraWriter: conta le scritture dello Speed Layer."""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, params):
+        self.submitted += 1
+
+    def stats(self):
+        return {"submitted": self.submitted}
+
+
+class AcceptAllModel:
+    """Modello che accetta tutto: le finestre arrivano sempre al sink."""
+
+    def __bool__(self):
+        return True
+
+    def is_clean(self, sid, price, default=False):
+        return True
+
+    def check_window(self, prices_by_sid, default=False):
+        return dict.fromkeys(prices_by_sid, True)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark offline del producer")
+    p.add_argument('--replay', nargs='+', help="Glob di file JSONL/IOTC da rigiocare")
+    p.add_argument('--symbols', type=int, default=3, help="Simboli sintetici")
+    p.add_argument('--rate', type=float, default=None, help="Trade/s target (default: massima velocità)")
+    p.add_argument('--burst-factor', type=float, default=1.0)
+    p.add_argument('--burst-period', type=float, default=0.0)
+    p.add_argument('--burst-duration', type=float, default=0.0)
+    p.add_argument('--duration', type=float, default=30.0, help="Durata della sorgente (s)")
+    p.add_argument('--seed', type=int, default=None)
+    p.add_argument('--log-trades', action='store_true', help="Log INFO di ogni trade (senza campionamento)")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    spool_dir = tempfile.mkdtemp(prefix='iot-bench-')
+    try:
+        run(args, spool_dir)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+def run(args, spool_dir):
+    os.environ.setdefault('HDFS_SPOOL_DIR', spool_dir)
+    logging.basicConfig(level=logging.INFO)
+
+    import producer_unified as pu
+    if args.log_trades:
+        pu.trade_log.rate = float('inf')
+    else:
+        logging.getLogger(pu.__name__).setLevel(logging.WARNING)
+
+    pu.hdfs_spool = HdfsSpool(spool_dir)
+    pu.cassandra_writer = CountingWriter()
+    pu.filtering_model = AcceptAllModel()
+    spool_latency = pu.serialize_batch = SpoolLatency(pu.serialize_batch)
+
+    if args.replay:
+        records = iter_archive(args.replay)
+    else:
+        records = iter_synthetic(args.symbols, seed=args.seed)
+    shape = BurstShape(args.rate, args.burst_factor, args.burst_period, args.burst_duration) if args.rate else None
+    source = ReplaySource(pu.data_queue, records, shape=shape, duration=args.duration, restamp=True)
+
+    threading.Thread(target=pu.process_queue, daemon=True).start()
+    threading.Thread(target=pu.process_aggregates, daemon=True).start()
+    started = time.monotonic()
+    threading.Thread(target=source.run, daemon=True).start()
+
+    depth_samples = []
+    last_dequeued = 0
+    while not (source.done and pu.data_queue.empty()):
+        time.sleep(1)
+        depth = pu.data_queue.qsize()
+        dequeued = pu.data_queue.dequeued
+        depth_samples.append(depth)
+        print(json.dumps({"t": round(time.monotonic() - started, 1), "emitted": source.emitted,
+                          "processed_per_s": dequeued - last_dequeued, "queue_depth": depth}))
+        last_dequeued = dequeued
+
+    elapsed = time.monotonic() - started
+    time.sleep(pu.AGGREGATION_WINDOW * 2)  # Ultima finestra dello Speed Layer
+    pu.hdfs_spool.sync(force=True)
+    qstats = pu.data_queue.stats()
+
+    spool_bytes = sum(os.path.getsize(os.path.join(spool_dir, f)) for f in pu.hdfs_spool.segments())
+    pu.hdfs_spool.close()
+    print(json.dumps({
+        "summary": dict({
+            "records": pu.data_queue.dequeued,
+            "elapsed_s": round(elapsed, 2),
+            "throughput_per_s": round(pu.data_queue.dequeued / elapsed, 1) if elapsed else 0.0,
+            "queue_depth_avg": round(sum(depth_samples) / len(depth_samples), 1) if depth_samples else 0,
+            "queue_depth_max": qstats["max_depth"],
+            # Solo attesa nella IngestQueue (put -> get), non la latenza end-to-end
+            "queue_wait_avg_ms": qstats["queue_wait_avg_ms"],
+            "queue_wait_max_ms": qstats["queue_wait_max_ms"],
+            "dropped": qstats["dropped"],
+            "speed_layer_writes": pu.cassandra_writer.submitted,
+            "spool_bytes": spool_bytes,
+        }, **spool_latency.summary())
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
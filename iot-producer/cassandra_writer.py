@@ -0,0 +1,119 @@
+"""
+cassandra_writer.py - Pipeline di scrittura asincrona verso Cassandra
+
+Usa execute_async del driver per tenere piu' scritture in volo:
+  - `max_in_flight` limita le richieste pendenti (semaforo). Quando il
+    limite e' raggiunto `submit` si blocca: backpressure verso il chiamante
+    invece di scartare righe.
+  - gli errori vengono ritentati con backoff esponenziale fino a `max_retries`.
+  - contatori e latenze per scrittura sono disponibili con `stats()`;
+    `on_latency(secondi)`, se dato, riceve la latenza di ogni scrittura riuscita.
+"""
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class CassandraWriter:
+
+    def __init__(self, session, statement, max_in_flight=128, max_retries=3,
+                 backoff_base=0.1, backoff_max=5.0, on_latency=None):
+        self.session = session
+        self.statement = statement
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_latency = on_latency
+
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0
+
+        # Contatori
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.blocked_time = 0.0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def submit(self, params):
+        """
+        Accoda una scrittura. Si blocca se ci sono gia' `max_in_flight`
+        scritture pendenti (backpressure).
+        """
+        t0 = time.monotonic()
+        self._slots.acquire()
+        waited = time.monotonic() - t0
+
+        with self._lock:
+            self._in_flight += 1
+            self.submitted += 1
+            self.blocked_time += waited
+
+        self._send(params, 0, time.monotonic())
+
+    def _send(self, params, attempt, started):
+        try:
+            future = self.session.execute_async(self.statement, params)
+        except Exception as e:
+            self._on_error(e, params, attempt, started)
+            return
+        future.add_callbacks(
+            callback=self._on_success, callback_args=(started,),
+            errback=self._on_error, errback_args=(params, attempt, started)
+        )
+
+    def _on_success(self, _rows, started):
+        latency = time.monotonic() - started
+        with self._lock:
+            self.succeeded += 1
+            self.latency_sum += latency
+            if latency > self.latency_max: self.latency_max = latency
+        if self.on_latency: self.on_latency(latency)
+        self._release()
+
+    def _on_error(self, exc, params, attempt, started):
+        if attempt < self.max_retries:
+            delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+            with self._lock: self.retried += 1
+            # Il retry non gira nel thread di I/O del driver
+            t = threading.Timer(delay, self._send, args=(params, attempt + 1, started))
+            t.daemon = True
+            t.start()
+            return
+
+        with self._lock: self.failed += 1
+        log.error(f"❌ Scrittura Cassandra fallita dopo {attempt + 1} tentativi: {exc}")
+        self._release()
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            if self._in_flight == 0: self._idle.notify_all()
+        self._slots.release()
+
+    def wait_idle(self, timeout=None):
+        """Attende che tutte le scritture in volo siano completate."""
+        with self._lock:
+            return self._idle.wait_for(lambda: self._in_flight == 0, timeout)
+
+    def stats(self):
+        with self._lock:
+            done = self.succeeded
+            return {
+                "in_flight": self._in_flight,
+                "submitted": self.submitted,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "retried": self.retried,
+                "blocked_s": round(self.blocked_time, 3),
+                "latency_avg_ms": round(self.latency_sum / done * 1000, 2) if done else 0.0,
+                "latency_max_ms": round(self.latency_max * 1000, 2),
+            }
@@ -0,0 +1,113 @@
+"""
+dedup.py - Deduplica dei trade e riconciliazione tra sorgenti
+
+DedupIndex: indice a memoria limitata dei record già visti, con chiave
+(src, sid, id evento). L'id evento è il campo opzionale "eid" del record
+(id del trade Binance, orario di aggiornamento CoinGecko); senza "eid"
+si usa il timestamp del record. Le chiavi scadono dopo `window` secondi e
+oltre `max_entries` si scartano le più vecchie (ordine di inserimento).
+Le sorgenti senza alcuna identità dell'evento (`price_only`: Coinbase non
+espone né id né orario) scartano solo le ripetizioni consecutive: un
+record è un doppione se il prezzo è uguale all'ultimo visto per
+(src, sid), quindi un ritorno A→B→A del prezzo resta un evento nuovo.
+
+Reconciler (opzionale): raggruppa per sensore le quotazioni di una
+finestra di `window` secondi e, se arrivano da più sorgenti, le fonde in
+un unico record: prezzo medio tra le sorgenti (ultimo prezzo di ognuna),
+timestamp più recente, "src" con l'insieme delle sorgenti ("Binance+Coinbase").
+
+Entrambi vengono usati dal solo thread di process_queue: nessun lock.
+"""
+
+import time
+from collections import OrderedDict
+
+
+class DedupIndex:
+
+    def __init__(self, max_entries=100000, window=120.0, price_only=('Coinbase',)):
+        self.max_entries = max_entries
+        self.window = window
+        self.price_only = frozenset(price_only)
+        self._seen = OrderedDict()  # chiave -> istante del primo arrivo
+        self._last_price = {}       # (src, sid) -> ultimo prezzo delle sorgenti price_only
+        self.duplicates = 0
+
+    @staticmethod
+    def key(item):
+        eid = item.get('eid')
+        return (item['src'], item['sid'], item['ts'] if eid is None else eid)
+
+    def is_duplicate(self, item, now=None):
+        if item['src'] in self.price_only:
+            k = (item['src'], item['sid'])
+            if self._last_price.get(k) == item['p']:
+                self.duplicates += 1
+                return True
+            self._last_price[k] = item['p']
+            return False
+
+        now = time.monotonic() if now is None else now
+        seen = self._seen
+
+        # Scadenza: le chiavi più vecchie sono in testa
+        limit = now - self.window
+        while seen:
+            oldest = next(iter(seen.values()))
+            if oldest >= limit: break
+            seen.popitem(last=False)
+
+        k = self.key(item)
+        if k in seen:
+            self.duplicates += 1
+            return True
+        seen[k] = now
+        if len(seen) > self.max_entries:
+            seen.popitem(last=False)
+        return False
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class Reconciler:
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self._open = {}  # sid -> (scadenza, {src: item})
+        self.merged = 0
+
+    def add(self, item, now=None):
+        """Accoda il record nella finestra del suo sensore; ritorna i record delle finestre chiuse."""
+        now = time.monotonic() if now is None else now
+        out = self.flush(now)
+        sid = item['sid']
+        entry = self._open.get(sid)
+        if entry is None:
+            entry = self._open[sid] = (now + self.window, {})
+        entry[1][item['src']] = item  # Ultima quotazione per sorgente
+        return out
+
+    def flush(self, now=None, force=False):
+        """Chiude le finestre scadute (tutte con `force`)."""
+        now = time.monotonic() if now is None else now
+        out = []
+        # Le finestre sono in ordine di apertura, quindi di scadenza
+        while self._open:
+            sid, (deadline, quotes) = next(iter(self._open.items()))
+            if not force and deadline > now: break
+            del self._open[sid]
+            out.append(self._merge(sid, quotes))
+        return out
+
+    def _merge(self, sid, quotes):
+        if len(quotes) == 1:
+            return next(iter(quotes.values()))
+        self.merged += 1
+        items = list(quotes.values())
+        return {
+            "sid": sid,
+            "ts": max(i['ts'] for i in items),
+            "p": sum(i['p'] for i in items) / len(items),
+            "src": "+".join(sorted(quotes)),
+        }
@@ -0,0 +1,295 @@
+"""
+hdfs_spool.py - Write-ahead spool locale per i batch destinati a HDFS
+
+I batch vengono prima scritti su disco locale e poi copiati su HDFS da un
+pool di upload in background, così un NameNode irraggiungibile non fa
+crescere la memoria e un riavvio non perde dati.
+
+Layout di SPOOL_DIR:
+  seg_<seq>.log     segmenti append-only, ruotati a `segment_bytes`
+  checkpoint.json   {"segment": "seg_<seq>.log", "offset": N} primo record non replicato
+
+Formato record:
+  IOTB <nome_batch> <lunghezza> <crc32>\\n<contenuto utf-8>\\n
+
+Le scritture vengono rese visibili subito (flush) ma l'fsync è raggruppato:
+al massimo uno ogni `fsync_interval` secondi (il chiamante invoca `sync()`
+periodicamente per chiudere la finestra anche senza nuove scritture).
+Ad ogni avvio si apre un segmento nuovo; un record troncato (crash) chiude
+la lettura del segmento. Il checkpoint avanza in ordine di spool; dopo un
+crash si possono ricaricare batch già inviati (il nome è fissato in spool):
+se il batch è ancora in incoming viene sovrascritto con lo stesso
+contenuto, se il job l'ha già archiviato run_job.sh trova il nome
+nell'archivio (compact_archive.py archived) e cancella la copia senza
+rielaborarla.
+"""
+
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'IOTB'
+CHECKPOINT = 'checkpoint.json'
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+    except OSError:
+        pass
+
+
+class HdfsSpool:
+
+    def __init__(self, spool_dir, segment_bytes=64 * 1024 * 1024, fsync_interval=1.0):
+        self.dir = spool_dir
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        os.makedirs(self.dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._has_data = threading.Condition(self._lock)
+        self._last_fsync = 0.0
+        self._dirty = False
+
+        segments = self.segments()
+        self._seq = int(segments[-1][4:-4]) + 1 if segments else 1
+        self._active_name = None
+        self._active = None
+        self._open_segment()
+
+    # --- Segmenti ---
+    def segments(self):
+        return sorted(f for f in os.listdir(self.dir) if f.startswith('seg_') and f.endswith('.log'))
+
+    def _open_segment(self):
+        if self._active:
+            self._sync_locked(force=True)
+            self._active.close()
+        self._active_name = f"seg_{self._seq:012d}.log"
+        self._seq += 1
+        self._active = open(os.path.join(self.dir, self._active_name), 'ab')
+        _fsync_dir(self.dir)
+
+    # --- Scrittura ---
+    def append(self, name, content):
+        data = content.encode('utf-8')
+        header = b'%s %s %d %d\n' % (MAGIC, name.encode('utf-8'), len(data), zlib.crc32(data))
+        with self._lock:
+            if self._active.tell() > 0 and self._active.tell() + len(data) > self.segment_bytes:
+                self._open_segment()
+            self._active.write(header + data + b'\n')
+            self._active.flush()
+            self._dirty = True
+            self._sync_locked()
+            self._has_data.notify_all()
+
+    def _sync_locked(self, force=False):
+        now = time.monotonic()
+        if self._dirty and (force or now - self._last_fsync >= self.fsync_interval):
+            os.fsync(self._active.fileno())
+            self._dirty = False
+            self._last_fsync = now
+
+    def sync(self, force=False):
+        """fsync dei record in sospeso; senza `force` solo se è scaduto fsync_interval."""
+        with self._lock:
+            self._sync_locked(force)
+
+    def wait_for_data(self, timeout):
+        with self._lock:
+            self._has_data.wait(timeout)
+
+    def close(self):
+        with self._lock:
+            self._sync_locked(force=True)
+            self._active.close()
+
+    # --- Checkpoint ---
+    def load_checkpoint(self):
+        try:
+            with open(os.path.join(self.dir, CHECKPOINT)) as f:
+                cp = json.load(f)
+            return cp["segment"], int(cp["offset"])
+        except (OSError, ValueError, KeyError):
+            segments = self.segments()
+            return (segments[0] if segments else self._active_name), 0
+
+    def commit(self, segment, offset):
+        """Registra (segment, offset) come primo record da replicare; elimina i segmenti precedenti."""
+        path = os.path.join(self.dir, CHECKPOINT)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({"segment": segment, "offset": offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        _fsync_dir(self.dir)
+
+        for old in self.segments():
+            if old >= segment: break
+            os.remove(os.path.join(self.dir, old))
+
+    # --- Lettura ---
+    def read_from(self, segment, offset):
+        """
+        Itera (segment, offset, fine_record, nome, contenuto) a partire dalla posizione data,
+        attraversando i segmenti successivi.
+        """
+        with self._lock:
+            active = self._active_name
+        for seg in self.segments():
+            if seg < segment: continue
+            start = offset if seg == segment else 0
+            for rec in self._read_segment(seg, start):
+                yield rec
+            if seg >= active: break  # Il segmento attivo è l'ultimo leggibile
+
+    def _read_segment(self, seg, offset):
+        with open(os.path.join(self.dir, seg), 'rb') as f:
+            f.seek(offset)
+            while True:
+                pos = f.tell()
+                header = f.readline()
+                if not header.endswith(b'\n'):
+                    return  # Fine segmento (o header ancora incompleto)
+                try:
+                    magic, name, length, crc = header.split()
+                    length, crc = int(length), int(crc)
+                except ValueError:
+                    log.error(f"Spool: header corrotto in {seg}@{pos}, segmento interrotto")
+                    return
+                data = f.read(length + 1)
+                if len(data) < length + 1 or magic != MAGIC or zlib.crc32(data[:-1]) != crc:
+                    return  # Record troncato: coda del segmento dopo un crash
+                yield seg, pos, f.tell(), name.decode('utf-8'), data[:-1].decode('utf-8')
+
+    def next_position(self, segment, offset):
+        """Posizione dopo la fine di `segment` se è chiuso (per saltare code troncate)."""
+        with self._lock:
+            active = self._active_name
+        if segment >= active:
+            return segment, offset
+        # Segmento ruotato durante la lettura: restano record completi da replicare
+        if any(True for _ in self._read_segment(segment, offset)):
+            return segment, offset
+        later = [s for s in self.segments() if s > segment]
+        return (later[0], 0) if later else (segment, offset)
+
+
+class SpoolReplayer:
+    """
+    Replica i batch dello spool su HDFS con un pool limitato di upload paralleli.
+
+    Fino a `max_pending` batch sono in volo su `workers` thread; ogni upload
+    ritenta con backoff esponenziale e jitter finché non riesce. Il checkpoint
+    avanza solo sul prefisso contiguo di batch completati, quindi dopo un
+    crash si riparte dal primo batch non confermato (i doppioni già
+    archiviati li scarta il job, vedi sopra).
+
+    Gli upload paralleli finiscono in ordine sparso: con `publish` il batch
+    si carica con un nome nascosto e `publish(name)` lo rende visibile
+    (rename) dal thread del replay, in ordine di spool, subito prima del
+    checkpoint. Così il job non vede mai un batch prima di quelli precedenti.
+    `upload(name, content)` e `publish(name)` devono sollevare un'eccezione
+    in caso di errore (publish si ritenta al giro successivo).
+    """
+
+    def __init__(self, spool, upload, workers=4, max_pending=16, backoff_base=1.0, backoff_max=30.0,
+                 publish=None):
+        self.spool = spool
+        self.upload = upload
+        self.publish = publish
+        self.workers = workers
+        self.max_pending = max(workers, max_pending)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.uploaded = 0
+        self.failures = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def run(self):
+        read_pos = self.spool.load_checkpoint()
+        pending = deque()  # (segment, fine_record, nome, future) in ordine di spool
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hdfs-upload') as pool:
+            while True:
+                try:
+                    # 1. Riempie la pipeline con i batch successivi
+                    fetched = 0
+                    room = self.max_pending - len(pending)
+                    if room > 0:
+                        for seg, _pos, end, name, content in itertools.islice(self.spool.read_from(*read_pos), room):
+                            pending.append((seg, end, name, pool.submit(self._upload, name, content)))
+                            read_pos = (seg, end)
+                            fetched += 1
+                        if not fetched:
+                            position = self.spool.next_position(*read_pos)
+                            fetched = int(position != read_pos)
+                            read_pos = position
+
+                    # 2. Pubblicazione e checkpoint sul prefisso contiguo completato
+                    while pending and pending[0][3].done():
+                        seg, end, name, future = pending[0]
+                        future.result()
+                        if self.publish: self.publish(name)
+                        pending.popleft()
+                        self.spool.commit(seg, end)
+
+                    with self._lock: self.in_flight = len(pending)
+
+                    # 3. Attesa: primo upload in volo o nuovi dati nello spool
+                    if pending:
+                        wait([pending[0][3]], timeout=0.5)
+                    elif not fetched:
+                        self.spool.wait_for_data(timeout=1.0)
+                except Exception as e:
+                    log.error(f"Errore replay spool verso HDFS: {e}")
+                    time.sleep(1)
+
+    def _upload(self, name, content):
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                self.upload(name, content)
+                break
+            except Exception as e:
+                with self._lock: self.failures += 1
+                delay = min(self.backoff_max, self.backoff_base * (2 ** min(attempt, 10)))
+                delay *= random.uniform(0.5, 1.5)  # Jitter: evita retry sincronizzati
+                attempt += 1
+                log.error(f"Errore upload {name} su HDFS (tentativo {attempt}, retry tra {delay:.1f}s): {e}")
+                time.sleep(delay)
+
+        latency = time.monotonic() - started
+        with self._lock:
+            self.uploaded += 1
+            self.latency_sum += latency
+            if latency > self.latency_max: self.latency_max = latency
+        log.info(f"💾 Batch salvato in INCOMING: {name} ({latency:.2f}s)")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "uploaded": self.uploaded,
+                "failures": self.failures,
+                "latency_avg_ms": round(self.latency_sum / self.uploaded * 1000, 2) if self.uploaded else 0.0,
+                "latency_max_ms": round(self.latency_max * 1000, 2),
+            }
@@ -0,0 +1,164 @@
+"""
+ingest_queue.py - Coda di ingestion con politiche di sovraccarico
+
+Sostituisce queue.Queue per data_queue (stessa interfaccia get/put/task_done).
+Quando la coda è piena, ogni sorgente applica la propria politica:
+
+  block        il produttore attende spazio (comportamento di queue.Queue)
+  drop_oldest  scarta l'elemento più vecchio in coda e accoda il nuovo
+  drop_newest  scarta il nuovo elemento
+  coalesce     sostituisce l'elemento ancora in coda dello stesso sensore
+               e sorgente con il prezzo più recente (se non c'è: drop_oldest)
+
+Solo "block" può fermare il chiamante: per le sorgenti WebSocket va
+usata una delle politiche non bloccanti.
+`stats()` espone profondità, attese e contatori degli scarti.
+"""
+
+import queue
+import threading
+import time
+from collections import deque, defaultdict
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+COALESCE = 'coalesce'
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+
+def parse_policies(spec):
+    """'Binance=coalesce,Coinbase=block' -> {'Binance': 'coalesce', 'Coinbase': 'block'}"""
+    out = {}
+    for part in (spec or '').split(','):
+        if '=' not in part: continue
+        src, policy = (x.strip() for x in part.split('=', 1))
+        if policy not in POLICIES:
+            raise ValueError(f"Politica di coda sconosciuta per {src}: {policy}")
+        out[src] = policy
+    return out
+
+
+class IngestQueue:
+
+    def __init__(self, maxsize, policies=None, default_policy=BLOCK):
+        if default_policy not in POLICIES:
+            raise ValueError(f"Politica di coda sconosciuta: {default_policy}")
+        self.maxsize = maxsize
+        self.policies = dict(policies or {})
+        self.default_policy = default_policy
+
+        self._items = deque()     # Entry: [item, t_enqueue, chiave_coalesce]
+        self._latest = {}         # (sid, src) -> ultima entry in coda
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
+
+        # Metriche
+        self.max_depth = 0
+        self.put_wait_s = 0.0
+        self.queue_wait_s = 0.0
+        self.queue_wait_max_s = 0.0
+        self.dequeued = 0
+        self.coalesced = defaultdict(int)
+        self.dropped = defaultdict(int)
+
+    def policy_for(self, src):
+        return self.policies.get(src, self.default_policy)
+
+    # --- Produttori ---
+    def put(self, item, block=True, timeout=None):
+        src = item.get('src')
+        policy = self.policy_for(src)
+
+        with self._mutex:
+            if len(self._items) >= self.maxsize:
+                if policy == BLOCK:
+                    if not block:
+                        raise queue.Full
+                    t0 = time.monotonic()
+                    ok = self._not_full.wait_for(lambda: len(self._items) < self.maxsize, timeout)
+                    self.put_wait_s += time.monotonic() - t0
+                    if not ok:
+                        raise queue.Full
+                elif policy == DROP_NEWEST:
+                    self.dropped[src] += 1
+                    return
+                elif policy == COALESCE and self._coalesce(item):
+                    return
+                else:
+                    self._evict_oldest()
+
+            self._append(item)
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def _coalesce(self, item):
+        entry = self._latest.get((item.get('sid'), item.get('src')))
+        if entry is None:
+            return False
+        entry[0] = item
+        self.coalesced[item.get('src')] += 1
+        return True
+
+    def _evict_oldest(self):
+        entry = self._items.popleft()
+        self._forget(entry)
+        self.dropped[entry[0].get('src')] += 1
+
+    def _append(self, item):
+        key = (item.get('sid'), item.get('src'))
+        entry = [item, time.monotonic(), key]
+        self._items.append(entry)
+        self._latest[key] = entry
+        depth = len(self._items)
+        if depth > self.max_depth: self.max_depth = depth
+        self._not_empty.notify()
+
+    def _forget(self, entry):
+        if self._latest.get(entry[2]) is entry:
+            del self._latest[entry[2]]
+
+    # --- Consumatore ---
+    def get(self, block=True, timeout=None):
+        with self._mutex:
+            if not self._items:
+                if not block or not self._not_empty.wait_for(lambda: self._items, timeout):
+                    raise queue.Empty
+            entry = self._items.popleft()
+            self._forget(entry)
+
+            waited = time.monotonic() - entry[1]
+            self.dequeued += 1
+            self.queue_wait_s += waited
+            if waited > self.queue_wait_max_s: self.queue_wait_max_s = waited
+            self._not_full.notify()
+            return entry[0]
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self):
+        pass  # Compatibilità con queue.Queue: nessun join() sulla coda
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def full(self):
+        return len(self._items) >= self.maxsize
+
+    def stats(self):
+        with self._mutex:
+            return {
+                "depth": len(self._items),
+                "max_depth": self.max_depth,
+                "put_wait_s": round(self.put_wait_s, 3),
+                "queue_wait_avg_ms": round(self.queue_wait_s / self.dequeued * 1000, 2) if self.dequeued else 0.0,
+                "queue_wait_max_ms": round(self.queue_wait_max_s * 1000, 2),
+                "dropped": dict(self.dropped),
+                "coalesced": dict(self.coalesced),
+            }
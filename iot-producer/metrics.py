@@ -0,0 +1,202 @@
+"""
+metrics.py - Metriche interne del producer, esposte via HTTP
+
+Contatori, gauge e istogrammi con etichette, thread-safe, senza dipendenze
+esterne. `serve(registry, port)` avvia un piccolo server HTTP in un thread
+daemon:
+  GET /metrics        formato testo Prometheus
+  GET /metrics.json   stesso contenuto in JSON
+
+LogRateLimiter sostituisce il log per singolo trade: al massimo `rate`
+righe al secondo, le altre vengono contate e riportate nella riga successiva.
+Il messaggio si passa come formato %-style più argomenti: la formattazione
+avviene solo per le righe effettivamente emesse.
+"""
+
+import bisect
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+# Secondi: da 1 ms a 30 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 5000, 10000)
+
+
+def _labels_text(names, values):
+    if not names: return ''
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, values)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=(), fn=None):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.fn = fn
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[n]) for n in self.label_names)
+
+    def samples(self):
+        if self.fn:
+            try:
+                value = self.fn()
+            except Exception:
+                return []
+            # fn può ritornare un numero o {tupla_etichette: valore}
+            items = value.items() if isinstance(value, dict) else [((), value)]
+            return [(self.name, key if isinstance(key, tuple) else (key,), v) for key, v in items]
+        with self._lock:
+            return [(self.name, key, v) for key, v in self._values.items()]
+
+
+class Counter(_Metric):
+    """Incrementato con inc() oppure letto da `fn` (totale monotòno tenuto altrove) ad ogni scrape."""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Valore impostato con set() oppure letto da `fn` ad ogni scrape."""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            h = self._values.get(key)
+            if h is None:
+                h = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, (counts, total, n) in self._values.items():
+                cumulative = 0
+                for bound, c in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += c
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    out.append((self.name + '_bucket', key + (le,), cumulative))
+                out.append((self.name + '_sum', key, total))
+                out.append((self.name + '_count', key, n))
+        return out
+
+    def label_names_for(self, sample_name):
+        return self.label_names + ('le',) if sample_name.endswith('_bucket') else self.label_names
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=(), fn=None):
+        return self._add(Counter(name, help_text, labels, fn))
+
+    def gauge(self, name, help_text, labels=(), fn=None):
+        return self._add(Gauge(name, help_text, labels, fn))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def render_text(self):
+        lines = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for sample, key, value in m.samples():
+                names = m.label_names_for(sample) if isinstance(m, Histogram) else m.label_names
+                lines.append(f"{sample}{_labels_text(names, key)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def render_json(self):
+        out = {}
+        for m in self._metrics:
+            for sample, key, value in m.samples():
+                names = m.label_names_for(sample) if isinstance(m, Histogram) else m.label_names
+                out.setdefault(sample, []).append({"labels": dict(zip(names, key)), "value": value})
+        return json.dumps(out)
+
+
+def serve(registry, port, host='0.0.0.0'):
+    """Avvia l'endpoint HTTP delle metriche in un thread daemon."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, ctype = registry.render_text(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, ctype = registry.render_json(), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            data = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass  # Nessun log per ogni scrape
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics-http').start()
+    log.info(f"📈 Metriche su http://{host}:{port}/metrics")
+    return server
+
+
+class LogRateLimiter:
+    """Al massimo `rate` righe al secondo; rate=0 disattiva il log."""
+
+    def __init__(self, logger, rate=1.0):
+        self.logger = logger
+        self.rate = rate
+        self._next = 0.0
+        self._suppressed = 0
+
+    def info(self, msg, *args):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        if now < self._next:
+            self._suppressed += 1
+            return
+        self._next = now + 1.0 / self.rate
+        if self._suppressed:
+            msg, args = msg + " (+%d non loggati)", args + (self._suppressed,)
+            self._suppressed = 0
+        self.logger.info(msg, *args)
@@ -0,0 +1,130 @@
+"""
+model_loader.py - Caricamento condizionale e versionato del modello da HDFS
+
+Il batch job pubblica, dopo /models/model.json, un piccolo marker
+/models/model.version:  {"version": <epoch>, "sha256": "<hex>"}
+
+Ad ogni poll il loader:
+  1. legge solo lo status del marker (una GETFILESTATUS): se la
+     modificationTime non è cambiata non fa altro;
+  2. legge il marker: se lo sha256 è quello già caricato non scarica nulla;
+  3. legge il modello in memoria, verifica lo sha256 e lo salva come
+     copia locale "last-known-good" (scrittura atomica tmp + rename).
+
+Se il marker manca (batch job precedente) usa modificationTime e
+dimensione di model.json come condizione.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from hdfs import InsecureClient
+
+log = logging.getLogger(__name__)
+
+
+class ModelLoader:
+
+    def __init__(self, hdfs_url, hdfs_user, model_path, version_path, cache_path, timeout=15):
+        self.client = InsecureClient(hdfs_url, user=hdfs_user, timeout=timeout)
+        self.model_path = model_path
+        self.version_path = version_path
+        self.cache_path = cache_path
+
+        self.version = None     # Versione del modello caricato
+        self.sha256 = None
+        self._marker_mtime = None
+        self._model_stamp = None  # (modificationTime, length) se manca il marker
+
+    def load_local(self):
+        """Modello last-known-good salvato su disco, o None."""
+        try:
+            with open(self.cache_path, 'rb') as f:
+                raw = f.read()
+            model = self._parse(raw)
+            if model is None: return None
+            meta = model.pop('__meta__', {})
+            self.version = meta.get('version')
+            self.sha256 = meta.get('sha256') or hashlib.sha256(raw).hexdigest()
+            return model
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning(f"Copia locale del modello illeggibile: {e}")
+            return None
+
+    def poll(self):
+        """
+        Ritorna il nuovo modello (dict) se è cambiato su HDFS, altrimenti None.
+        """
+        marker_status = self.client.status(self.version_path, strict=False)
+        if marker_status:
+            return self._poll_marker(marker_status)
+        return self._poll_model_status()
+
+    def _poll_marker(self, marker_status):
+        mtime = marker_status.get('modificationTime')
+        if mtime == self._marker_mtime:
+            return None
+
+        with self.client.read(self.version_path) as r:
+            marker = json.loads(r.read())
+        expected = marker.get('sha256')
+
+        if expected and expected == self.sha256:
+            self._marker_mtime = mtime
+            return None
+
+        with self.client.read(self.model_path) as r:
+            raw = r.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        if expected and digest != expected:
+            # Modello e marker non ancora allineati: si riprova al prossimo poll
+            log.info("Modello in aggiornamento (checksum diverso dal marker), riprovo...")
+            return None
+
+        self._marker_mtime = mtime
+        return self._accept(raw, digest, marker.get('version'))
+
+    def _poll_model_status(self):
+        status = self.client.status(self.model_path, strict=False)
+        if not status: return None
+        stamp = (status.get('modificationTime'), status.get('length'))
+        if stamp == self._model_stamp:
+            return None
+
+        with self.client.read(self.model_path) as r:
+            raw = r.read()
+        self._model_stamp = stamp
+        digest = hashlib.sha256(raw).hexdigest()
+        if digest == self.sha256:
+            return None
+        return self._accept(raw, digest, stamp[0])
+
+    def _accept(self, raw, digest, version):
+        model = self._parse(raw)
+        self.sha256 = digest
+        if model is None:
+            return None
+        self.version = version
+        self._save_local(model, digest, version)
+        return model
+
+    @staticmethod
+    def _parse(raw):
+        text = raw.decode('utf-8') if isinstance(raw, bytes) else raw
+        if not text or text.strip() == '{}':
+            return None
+        return json.loads(text)
+
+    def _save_local(self, model, digest, version):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            tmp = f"{self.cache_path}.{os.getpid()}.tmp"  # Più processi worker condividono la cache
+            with open(tmp, 'w') as f:
+                json.dump(dict(model, __meta__={"version": version, "sha256": digest}), f)
+            os.replace(tmp, self.cache_path)
+        except Exception as e:
+            log.warning(f"Impossibile salvare la copia locale del modello: {e}")
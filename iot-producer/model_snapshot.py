@@ -0,0 +1,66 @@
+"""
+model_snapshot.py - Modello anti-anomalie compilato e immutabile
+
+Il modello JSON ({sid: {"mean", "std_dev"}}) viene compilato una sola volta
+in una tabella di limiti [mean - 3σ, mean + 3σ] per sensore.
+Lo snapshot non viene mai modificato: chi aggiorna il modello ne crea uno
+nuovo e lo pubblica riassegnando il riferimento globale (assegnazione
+atomica in CPython), quindi i lettori non prendono alcun lock.
+"""
+
+from types import MappingProxyType
+
+SIGMA = 3
+_ALWAYS = (float('-inf'), float('inf'))
+
+
+class ModelSnapshot:
+    __slots__ = ("bounds", "version")
+
+    def __init__(self, bounds, version=None):
+        self.bounds = MappingProxyType(dict(bounds))
+        self.version = version
+
+    @classmethod
+    def compile(cls, model, version=None, sigma=SIGMA):
+        bounds = {}
+        for sid, params in model.items():
+            m = params.get('mean')
+            s = params.get('std_dev')
+            # std_dev nullo o assente: impossibile filtrare, il dato e' sempre pulito
+            if m is None or s is None or s <= 0:
+                bounds[sid] = _ALWAYS
+            else:
+                bounds[sid] = (m - sigma*s, m + sigma*s)
+        return cls(bounds, version)
+
+    def __bool__(self):
+        return bool(self.bounds)
+
+    def sensors(self):
+        return list(self.bounds)
+
+    def is_clean(self, sid, price, default=False):
+        """`default` e' il risultato per i sensori assenti dal modello."""
+        b = self.bounds.get(sid)
+        if b is None: return default
+        return b[0] <= price <= b[1]
+
+    def check_batch(self, sid, prices, default=False):
+        """Controlla una sequenza di prezzi dello stesso sensore in una chiamata."""
+        b = self.bounds.get(sid)
+        if b is None: return [default] * len(prices)
+        lo, hi = b
+        return [lo <= p <= hi for p in prices]
+
+    def check_window(self, prices_by_sid, default=False):
+        """Controlla {sid: prezzo} (es. le medie di una finestra). Ritorna {sid: bool}."""
+        bounds = self.bounds
+        out = {}
+        for sid, price in prices_by_sid.items():
+            b = bounds.get(sid)
+            out[sid] = default if b is None else b[0] <= price <= b[1]
+        return out
+
+
+EMPTY = ModelSnapshot({})
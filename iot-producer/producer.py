@@ -7,6 +7,8 @@ import threading
 from datetime import datetime
 from cassandra.cluster import Cluster
 from hdfs import InsecureClient
+import model_snapshot
+from model_loader import ModelLoader
 
 # --- Impostazioni Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -39,11 +41,12 @@ cassandra_query = None
 last_data_received_time = None
 
 # --- Variabili per il Modello e Contatori Scarti ---
-filtering_model = None
-model_lock = threading.Lock() 
+filtering_model = model_snapshot.EMPTY # Snapshot immutabile, letto senza lock
 HDFS_MODEL_PATH = '/models/model.json' 
+HDFS_MODEL_VERSION_PATH = '/models/model.version'
+MODEL_CACHE_PATH = os.environ.get('MODEL_CACHE_PATH', '/var/lib/iot-producer/model.json')
 LAST_MODEL_CHECK_TIME = 0
-MODEL_CHECK_INTERVAL = 60 # Controlla HDFS per un nuovo modello ogni 60 secondi
+MODEL_CHECK_INTERVAL = 5 # Poll economico del marker di versione su HDFS
 
 # Contatore per gli scarti (in memoria)
 discard_counter_memory = 0
@@ -54,6 +57,9 @@ HDFS_ROTATE_TRIGGER_PATH = '/models/rotate_trigger'
 # Timeout per operazioni HDFS
 HDFS_TIMEOUT = 15  # secondi
 
+model_loader = ModelLoader(f"http://{HDFS_HOST}:{HDFS_PORT}", HDFS_USER, HDFS_MODEL_PATH,
+                           HDFS_MODEL_VERSION_PATH, MODEL_CACHE_PATH, timeout=HDFS_TIMEOUT)
+
 def setup_connections():
     """Inizializza o re-inizializza le connessioni globali."""
     global cassandra_session, cassandra_cluster, hdfs_client, cassandra_query
@@ -97,83 +103,30 @@ def setup_connections():
 def is_data_clean(sensor_id, temp, model):
     """
     Controlla se un dato è "pulito" secondo il modello 3-Sigma.
+    `model` è uno snapshot compilato: i limiti sono già precalcolati.
+    Sensori senza parametri o con std_dev nullo sono sempre puliti.
     """
-    model_params = model.get(sensor_id)
-    
-    if not model_params:
-        return True
-        
-    mean = model_params.get('mean')
-    std_dev = model_params.get('std_dev')
-    
-    # Se std_dev è 0 o nullo, accetta il dato (non possiamo filtrare)
-    if mean is None or std_dev is None or std_dev <= 0:
-        return True
-        
-    lower_bound = mean - (3 * std_dev)
-    upper_bound = mean + (3 * std_dev)
-    
-    if lower_bound <= temp <= upper_bound:
-        return True
-    else:
-        return False
+    return model.is_clean(sensor_id, temp, default=True)
 
 def update_filtering_model():
     """
-    Scarica il modello da HDFS su un file temporaneo locale, poi lo carica.
-    Più robusto di .read() per evitare timeout su stream HTTP.
+    Aggiornamento condizionale del modello: controlla il marker di versione
+    su HDFS e scarica/parsa in memoria solo se è cambiato. Ogni modello
+    accettato viene salvato come copia locale last-known-good.
     """
-    global filtering_model, hdfs_client
-    
-    if not hdfs_client:
-        log.warning("⚠️  Update Modello: HDFS client non pronto.")
-        return
+    global filtering_model
 
-    import tempfile
-    
     try:
-        # 1. Verifica esistenza
-        status = hdfs_client.status(HDFS_MODEL_PATH, strict=False)
-        if not status:
-            log.info("⏳ Nessun modello trovato su HDFS.")
+        new_model_data = model_loader.poll()
+        if not new_model_data:
             return
 
-        log.info(f"📥 Trovato modello ({HDFS_MODEL_PATH})... Download in corso...")
-        
-        # 2. Download atomico su file temporaneo
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            local_tmp_path = tmp_file.name
-
-        try:
-            # Scarica il file da HDFS al path locale
-            hdfs_client.download(HDFS_MODEL_PATH, local_tmp_path, overwrite=True)
-            
-            # 3. Leggi dal file locale
-            with open(local_tmp_path, 'r') as f:
-                content = f.read()
-                
-            if not content or content.strip() == '{}':
-                log.warning("⚠️  Modello scaricato vuoto.")
-                return 
-
-            new_model_data = json.loads(content)
-            
-            # 4. Aggiorna la variabile globale
-            with model_lock:
-                filtering_model = new_model_data
-                
-            log.info(f"✅ Modello aggiornato con successo! Sensori: {list(filtering_model.keys())}")
-
-        except Exception as e:
-            log.error(f"❌ Errore durante download/parsing modello: {e}")
-
-        finally:
-            # Pulizia file temporaneo
-            if os.path.exists(local_tmp_path):
-                os.remove(local_tmp_path)
+        # Compila e pubblica il nuovo snapshot (swap atomico del riferimento)
+        filtering_model = model_snapshot.ModelSnapshot.compile(new_model_data, version=model_loader.version)
+        log.info(f"✅ Modello aggiornato (v{model_loader.version})! Sensori: {filtering_model.sensors()}")
 
     except Exception as e:
-        log.error(f"❌ Errore generale update modello: {e}")
+        log.error(f"❌ Errore update modello: {e}")
 
 def rotate_discard_counters():
     """
@@ -258,11 +211,7 @@ def on_message(ws, message):
 
         # --- Logica di Scrittura Selettiva e Conteggio Scarti ---
         is_clean = False
-        current_model = None
-        
-        with model_lock: 
-            if filtering_model:
-                current_model = filtering_model
+        current_model = filtering_model
         
         if current_model:
             if is_data_clean(sensor_id, price, current_model):
@@ -330,7 +279,7 @@ def on_close(ws, close_status_code, close_msg):
 
 def model_watcher():
     """
-    Thread separato che aggiorna il modello ogni 60 secondi.
+    Thread separato che controlla il modello ogni MODEL_CHECK_INTERVAL secondi.
     Non blocca il WebSocket principale.
     """
     global LAST_MODEL_CHECK_TIME
@@ -339,11 +288,10 @@ def model_watcher():
     
     while True:
         try:
-            time.sleep(60)  # Controlla ogni minuto
+            time.sleep(MODEL_CHECK_INTERVAL)
             current_time = time.time()
             
             # Aggiorna il modello (con timeout interno)
-            log.info("🔄 Controllo periodico aggiornamenti modello da HDFS...")
             update_filtering_model()
             LAST_MODEL_CHECK_TIME = current_time
             
@@ -369,9 +317,15 @@ def on_open(ws):
     log.info(f"📡 Sottoscritto a: {streams}")
 
 def main():
-    global last_data_received_time, LAST_MODEL_CHECK_TIME
+    global last_data_received_time, LAST_MODEL_CHECK_TIME, filtering_model
     log.info("🚀 Avvio del producer di dati crypto...")
     
+    # Copia locale last-known-good, disponibile anche se HDFS non risponde
+    local_model = model_loader.load_local()
+    if local_model:
+        filtering_model = model_snapshot.ModelSnapshot.compile(local_model, version=model_loader.version)
+        log.info(f"📂 Modello locale caricato (v{model_loader.version})")
+
     setup_connections()
 
     log.info("⏳ Fase di raccolta dati per i primi 5 minuti...")
@@ -1,17 +1,40 @@
 import os
+import sys
 import time
+import socket
+import signal
 import json
 import logging
-import requests
 import threading
 import queue
-import websocket 
 import urllib3
-from collections import defaultdict
 from datetime import datetime
 from cassandra.cluster import Cluster
 from cassandra.policies import DCAwareRoundRobinPolicy 
-from hdfs import InsecureClient
+from hdfs import InsecureClient, HdfsError
+
+# Moduli condivisi con il Batch Layer (copiati in /hadoop-job dal Dockerfile)
+sys.path.append(os.environ.get('HADOOP_JOB_DIR', '/hadoop-job'))
+try:
+    import batch_format
+except ImportError:
+    batch_format = None
+import codec
+import discard_log
+
+from source_engine import SourceEngine
+from symbol_registry import SymbolRegistry
+import replay_source
+from cassandra_writer import CassandraWriter
+from accumulators import ShardedAccumulators
+from dedup import DedupIndex, Reconciler
+import model_snapshot
+import ingest_queue
+from hdfs_spool import HdfsSpool, SpoolReplayer
+from model_loader import ModelLoader
+from state_snapshot import StateSnapshot
+import worker_pool
+import metrics
 
 # --- Configurazione Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - PRODUCER - %(message)s')
@@ -22,12 +45,13 @@ logging.getLogger("hdfs").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 logging.getLogger("requests").setLevel(logging.WARNING)
 logging.getLogger("websocket").setLevel(logging.WARNING)
+logging.getLogger("aiohttp").setLevel(logging.WARNING)
 
 # --- Env ---
 CASSANDRA_HOST = os.environ.get('CASSANDRA_HOST', 'cassandra-seed')
 CASSANDRA_KEYSPACE = 'iot_keyspace'
 HDFS_HOST = os.environ.get('HDFS_HOST', 'namenode')
-HDFS_PORT = 9870
+HDFS_PORT = int(os.environ.get('HDFS_PORT', 9870))
 HDFS_USER = 'root'
 
 # Directory base per l'architettura incrementale
@@ -40,215 +64,413 @@ HDFS_BATCH_SIZE = 500      # Aumentato per ridurre piccoli file
 HDFS_FLUSH_INTERVAL = 60   # Aumentato a 60s per ridurre carico su NameNode
 STATS_FLUSH_INTERVAL = 10 
 
-aggregation_buffer = defaultdict(list)
-buffer_lock = threading.Lock()
+# --- Spool locale (write-ahead) per i batch HDFS ---
+HDFS_SPOOL_DIR = os.environ.get('HDFS_SPOOL_DIR', '/var/lib/iot-producer/spool')
+HDFS_SPOOL_SEGMENT_BYTES = 64 * 1024 * 1024
+HDFS_SPOOL_FSYNC_INTERVAL = 1.0
+HDFS_UPLOAD_WORKERS = int(os.environ.get('HDFS_UPLOAD_WORKERS', 4))
+HDFS_UPLOAD_MAX_PENDING = 16  # Batch in volo verso HDFS
+STATS_LOG_INTERVAL = 60
+
+# --- Pipeline Cassandra ---
+CASSANDRA_MAX_IN_FLIGHT = int(os.environ.get('CASSANDRA_MAX_IN_FLIGHT', 128))
+CASSANDRA_MAX_RETRIES = 3
+
+# Formato dei batch su HDFS: 'jsonl' (default) o 'iotc' (colonnare compresso)
+HDFS_BATCH_FORMAT = os.environ.get('HDFS_BATCH_FORMAT', 'jsonl').lower()
+
+AGGREGATION_SHARDS = 8
+
+# --- Deduplica e riconciliazione tra sorgenti ---
+DEDUP_MAX_ENTRIES = int(os.environ.get('DEDUP_MAX_ENTRIES', 100000))
+DEDUP_WINDOW = float(os.environ.get('DEDUP_WINDOW', 120))        # Secondi di memoria per chiave
+RECONCILE_WINDOW = float(os.environ.get('RECONCILE_WINDOW', 0))  # Secondi, 0 = disattivata
+
+# --- Warm start: snapshot locale di stato (buffer HDFS, scarti pendenti) ---
+STATE_SNAPSHOT_PATH = os.environ.get('STATE_SNAPSHOT_PATH', '/var/lib/iot-producer/state.json')
+STATE_SNAPSHOT_INTERVAL = 5  # Secondi tra due snapshot del buffer non ancora in spool
+CONNECT_RETRY_MAX = 5        # Backoff massimo (s) tra due tentativi di connessione
+
+# --- Multi-processo: N worker partizionati per sensor_id (1 = processo unico) ---
+PRODUCER_WORKERS = int(os.environ.get('PRODUCER_WORKERS', 1))
+WORKER_BATCH_SIZE = 256  # Record per messaggio sulla Pipe verso un worker
+worker_index = None      # Indice del worker in questo processo (None = processo unico)
+
+# --- Metriche (endpoint HTTP) e log per trade ---
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 8000))  # 0 = disattivato
+TRADE_LOG_RATE = float(os.environ.get('TRADE_LOG_RATE', 1))  # Righe/s di log dei trade, 0 = nessuna
+
+# Accumulatori O(1) per sensore, shardati (un lock per shard)
+aggregation_buffer = ShardedAccumulators(AGGREGATION_SHARDS)
 
 # --- API Esterne ---
-BINANCE_WS_URL = "wss://stream.binance.com:9443/stream"
+BINANCE_WS_URL = os.environ.get('BINANCE_WS_URL', "wss://stream.binance.com:9443/stream")  # ws_standin.py per i test
 COINBASE_API_URL = "https://api.coinbase.com/v2/prices/{}/spot"
 COINGECKO_API_URL = "https://api.coingecko.com/api/v3/simple/price"
 
-UNIFIED_MAP = {
-    "btcusdt": "A1", "ethusdt": "B1", "solusdt": "C1",
-    "BTC-USD": "A1", "ETH-USD": "B1", "SOL-USD": "C1",
-    "bitcoin": "A1", "ethereum": "B1", "solana": "C1"
-}
+# Registro dei simboli (sensor_id -> simbolo per sorgente), ricaricato a caldo
+SYMBOL_REGISTRY = os.environ.get('SYMBOL_REGISTRY', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'symbols.json'))
+SYMBOL_REGISTRY_POLL = int(os.environ.get('SYMBOL_REGISTRY_POLL', 30))
+
+# --- Source Engine (asyncio) ---
+COINBASE_POLL_INTERVAL = 5     # Secondi tra due poll della stessa coppia
+COINGECKO_POLL_INTERVAL = 20
+COINBASE_RATE_LIMIT = float(os.environ.get('COINBASE_RATE_LIMIT', 5))    # req/s
+COINGECKO_RATE_LIMIT = float(os.environ.get('COINGECKO_RATE_LIMIT', 0.5))
+HTTP_POOL_SIZE = 20
+# Stream Binance distribuiti su più connessioni (limite per connessione dell'exchange)
+BINANCE_WS_CONNECTIONS = int(os.environ.get('BINANCE_WS_CONNECTIONS', 1))
+BINANCE_WS_MAX_STREAMS = int(os.environ.get('BINANCE_WS_MAX_STREAMS', 200))
+BINANCE_WS_WATCHDOG = int(os.environ.get('BINANCE_WS_WATCHDOG', 40))  # Secondi senza messaggi -> riconnessione
+
+# --- Sorgente: 'live' (exchange), 'replay' (archivio locale), 'synthetic' ---
+PRODUCER_SOURCE = os.environ.get('PRODUCER_SOURCE', 'live').lower()
+REPLAY_PATHS = os.environ.get('REPLAY_PATHS', '').split()
+REPLAY_RATE = float(os.environ.get('REPLAY_RATE', 0)) or None  # None = massima velocità
+SYNTHETIC_SYMBOLS = int(os.environ.get('SYNTHETIC_SYMBOLS', 3))
 
 # --- Globals ---
-data_queue = queue.Queue(maxsize=10000) 
+# Politiche di sovraccarico: block | drop_oldest | drop_newest | coalesce
+# Il WebSocket non deve mai fermarsi dietro l'I/O a valle: default 'coalesce'
+QUEUE_MAXSIZE = int(os.environ.get('QUEUE_MAXSIZE', 10000))
+QUEUE_DEFAULT_POLICY = os.environ.get('QUEUE_DEFAULT_POLICY', ingest_queue.BLOCK)
+QUEUE_SOURCE_POLICIES = ingest_queue.parse_policies(
+    os.environ.get('QUEUE_SOURCE_POLICIES', 'Binance=coalesce'))
+
+data_queue = ingest_queue.IngestQueue(QUEUE_MAXSIZE, QUEUE_SOURCE_POLICIES, QUEUE_DEFAULT_POLICY)
 cassandra_session = None
 hdfs_client = None
 cassandra_query = None
+cassandra_writer = None
+hdfs_spool = None
+uploader = None
+state_snapshot = None
+shutdown_event = threading.Event()   # SIGTERM: svuota buffer e salva lo stato
+queue_drained = threading.Event()    # process_queue ha messo in spool l'ultimo buffer
 
-filtering_model = None
-model_lock = threading.Lock()
+# Snapshot immutabile del modello: pubblicato per riassegnazione, letto senza lock
+filtering_model = model_snapshot.EMPTY
 HDFS_MODEL_PATH = '/models/model.json'
+HDFS_MODEL_VERSION_PATH = '/models/model.version'
+MODEL_CACHE_PATH = os.environ.get('MODEL_CACHE_PATH', '/var/lib/iot-producer/model.json')
+MODEL_POLL_INTERVAL = 5 # Poll economico: solo GETFILESTATUS sul marker
 HDFS_DISCARD_STATS_PATH = '/models/discard_stats.json'
+HDFS_DISCARD_DELTA_DIR = '/models/discard_deltas'
+PRODUCER_ID = f"{socket.gethostname()}-{os.getpid()}-{int(time.time())}"
 discard_counter = 0
+discard_seq = 0
+discard_pending = None  # (producer, seq, count) del delta in scrittura, non ancora confermato
 discard_lock = threading.Lock()
 
-def setup_connections():
-    global cassandra_session, hdfs_client, cassandra_query
-    # 1. Cassandra
+# --- Metriche ---
+registry = metrics.Registry()
+m_messages = registry.counter('producer_messages_total', 'Record ricevuti dalle sorgenti', ('source',))
+m_parse_failures = registry.counter('producer_parse_failures_total', 'Messaggi non interpretabili', ('source',))
+m_queue_depth = registry.gauge('producer_queue_depth', 'Record in data_queue', fn=lambda: data_queue.qsize())
+m_queue_dropped = registry.counter('producer_queue_dropped_total', 'Record scartati dalla coda per sovraccarico', ('source',),
+                                   fn=lambda: data_queue.stats()["dropped"])
+m_queue_wait = registry.gauge('producer_queue_wait_max_seconds', 'Attesa massima in coda',
+                              fn=lambda: data_queue.stats()["queue_wait_max_ms"] / 1000)
+m_flush_rows = registry.histogram('producer_hdfs_flush_rows', 'Righe per batch HDFS', buckets=metrics.SIZE_BUCKETS)
+m_flush_bytes = registry.histogram('producer_hdfs_flush_bytes', 'Byte per batch HDFS',
+                                   buckets=(1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6))
+m_spool_latency = registry.histogram('producer_spool_append_seconds', 'Serializzazione + scrittura del batch nello spool')
+m_upload_latency = registry.histogram('producer_hdfs_upload_seconds', 'Latenza di upload di un batch su HDFS')
+m_cassandra_latency = registry.histogram('producer_cassandra_write_seconds', 'Latenza delle scritture Speed Layer')
+m_duplicates = registry.counter('producer_duplicates_total', 'Record duplicati scartati', ('source',))
+m_reconciled = registry.counter('producer_reconciled_total', 'Record fusi da più sorgenti')
+m_discards = registry.counter('producer_discards_total', 'Finestre scartate dal modello', ('sensor',))
+m_model_age = registry.gauge('producer_model_age_seconds', 'Età del modello in uso (dalla versione pubblicata)',
+                             fn=lambda: model_age())
+trade_log = metrics.LogRateLimiter(log, TRADE_LOG_RATE)
+
+model_loader = ModelLoader(f"http://{HDFS_HOST}:{HDFS_PORT}", HDFS_USER, HDFS_MODEL_PATH,
+                           HDFS_MODEL_VERSION_PATH, MODEL_CACHE_PATH)
+
+def connect_cassandra():
+    global cassandra_session, cassandra_query, cassandra_writer
+    delay = 1
     while True:
         try:
             cluster = Cluster([CASSANDRA_HOST], port=9042, load_balancing_policy=DCAwareRoundRobinPolicy(local_dc='datacenter1'))
             cassandra_session = cluster.connect() 
             cassandra_query = cassandra_session.prepare(f"INSERT INTO {CASSANDRA_KEYSPACE}.sensor_data (sensor_id, timestamp, temp) VALUES (?, ?, ?)")
+            cassandra_writer = CassandraWriter(cassandra_session, cassandra_query,
+                                               max_in_flight=CASSANDRA_MAX_IN_FLIGHT, max_retries=CASSANDRA_MAX_RETRIES,
+                                               on_latency=m_cassandra_latency.observe)
             log.info("✅ Cassandra Connesso")
-            break
-        except Exception: time.sleep(5)
-    
-    # 2. HDFS
+            return
+        except Exception:
+            time.sleep(delay)
+            delay = min(CONNECT_RETRY_MAX, delay * 2)
+
+def connect_hdfs():
+    global hdfs_client
+    delay = 1
     while True:
         try:
-            hdfs_client = InsecureClient(f"http://{HDFS_HOST}:{HDFS_PORT}", user=HDFS_USER, timeout=120)
+            client = InsecureClient(f"http://{HDFS_HOST}:{HDFS_PORT}", user=HDFS_USER, timeout=120)
             # Crea cartelle struttura
             for d in [HDFS_BASE_DIR, HDFS_INCOMING_DIR, '/models']:
-                if not hdfs_client.status(d, strict=False): hdfs_client.makedirs(d)
+                if not client.status(d, strict=False): client.makedirs(d)
+            hdfs_client = client
             log.info("✅ HDFS Connesso")
-            break
-        except Exception: time.sleep(5)
+            return
+        except Exception:
+            time.sleep(delay)
+            delay = min(CONNECT_RETRY_MAX, delay * 2)
+
+def start_hdfs_side():
+    """Dopo la connessione a HDFS: contatori di scarto e replay dello spool."""
+    global uploader
+    connect_hdfs()
+    init_discard_stats()
+    uploader = SpoolReplayer(hdfs_spool, upload_batch, workers=HDFS_UPLOAD_WORKERS, max_pending=HDFS_UPLOAD_MAX_PENDING,
+                             publish=publish_batch)
+    uploader.run()
+
+def setup_connections():
+    """
+    Cassandra e HDFS in parallelo, in background: la pipeline parte subito
+    (spool locale, modello last-known-good) e usa ogni lato appena è pronto.
+    """
+    threading.Thread(target=connect_cassandra, daemon=True, name='connect-cassandra').start()
+    threading.Thread(target=start_hdfs_side, daemon=True, name='hdfs-side').start()
 
 def init_discard_stats():
     if not hdfs_client: return
     try:
+        if not hdfs_client.status(HDFS_DISCARD_DELTA_DIR, strict=False):
+            hdfs_client.makedirs(HDFS_DISCARD_DELTA_DIR)
         if not hdfs_client.status(HDFS_DISCARD_STATS_PATH, strict=False):
             with hdfs_client.write(HDFS_DISCARD_STATS_PATH, encoding='utf-8', overwrite=True) as w:
-                json.dump({"total": 0}, w)
+                json.dump({"total": 0, "watermarks": {}}, w)
     except Exception: pass
 
+def delta_written(path, seq, count):
+    """Dopo un errore di scrittura verifica se il delta è comunque arrivato su HDFS."""
+    try:
+        with hdfs_client.read(path, encoding='utf-8') as r:
+            d = discard_log.parse_delta(r.read())
+        return d is not None and d["seq"] == seq and d["count"] == count
+    except Exception:
+        return False
+
 def flush_discard_stats():
-    global discard_counter
+    """
+    Scrive gli scarti accumulati come nuovo file delta (nessuna lettura dello snapshot).
+    Un delta non confermato si riscrive con lo stesso seq e lo stesso conteggio
+    (overwrite) finché la scrittura non riesce: se il tentativo fallito era
+    comunque arrivato su HDFS, il file resta uno solo e gli scarti contano una volta.
+    Gli scarti arrivati nel frattempo vanno nel delta successivo.
+    Il delta pendente entra nello snapshot di stato PRIMA della scrittura: dopo
+    un crash si riscrive lo stesso file (stesso producer e seq), non uno nuovo.
+    """
+    global discard_counter, discard_seq, discard_pending
     if not hdfs_client: return
-    local_count = 0
     with discard_lock:
-        if discard_counter == 0: return 
-        local_count = discard_counter
-    
+        new_delta = discard_pending is None
+        if new_delta:
+            if discard_counter == 0: return
+            discard_seq += 1
+            discard_pending = (PRODUCER_ID, discard_seq, discard_counter)
+        producer, seq, count = discard_pending
+    if new_delta:
+        save_discards()
+
+    path = f"{HDFS_DISCARD_DELTA_DIR}/{discard_log.delta_name(producer, seq)}"
     try:
-        current_total = 0
-        read_success = False
-        if hdfs_client.status(HDFS_DISCARD_STATS_PATH, strict=False):
-            try:
-                with hdfs_client.read(HDFS_DISCARD_STATS_PATH, encoding='utf-8') as r:
-                    content = r.read()
-                    if content:
-                        data = json.loads(content)
-                        current_total = int(data.get("total", 0))
-                        read_success = True
-            except Exception: pass
-        else:
-            read_success = True
-
-        if read_success:
-            new_total = current_total + local_count
-            with hdfs_client.write(HDFS_DISCARD_STATS_PATH, encoding='utf-8', overwrite=True) as w:
-                json.dump({"total": new_total}, w)
-            with discard_lock:
-                discard_counter -= local_count
+        with hdfs_client.write(path, encoding='utf-8', overwrite=True) as w:
+            w.write(discard_log.make_delta(producer, seq, count))
+        written = True
     except Exception as e:
-        log.error(f"Errore salvataggio stats: {e}")
+        written = delta_written(path, seq, count)
+        if not written: log.error(f"Errore salvataggio stats (delta {seq}, riprova allo stesso seq): {e}")
+
+    if written:
+        with discard_lock:
+            discard_counter -= count
+            discard_pending = None
 
 def update_model():
+    """
+    Poll condizionale: scarica e ricompila il modello solo se il marker
+    di versione su HDFS è cambiato. Il parsing avviene in memoria.
+    """
     global filtering_model
-    import tempfile
     try:
-        fast_client = InsecureClient(f"http://{HDFS_HOST}:{HDFS_PORT}", user=HDFS_USER, timeout=15)
-        if not fast_client.status(HDFS_MODEL_PATH, strict=False): return 
-        
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            local_path = tmp.name
-        try:
-            fast_client.download(HDFS_MODEL_PATH, local_path, overwrite=True)
-            with open(local_path, 'r') as f:
-                c = f.read()
-                if c and c.strip() != '{}':
-                    with model_lock: filtering_model = json.loads(c)
-                    log.info(f"🔄 Modello Aggiornato: {list(filtering_model.keys())}")
-        finally:
-            if os.path.exists(local_path): os.remove(local_path)
-    except Exception: pass
+        model = model_loader.poll()
+        if model:
+            filtering_model = model_snapshot.ModelSnapshot.compile(model, version=model_loader.version)
+            log.info(f"🔄 Modello Aggiornato (v{model_loader.version}): {filtering_model.sensors()}")
+    except Exception as e:
+        log.debug(f"Poll modello fallito: {e}")
+
+def poll_model_loop():
+    """
+    Poll del modello su un thread dedicato: con HDFS irraggiungibile ogni
+    chiamata può attendere fino al timeout del client, e il thread
+    principale non deve ritardare spool.sync e le altre scadenze.
+    """
+    update_model()
+    while not shutdown_event.wait(MODEL_POLL_INTERVAL):
+        update_model()
+
+def load_local_model():
+    """All'avvio usa la copia last-known-good, in attesa di HDFS."""
+    global filtering_model
+    model = model_loader.load_local()
+    if model:
+        filtering_model = model_snapshot.ModelSnapshot.compile(model, version=model_loader.version)
+        log.info(f"📂 Modello locale caricato (v{model_loader.version}): {filtering_model.sensors()}")
+
+def model_age():
+    """Secondi dalla pubblicazione del modello in uso (versione: epoch s dal marker, ms dal fallback)."""
+    version = filtering_model.version
+    if not version: return float('nan')
+    version = float(version)
+    if version > 1e11: version /= 1000
+    return time.time() - version
 
 def is_clean(sid, price):
-    with model_lock:
-        if not filtering_model or sid not in filtering_model: return False 
-        m = filtering_model[sid]['mean']
-        s = filtering_model[sid]['std_dev']
-        if s == 0: return True
-        # Tolleranza ampia (3 sigma)
-        return (m - 3*s) <= price <= (m + 3*s)
+    # Tolleranza ampia (3 sigma), limiti precalcolati nello snapshot
+    return filtering_model.is_clean(sid, price)
 
 # --- THREADS ---
-def run_binance():
-    last_ts_map = {}
-    def on_msg(ws, msg):
-        try:
-            j = json.loads(msg)
-            if 'data' not in j or j['data']['e'] != 'trade': return
-            d = j['data']
-            sid = UNIFIED_MAP.get(d['s'].lower())
-            if not sid: return
-            ts = datetime.utcfromtimestamp(d['E']/1000.0)
-            if sid in last_ts_map and last_ts_map[sid] == ts: return 
-            last_ts_map[sid] = ts
-            price = float(d['p'])
-            data_queue.put({"sid": sid, "ts": ts, "p": price, "src": "Binance"})
-        except: pass
-    while True:
-        try:
-            ws = websocket.WebSocketApp(BINANCE_WS_URL, on_message=on_msg)
-            ws.on_open = lambda w: w.send(json.dumps({"method": "SUBSCRIBE", "params": ["btcusdt@trade", "ethusdt@trade", "solusdt@trade"], "id": 1}))
-            ws.run_forever()
-        except: time.sleep(5)
+def serialize_batch(rows):
+    """
+    Serializza le righe (sid, ts, price, src) nel formato configurato.
+    Ritorna (estensione, contenuto testuale).
+    """
+    if HDFS_BATCH_FORMAT == 'iotc' and batch_format:
+        return batch_format.FILE_EXT, batch_format.encode_batch(
+            [(sid, batch_format.datetime_to_us(ts), price, src) for sid, ts, price, src in rows])
 
-def run_coinbase():
-    pairs = ["BTC-USD", "ETH-USD", "SOL-USD"]
-    while True:
-        for p in pairs:
-            try:
-                res = requests.get(COINBASE_API_URL.format(p), timeout=5)
-                if res.status_code == 200:
-                    data_queue.put({"sid": UNIFIED_MAP.get(p), "ts": datetime.utcnow(), "p": float(res.json()['data']['amount']), "src": "Coinbase"})
-            except: pass
-        time.sleep(5)
-
-def run_coingecko():
-    params = {"ids": "bitcoin,ethereum,solana", "vs_currencies": "usd"}
-    while True:
-        try:
-            res = requests.get(COINGECKO_API_URL, params=params, timeout=10)
-            if res.status_code == 200:
-                for c, v in res.json().items(): data_queue.put({"sid": UNIFIED_MAP.get(c), "ts": datetime.utcnow(), "p": float(v['usd']), "src": "CoinGecko"})
-        except: pass
-        time.sleep(20)
+    return 'jsonl', "".join(codec.dumps({
+        "sensor_id": sid,
+        "timestamp": ts.isoformat(), # ISO standard
+        "temp": price,
+        "source": src
+    }) + '\n' for sid, ts, price, src in rows)
+
+def upload_batch(name, content):
+    """Copia un batch dello spool in /incoming come _<nome>: il job (batch_*) non lo vede ancora."""
+    started = time.monotonic()
+    with hdfs_client.write(f"{HDFS_INCOMING_DIR}/_{name}", encoding='utf-8', overwrite=True) as w:
+        w.write(content)
+    m_upload_latency.observe(time.monotonic() - started)
+
+def publish_batch(name):
+    """Rende visibile un batch caricato (rename), in ordine di spool."""
+    hidden, visible = f"{HDFS_INCOMING_DIR}/_{name}", f"{HDFS_INCOMING_DIR}/{name}"
+    try:
+        hdfs_client.rename(hidden, visible)
+    except HdfsError:
+        # Replay dopo un crash tra rename e checkpoint: il batch è già visibile
+        if not hdfs_client.status(visible, strict=False): raise
+        hdfs_client.delete(hidden)
+
+def encode_rows(rows):
+    return [[sid, ts.isoformat(), price, src] for sid, ts, price, src in rows]
+
+def decode_rows(rows):
+    return [(sid, datetime.fromisoformat(ts), price, src) for sid, ts, price, src in rows]
 
-def process_queue():
+def process_queue(initial_rows=None):
     """
-    Raccoglie i dati e scrive file BATCH UNIVOCI nella cartella /incoming.
+    Raccoglie i dati e scrive file BATCH UNIVOCI nello spool locale;
+    il replayer li copia poi nella cartella /incoming.
     EVITA 'append' per prevenire lock HDFS.
+    Il buffer non ancora in spool finisce nello snapshot di stato ogni
+    STATE_SNAPSHOT_INTERVAL secondi; allo shutdown viene messo in spool.
     """
-    hdfs_buffer = []
+    hdfs_buffer = list(initial_rows or [])
     last_hdfs_flush = time.time()
+    last_snapshot = time.time()
+    snapshot_dirty = False
+    dedup_index = DedupIndex(DEDUP_MAX_ENTRIES, DEDUP_WINDOW)
+    reconciler = Reconciler(RECONCILE_WINDOW) if RECONCILE_WINDOW > 0 else None
+
+    def flush():
+        # Nome file univoco: batch_TIMESTAMP_NANO.<jsonl|iotc>
+        ts_batch = int(time.time() * 1000)
+        started = time.monotonic()
+        ext, content = serialize_batch(hdfs_buffer)
+        suffix = f"_w{worker_index}" if worker_index is not None else ""
+        filename = f"batch_{ts_batch}{suffix}.{ext}"
+
+        # Prima su disco locale: HDFS giù non fa crescere la memoria
+        hdfs_spool.append(filename, content)
+        m_spool_latency.observe(time.monotonic() - started)
+        m_flush_rows.observe(len(hdfs_buffer))
+        m_flush_bytes.observe(len(content))
+        log.info(f"📝 Batch in spool: {filename} ({len(hdfs_buffer)} righe)")
+        if state_snapshot: state_snapshot.save(buffer=[])
+
+    # Allo shutdown si consuma solo quanto già in coda
+    remaining = None
     
     while True:
         try:
+            if shutdown_event.is_set() and remaining is None:
+                remaining = data_queue.qsize()
+
+            records = []
             try:
-                item = data_queue.get(timeout=1)
-                sid, ts, price, src = item['sid'], item['ts'], item['p'], item['src']
-                log.info(f"[{src}] -> {sid}: ${price}")
+                if remaining is not None:
+                    if remaining <= 0: raise queue.Empty
+                    remaining -= 1
+                    item = data_queue.get_nowait()
+                else:
+                    item = data_queue.get(timeout=RECONCILE_WINDOW or 1)
+                data_queue.task_done()
+                m_messages.inc(source=item['src'])
+                if dedup_index.is_duplicate(item):
+                    m_duplicates.inc(source=item['src'])
+                elif reconciler:
+                    records = reconciler.add(item)
+                else:
+                    records = [item]
+            except queue.Empty:
+                if reconciler: records = reconciler.flush(force=remaining is not None)
+
+            for rec in records:
+                sid, ts, price, src = rec['sid'], rec['ts'], rec['p'], rec['src']
+                if '+' in src: m_reconciled.inc()
+                trade_log.info("[%s] -> %s: $%s", src, sid, price)
                 
                 # Speed Layer Buffer
-                with buffer_lock: aggregation_buffer[sid].append(price)
+                aggregation_buffer.add(sid, price)
                 
-                # Batch Layer Buffer
-                hdfs_buffer.append(json.dumps({
-                    "sensor_id": sid, 
-                    "timestamp": ts.isoformat(), # ISO standard
-                    "temp": price, 
-                    "source": src
-                }) + '\n')
-                
-                data_queue.task_done()
-            except queue.Empty: pass
+                # Batch Layer Buffer (serializzato al flush)
+                hdfs_buffer.append((sid, ts, price, src))
+                snapshot_dirty = True
+
+            if remaining is not None and remaining <= 0:
+                # Shutdown: ultimo batch in spool, anche se piccolo (altrimenti resta nello snapshot)
+                try:
+                    if hdfs_buffer: flush()
+                except Exception as e:
+                    log.error(f"Errore scrittura spool allo shutdown: {e}")
+                    if state_snapshot: state_snapshot.save(buffer=encode_rows(hdfs_buffer))
+                queue_drained.set()
+                return
 
             # Logica di Flush: Tempo o Dimensione
             if len(hdfs_buffer) > 0 and (len(hdfs_buffer) >= HDFS_BATCH_SIZE or (time.time() - last_hdfs_flush > HDFS_FLUSH_INTERVAL)):
-                
-                # Nome file univoco: batch_TIMESTAMP_NANO.jsonl
-                ts_batch = int(time.time() * 1000)
-                filename = f"batch_{ts_batch}.jsonl"
-                full_path = f"{HDFS_INCOMING_DIR}/{filename}"
-                
                 try:
-                    # Write con Overwrite=True (sicuro perché il nome è univoco)
-                    with hdfs_client.write(full_path, encoding='utf-8', overwrite=True) as w:
-                        w.write("".join(hdfs_buffer))
-                    log.info(f"💾 Batch salvato in INCOMING: {filename} ({len(hdfs_buffer)} righe)")
+                    flush()
                     hdfs_buffer = []
+                    snapshot_dirty = False
                     last_hdfs_flush = time.time()
+                    last_snapshot = last_hdfs_flush
                 except Exception as e:
-                    log.error(f"Errore scrittura HDFS: {e}")
+                    log.error(f"Errore scrittura spool: {e}")
+
+            elif snapshot_dirty and state_snapshot and time.time() - last_snapshot > STATE_SNAPSHOT_INTERVAL:
+                state_snapshot.save(buffer=encode_rows(hdfs_buffer))
+                snapshot_dirty = False
+                last_snapshot = time.time()
 
         except Exception as e:
             log.error(f"Errore loop process_queue: {e}")
@@ -258,57 +480,187 @@ def process_aggregates():
     last_wait_log = 0 
     while True:
         time.sleep(AGGREGATION_WINDOW)
-        has_model = False
-        with model_lock:
-            if filtering_model: has_model = True
+        snapshot = filtering_model
+
+        if cassandra_writer is None:
+            aggregation_buffer.clear()  # Cassandra non ancora connesso
+            continue
         
-        if not has_model:
-            with buffer_lock: aggregation_buffer.clear()
+        if not snapshot:
+            aggregation_buffer.clear()
             if time.time() - last_wait_log > 30: 
                 log.info("⏳ In attesa del modello (Calibrazione)...")
                 last_wait_log = time.time()
             continue
             
-        current_data = {}
-        with buffer_lock:
-            for k, v in aggregation_buffer.items():
-                if v: current_data[k] = v[:]
-            aggregation_buffer.clear()
+        # Scambio atomico degli accumulatori: nessuna copia sotto lock
+        current_data = aggregation_buffer.swap()
         
         ts_now = datetime.utcnow()
-        for sid, prices in current_data.items():
-            avg = sum(prices) / len(prices)
-            if is_clean(sid, avg):
-                try: cassandra_session.execute(cassandra_query, (sid, ts_now, avg))
-                except: pass
+        averages = {sid: acc.mean() for sid, acc in current_data.items()}
+        clean = snapshot.check_window(averages)
+        for sid, avg in averages.items():
+            if clean[sid]:
+                # Bloccante solo se la pipeline e' satura (backpressure)
+                cassandra_writer.submit((sid, ts_now, avg))
             else:
                 with discard_lock: discard_counter += 1
+                m_discards.inc(sensor=sid)
                 log.info(f"⚠️ Anomalia scartata (Speed Layer): {sid} - ${avg:.2f}")
 
-def main():
+def build_source():
+    """Sorgente configurata con PRODUCER_SOURCE; tutte espongono run() bloccante."""
+    if PRODUCER_SOURCE == 'replay':
+        shape = replay_source.BurstShape(REPLAY_RATE) if REPLAY_RATE else None
+        return replay_source.ReplaySource(data_queue, replay_source.iter_archive(REPLAY_PATHS), shape=shape)
+    if PRODUCER_SOURCE == 'synthetic':
+        shape = replay_source.BurstShape(REPLAY_RATE) if REPLAY_RATE else None
+        return replay_source.ReplaySource(data_queue, replay_source.iter_synthetic(SYNTHETIC_SYMBOLS), shape=shape)
+
+    return SourceEngine(
+        data_queue, SymbolRegistry(SYMBOL_REGISTRY),
+        BINANCE_WS_URL, COINBASE_API_URL, COINGECKO_API_URL,
+        ws_connections=BINANCE_WS_CONNECTIONS, ws_max_streams=BINANCE_WS_MAX_STREAMS,
+        ws_watchdog=BINANCE_WS_WATCHDOG, registry_poll=SYMBOL_REGISTRY_POLL,
+        coinbase_interval=COINBASE_POLL_INTERVAL, coingecko_interval=COINGECKO_POLL_INTERVAL,
+        coinbase_rate=COINBASE_RATE_LIMIT, coingecko_rate=COINGECKO_RATE_LIMIT,
+        http_pool_size=HTTP_POOL_SIZE
+    )
+
+def restore_state():
+    """Warm start: buffer HDFS e scarti pendenti dall'ultimo snapshot locale."""
+    global state_snapshot, discard_counter, discard_pending
+    state_snapshot = StateSnapshot(STATE_SNAPSHOT_PATH)
+    state = state_snapshot.load()
+    rows = []
+    try:
+        rows = decode_rows(state.get("buffer", []))
+    except Exception as e:
+        log.warning(f"Buffer nello snapshot non valido, ignorato: {e}")
+    pending = state.get("discard_pending")
+    with discard_lock:
+        discard_counter += int(state.get("discards", 0))
+        if pending:
+            # Delta forse già scritto prima del crash: si riprova allo stesso percorso
+            discard_pending = (str(pending[0]), int(pending[1]), int(pending[2]))
+            discard_counter += discard_pending[2]
+    if rows or discard_counter:
+        log.info(f"♻️ Stato ripristinato: {len(rows)} righe in buffer, {discard_counter} scarti pendenti")
+    return rows
+
+def save_discards():
+    """Scarti non ancora su HDFS: il delta pendente a parte, gli altri come conteggio."""
+    with discard_lock:
+        pending = discard_pending
+        unsent = discard_counter - (pending[2] if pending else 0)
+    state_snapshot.save(discards=unsent, discard_pending=list(pending) if pending else None)
+
+def shutdown(threads_timeout=5):
+    """SIGTERM: ultimo batch in spool, scarti su HDFS (o nello snapshot), scritture Cassandra completate."""
+    log.info("🛑 Arresto: salvataggio dello stato...")
+    queue_drained.wait(threads_timeout)
+    flush_discard_stats()
+    save_discards()
+    hdfs_spool.close()
+    if cassandra_writer: cassandra_writer.wait_idle(threads_timeout)
+    log.info("🛑 Producer arrestato")
+
+def run_pipeline(source=None):
+    """
+    Aggregazione, filtro e batching HDFS sui record di data_queue.
+    `source`: sorgente da avviare in questo processo (None nei worker, alimentati dal supervisore).
+    """
+    global hdfs_spool
+    signal.signal(signal.SIGTERM, lambda *_: shutdown_event.set())
+    load_local_model()
+    restored_rows = restore_state()
+    hdfs_spool = HdfsSpool(HDFS_SPOOL_DIR, HDFS_SPOOL_SEGMENT_BYTES, HDFS_SPOOL_FSYNC_INTERVAL)
     setup_connections()
-    init_discard_stats()
+
+    if HDFS_BATCH_FORMAT == 'iotc' and not batch_format:
+        log.warning("⚠️ batch_format non disponibile: fallback a JSONL")
     
-    threading.Thread(target=run_binance, daemon=True).start()
-    threading.Thread(target=run_coinbase, daemon=True).start()
-    threading.Thread(target=run_coingecko, daemon=True).start()
-    threading.Thread(target=process_queue, daemon=True).start()
+    if source:
+        m_parse_failures.fn = lambda: dict(getattr(source, 'parse_failures', {}))
+        threading.Thread(target=source.run, daemon=True).start()
+    if METRICS_PORT:
+        metrics.serve(registry, METRICS_PORT)
+    threading.Thread(target=process_queue, args=(restored_rows,), daemon=True).start()
     threading.Thread(target=process_aggregates, daemon=True).start()
+    threading.Thread(target=poll_model_loop, daemon=True, name='model-poll').start()
 
     log.info("🚀 Unified Producer Avviato (Mode: Incremental)")
 
-    last_chk = 0
     last_stats_flush = 0
+    last_stats_log = time.time()
 
-    while True:
-        time.sleep(1) 
+    while not shutdown_event.wait(1):
         now = time.time()
-        if now - last_chk > 60:
-            update_model()
-            last_chk = now
+        hdfs_spool.sync()
         if now - last_stats_flush > STATS_FLUSH_INTERVAL:
             flush_discard_stats()
+            save_discards()
             last_stats_flush = now
+        if now - last_stats_log > STATS_LOG_INTERVAL:
+            if cassandra_writer: log.info(f"📊 Cassandra: {cassandra_writer.stats()}")
+            log.info(f"📊 Coda: {data_queue.stats()}")
+            if source and hasattr(source, 'stats'): log.info(f"📊 Sorgenti: {source.stats()}")
+            if uploader: log.info(f"📊 Upload HDFS: {uploader.stats()}")
+            last_stats_log = now
+
+    shutdown()
+
+def run_worker(index, conn):
+    """
+    Entry point di un processo worker (contesto spawn): spool, id dei delta
+    di scarto, nomi dei batch e porta delle metriche sono propri del worker.
+    """
+    global worker_index, HDFS_SPOOL_DIR, STATE_SNAPSHOT_PATH, PRODUCER_ID, METRICS_PORT
+    worker_index = index
+    HDFS_SPOOL_DIR = os.path.join(HDFS_SPOOL_DIR, f"worker-{index}")
+    STATE_SNAPSHOT_PATH = os.path.splitext(STATE_SNAPSHOT_PATH)[0] + f"-w{index}.json"
+    PRODUCER_ID = f"{PRODUCER_ID}-w{index}"
+    if METRICS_PORT: METRICS_PORT += 1 + index
+    logging.getLogger().handlers[0].setFormatter(
+        logging.Formatter(f'%(asctime)s - PRODUCER[w{index}] - %(message)s'))
+
+    def feed():
+        worker_pool.receive_into(conn, data_queue)
+        # Supervisore terminato: arresto ordinato come per SIGTERM
+        shutdown_event.set()
+
+    threading.Thread(target=feed, daemon=True).start()
+    run_pipeline()
+
+def run_supervisor():
+    """Processo principale in modalità multi-processo: sola ingestion e routing ai worker."""
+    supervisor = worker_pool.WorkerSupervisor(run_worker, PRODUCER_WORKERS, batch_size=WORKER_BATCH_SIZE)
+    supervisor.start()
+    # SIGTERM: uscita ordinata, multiprocessing termina (SIGTERM) e attende i worker
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    source = build_source()
+    m_parse_failures.fn = lambda: dict(getattr(source, 'parse_failures', {}))
+    registry.counter('producer_worker_restarts_total', 'Riavvii dei worker', ('worker',),
+                     fn=lambda: {(str(w["index"]),): w["restarts"] for w in supervisor.stats()["workers"]})
+    registry.counter('producer_worker_lost_total', 'Record persi verso worker terminati', fn=lambda: supervisor.lost)
+    if METRICS_PORT:
+        metrics.serve(registry, METRICS_PORT)
+    threading.Thread(target=source.run, daemon=True).start()
+    threading.Thread(target=supervisor.run_router, args=(data_queue,), daemon=True).start()
+    log.info(f"🚀 Unified Producer Avviato (Mode: Incremental, {PRODUCER_WORKERS} worker)")
+
+    while True:
+        time.sleep(STATS_LOG_INTERVAL)
+        log.info(f"📊 Coda: {data_queue.stats()}")
+        if hasattr(source, 'stats'): log.info(f"📊 Sorgenti: {source.stats()}")
+        log.info(f"📊 Worker: {supervisor.stats()}")
+
+def main():
+    if PRODUCER_WORKERS > 1:
+        run_supervisor()
+    else:
+        run_pipeline(build_source())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
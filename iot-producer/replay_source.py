@@ -0,0 +1,121 @@
+"""
+replay_source.py - Sorgenti offline per il producer (nessuna rete)
+
+  - archive:   rilegge file locali dell'archivio (/iot-data/archive copiato
+               con "hdfs dfs -get"), sia JSONL sia blocchi IOTC, sia
+               batch singoli sia segmenti compattati (.gz)
+  - synthetic: genera trade con random walk per N simboli, con raffiche
+               periodiche configurabili
+
+ReplaySource spinge i record in `out_queue` (stesso contratto di
+SourceEngine: {"sid", "ts", "p", "src"}) a un rate target oppure il più
+velocemente possibile (rate=None).
+"""
+
+import glob
+import gzip
+import logging
+import random
+import time
+from datetime import datetime
+
+import codec
+
+try:
+    import batch_format
+except ImportError:
+    batch_format = None
+
+log = logging.getLogger(__name__)
+
+
+def iter_archive(patterns, src='Replay'):
+    """Record da file JSONL/IOTC locali, nell'ordine dei file (glob ordinati)."""
+    paths = sorted(p for pattern in patterns for p in glob.glob(pattern) if not p.endswith('.idx.json'))
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line: continue
+                try:
+                    if batch_format and batch_format.is_block(line):
+                        for sid, ts_us, temp, source in batch_format.iter_block(line):
+                            yield {"sid": sid, "ts": batch_format.us_to_datetime(ts_us), "p": temp, "src": source or src}
+                        continue
+                    d = codec.loads(line)
+                    yield {"sid": d["sensor_id"], "ts": datetime.fromisoformat(d["timestamp"]),
+                           "p": float(d["temp"]), "src": d.get("source", src)}
+                except Exception:
+                    pass  # Riga malformata
+
+
+def iter_synthetic(symbols=3, start_price=100.0, volatility=0.0005, src='Synthetic', seed=None):
+    """Trade infiniti: random walk moltiplicativo per ogni simbolo (S0, S1, ...)."""
+    rnd = random.Random(seed)
+    prices = [start_price * (1 + i) for i in range(symbols)]
+    sids = [f"S{i}" for i in range(symbols)]
+    while True:
+        i = rnd.randrange(symbols)
+        prices[i] *= 1 + rnd.gauss(0, volatility)
+        yield {"sid": sids[i], "ts": datetime.utcnow(), "p": prices[i], "src": src}
+
+
+class BurstShape:
+    """
+    Rate istantaneo: `base_rate`, moltiplicato per `factor` nei primi
+    `duration` secondi di ogni `period`.
+    """
+
+    def __init__(self, base_rate, factor=1.0, period=0.0, duration=0.0):
+        self.base_rate = base_rate
+        self.factor = factor
+        self.period = period
+        self.duration = duration
+
+    def rate(self, elapsed):
+        if self.period > 0 and (elapsed % self.period) < self.duration:
+            return self.base_rate * self.factor
+        return self.base_rate
+
+
+class ReplaySource:
+    """
+    `records` è un iterabile di record; `shape` un BurstShape o None (massima
+    velocità). `run()` è bloccante e termina a fine input o dopo `duration`.
+    """
+
+    def __init__(self, out_queue, records, shape=None, duration=None, restamp=False):
+        self.out_queue = out_queue
+        self.records = records
+        self.shape = shape
+        self.duration = duration
+        self.restamp = restamp
+        self.emitted = 0
+        self.done = False
+
+    def run(self):
+        start = time.monotonic()
+        next_at = start
+        try:
+            for item in self.records:
+                now = time.monotonic()
+                if self.duration is not None and now - start >= self.duration:
+                    break
+
+                if self.shape:
+                    # Pacing: dorme solo se in anticipo di almeno 1 ms sul piano
+                    next_at += 1.0 / self.shape.rate(now - start)
+                    ahead = next_at - now
+                    if ahead > 0.001:
+                        time.sleep(ahead)
+                    elif ahead < -1.0:
+                        next_at = now  # Troppo indietro: niente raffica di recupero
+
+                if self.restamp:
+                    item = dict(item, ts=datetime.utcnow())
+                self.out_queue.put(item)
+                self.emitted += 1
+        finally:
+            self.done = True
+            log.info(f"⏹️ Sorgente offline terminata: {self.emitted} record")
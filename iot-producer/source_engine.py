@@ -0,0 +1,343 @@
+"""
+source_engine.py - Motore di ingestion asincrono per le sorgenti di prezzo
+
+Un solo event loop (asyncio) multiplexa:
+  - N connessioni WebSocket Binance (@trade), con i simboli distribuiti
+    tra le connessioni (shard); ogni shard ha riconnessione e watchdog
+  - un poller REST Coinbase per ogni coppia, in parallelo
+  - il poller REST CoinGecko
+
+I simboli vengono dal SymbolRegistry: quando il registro cambia, i nuovi
+stream vengono assegnati allo shard meno carico (SUBSCRIBE sulla
+connessione già aperta, senza riconnettere) e quelli rimossi vengono
+disiscritti; se tutti gli shard sono pieni se ne apre uno nuovo.
+
+Le richieste HTTP condividono un pool di connessioni keep-alive
+(aiohttp.TCPConnector) e ogni sorgente REST ha il proprio rate limit.
+I record vengono messi in `out_queue` con lo stesso contratto dei
+vecchi thread: {"sid", "ts", "p", "src"}, più "eid" (id dell'evento alla
+sorgente) usato dalla deduplica a valle.
+"""
+
+import asyncio
+import json
+import logging
+import queue
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import aiohttp
+
+import codec
+
+log = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket asincrono: al massimo `rate` richieste al secondo,
+    con raffiche fino a `burst`.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BinanceShard:
+    """Una connessione WebSocket e l'insieme di simboli che le è assegnato."""
+
+    def __init__(self, index):
+        self.index = index
+        self.symbols = set()
+        self.ws = None
+        self.msg_id = 0
+        self.messages = 0
+        self.reconnects = 0
+        self.has_symbols = asyncio.Event()
+        self.task = None
+
+    async def send(self, method, symbols):
+        if not self.ws or self.ws.closed or not symbols:
+            return
+        self.msg_id += 1
+        params = [f"{s}@trade" for s in sorted(symbols)]
+        await self.ws.send_str(json.dumps({"method": method, "params": params, "id": self.msg_id}))
+
+
+class SourceEngine:
+    """
+    Raccoglie i prezzi da Binance, Coinbase e CoinGecko su un unico event loop.
+    `run()` e' bloccante: va lanciato in un thread dedicato.
+    """
+
+    def __init__(self, out_queue, registry,
+                 binance_url, coinbase_url, coingecko_url,
+                 ws_connections=1, ws_max_streams=200, ws_watchdog=40,
+                 registry_poll=30,
+                 coinbase_interval=5, coingecko_interval=20,
+                 coinbase_rate=5.0, coingecko_rate=0.5,
+                 http_pool_size=20, http_timeout=10):
+        self.out_queue = out_queue
+        self.registry = registry
+
+        self.binance_url = binance_url
+        self.coinbase_url = coinbase_url
+        self.coingecko_url = coingecko_url
+
+        self.ws_connections = max(1, ws_connections)
+        self.ws_max_streams = ws_max_streams
+        self.ws_watchdog = ws_watchdog
+        self.registry_poll = registry_poll
+
+        self.coinbase_interval = coinbase_interval
+        self.coingecko_interval = coingecko_interval
+        self.coinbase_rate = coinbase_rate
+        self.coingecko_rate = coingecko_rate
+        self.http_pool_size = http_pool_size
+        self.http_timeout = http_timeout
+
+        self.shards = []
+        self._shard_seq = 0  # Indici sempre nuovi: gli shard rimossi non si riusano
+        self.ws_dropped = 0  # Trade scartati perché la coda era piena
+        self.parse_failures = defaultdict(int)  # Messaggi non interpretabili, per sorgente
+        self._coinbase_tasks = {}
+        self._loop = None
+        self._main_task = None
+
+    def run(self):
+        try:
+            asyncio.run(self._main())
+        except asyncio.CancelledError:
+            log.info("⏹️ Source Engine fermato")
+
+    def stop(self):
+        """Ferma l'event loop da un altro thread (connessioni e poller vengono cancellati)."""
+        if self._main_task:
+            self._loop.call_soon_threadsafe(self._main_task.cancel)
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._main_task = asyncio.current_task()
+        connector = aiohttp.TCPConnector(limit=self.http_pool_size, keepalive_timeout=60, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.http_timeout)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            self._session = session
+            self._coinbase_limiter = RateLimiter(self.coinbase_rate, burst=max(1, len(self.registry.coinbase_pairs)))
+            coingecko_limiter = RateLimiter(self.coingecko_rate)
+
+            for _ in range(self.ws_connections):
+                self._add_shard()
+            await self._rebalance()
+
+            log.info(f"🔌 Source Engine avviato ({len(self.shards)} connessioni WS, "
+                     f"{len(self._coinbase_tasks)} poller Coinbase su un event loop)")
+            await asyncio.gather(self._poll_coingecko(session, coingecko_limiter), self._watch_registry())
+
+    async def _emit(self, item):
+        try:
+            self.out_queue.put_nowait(item)
+        except queue.Full:
+            # Coda piena: attende fuori dall'event loop per non bloccare le altre sorgenti
+            await asyncio.to_thread(self.out_queue.put, item)
+
+    def _emit_nowait(self, item):
+        """Per il WebSocket: non attende mai, anche se la sorgente è in politica 'block'."""
+        try:
+            self.out_queue.put_nowait(item)
+        except queue.Full:
+            self.ws_dropped += 1
+
+    # --- Registro e ribilanciamento ---
+    async def _watch_registry(self):
+        while True:
+            await asyncio.sleep(self.registry_poll)
+            try:
+                if self.registry.reload_if_changed():
+                    await self._rebalance()
+            except Exception as e:
+                log.error(f"Errore ribilanciamento simboli: {e}")
+
+    def _add_shard(self):
+        shard = BinanceShard(self._shard_seq)
+        self._shard_seq += 1
+        self.shards.append(shard)
+        shard.task = asyncio.ensure_future(self._run_shard(shard))
+        return shard
+
+    async def _rebalance(self):
+        wanted = set(self.registry.binance_symbols)
+
+        # Rimozioni: UNSUBSCRIBE sugli shard che li seguivano
+        emptied = []
+        for shard in self.shards:
+            removed = shard.symbols - wanted
+            if removed:
+                shard.symbols -= removed
+                await shard.send("UNSUBSCRIBE", removed)
+                if not shard.symbols:
+                    emptied.append(shard)
+
+        # Shard rimasti senza simboli: connessione chiusa (niente watchdog e
+        # riconnessioni a vuoto); oltre ws_connections lo shard si elimina,
+        # altrimenti resta fermo in attesa di nuovi simboli
+        for shard in emptied:
+            shard.has_symbols.clear()
+            if len(self.shards) > self.ws_connections:
+                self.shards.remove(shard)
+                shard.task.cancel()
+                log.info(f"🔌 Shard {shard.index} senza simboli: chiuso e rimosso")
+            elif shard.ws and not shard.ws.closed:
+                await shard.ws.close()
+                log.info(f"🔌 Shard {shard.index} senza simboli: connessione chiusa")
+
+        # Aggiunte: shard meno carico con posto libero, altrimenti uno nuovo
+        assigned = set().union(*(s.symbols for s in self.shards))
+        added = {}
+        for sym in sorted(wanted - assigned):
+            candidates = [s for s in self.shards if len(s.symbols) < self.ws_max_streams]
+            shard = min(candidates, key=lambda s: len(s.symbols)) if candidates else self._add_shard()
+            shard.symbols.add(sym)
+            added.setdefault(shard, set()).add(sym)
+
+        for shard, syms in added.items():
+            await shard.send("SUBSCRIBE", syms)
+            shard.has_symbols.set()
+
+        # Coinbase: un poller per coppia
+        pairs = set(self.registry.coinbase_pairs)
+        for pair in list(self._coinbase_tasks):
+            if pair not in pairs:
+                self._coinbase_tasks.pop(pair).cancel()
+        new_pairs = sorted(pairs - set(self._coinbase_tasks))
+        for i, pair in enumerate(new_pairs):
+            # Sfasa le coppie nell'intervallo per distribuire il carico
+            offset = self.coinbase_interval * i / len(new_pairs)
+            self._coinbase_tasks[pair] = asyncio.ensure_future(
+                self._poll_coinbase(self._session, self._coinbase_limiter, pair, offset))
+
+        if added or new_pairs:
+            log.info(f"🔀 Simboli ribilanciati: {[len(s.symbols) for s in self.shards]} stream per connessione")
+
+    # --- Binance (WebSocket, uno per shard) ---
+    async def _run_shard(self, shard):
+        while True:
+            await shard.has_symbols.wait()
+            try:
+                async with self._session.ws_connect(self.binance_url, heartbeat=20, timeout=self.http_timeout) as ws:
+                    shard.ws = ws
+                    await shard.send("SUBSCRIBE", shard.symbols)
+                    while True:
+                        try:
+                            # Watchdog: nessun messaggio per ws_watchdog secondi -> riconnessione
+                            msg = await ws.receive(timeout=self.ws_watchdog)
+                        except asyncio.TimeoutError:
+                            log.warning(f"Watchdog shard {shard.index}: nessun dato in {self.ws_watchdog}s, riconnessione...")
+                            break
+                        if msg.type != aiohttp.WSMsgType.TEXT:
+                            if msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                                break
+                            continue
+                        shard.messages += 1
+                        item = self._parse_binance(msg.data)
+                        if item:
+                            self._emit_nowait(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"Binance WS shard {shard.index} disconnesso: {e}")
+            finally:
+                shard.ws = None
+            if not shard.has_symbols.is_set():
+                continue  # Chiuso dal ribilanciamento: attende nuovi simboli
+            shard.reconnects += 1
+            await asyncio.sleep(5)
+
+    def _parse_binance(self, msg):
+        try:
+            j = codec.loads(msg)
+            if 'data' not in j or j['data']['e'] != 'trade': return None
+            d = j['data']
+            sid = self.registry.unified_map.get(d['s'].lower())
+            if not sid: return None
+            ts = datetime.utcfromtimestamp(d['E']/1000.0)
+            return {"sid": sid, "ts": ts, "p": float(d['p']), "src": "Binance", "eid": d['t']}
+        except Exception:
+            self.parse_failures["Binance"] += 1
+            return None
+
+    # --- Coinbase (REST, una coroutine per coppia) ---
+    async def _poll_coinbase(self, session, limiter, pair, offset):
+        url = self.coinbase_url.format(pair)
+        await asyncio.sleep(offset)
+
+        while True:
+            started = time.monotonic()
+            try:
+                await limiter.acquire()
+                async with session.get(url) as res:
+                    if res.status == 200:
+                        body = await res.json(loads=codec.loads, content_type=None)
+                        sid = self.registry.unified_map.get(pair)
+                        amount = body['data']['amount']
+                        # Nessun id né orario dell'evento: la deduplica scarta solo il prezzo invariato
+                        await self._emit({"sid": sid, "ts": datetime.utcnow(), "p": float(amount), "src": "Coinbase"})
+            except asyncio.CancelledError:
+                raise
+            except (KeyError, ValueError, TypeError) as e:
+                self.parse_failures["Coinbase"] += 1
+                log.debug(f"Coinbase {pair}: risposta non valida: {e}")
+            except Exception as e:
+                log.debug(f"Coinbase {pair}: {e}")
+            await asyncio.sleep(max(0, self.coinbase_interval - (time.monotonic() - started)))
+
+    # --- CoinGecko (REST, una richiesta per tutti gli id) ---
+    async def _poll_coingecko(self, session, limiter):
+        while True:
+            started = time.monotonic()
+            try:
+                ids = self.registry.coingecko_ids
+                if ids:
+                    await limiter.acquire()
+                    params = {"ids": ",".join(ids), "vs_currencies": "usd", "include_last_updated_at": "true"}
+                    async with session.get(self.coingecko_url, params=params) as res:
+                        if res.status == 200:
+                            body = await res.json(loads=codec.loads, content_type=None)
+                            ts = datetime.utcnow()
+                            for c, v in body.items():
+                                await self._emit({"sid": self.registry.unified_map.get(c), "ts": ts, "p": float(v['usd']),
+                                                  "src": "CoinGecko", "eid": v.get('last_updated_at')})
+            except asyncio.CancelledError:
+                raise
+            except (KeyError, ValueError, TypeError, AttributeError) as e:
+                self.parse_failures["CoinGecko"] += 1
+                log.debug(f"CoinGecko: risposta non valida: {e}")
+            except Exception as e:
+                log.debug(f"CoinGecko: {e}")
+            await asyncio.sleep(max(0, self.coingecko_interval - (time.monotonic() - started)))
+
+    def stats(self):
+        return {
+            "ws_connections": len(self.shards),
+            "ws_streams": [len(s.symbols) for s in self.shards],
+            "ws_messages": [s.messages for s in self.shards],
+            "ws_reconnects": sum(s.reconnects for s in self.shards),
+            "ws_dropped": self.ws_dropped,
+            "parse_failures": dict(self.parse_failures),
+        }
@@ -15,6 +15,7 @@ HDFS_PORT = 9870
 HDFS_USER = 'root'
 HDFS_DIR = '/iot-data'
 HDFS_MODEL_PATH = '/models/model.json'
+HDFS_MODEL_VERSION_PATH = '/models/model.version'
 
 # Comandi CQL da eseguire
 CQL_CREATE_KEYSPACE = """
@@ -119,6 +120,8 @@ def remove_old_model(hdfs_client):
             log.info("Modello vecchio rimosso con successo.")
         else:
             log.info("Nessun modello vecchio trovato. Avvio pulito.")
+        # Senza marker il batch job ripubblica il modello anche se invariato
+        hdfs_client.delete(HDFS_MODEL_VERSION_PATH)
     except Exception as e:
         log.error(f"Errore durante la rimozione del modello vecchio: {e}")
 
@@ -0,0 +1,58 @@
+"""
+state_snapshot.py - Snapshot locale dello stato del producer (warm start)
+
+Un file JSON (STATE_SNAPSHOT_PATH) con parti indipendenti, aggiornate dai
+thread che le possiedono:
+  "buffer"    righe del batch HDFS non ancora in spool   (process_queue)
+  "discards"  scarti non ancora scritti come delta HDFS  (thread principale)
+  "discard_pending"  [producer, seq, count] del delta in scrittura (idem)
+Il modello non è qui: ModelLoader ne tiene già la copia last-known-good.
+
+Ogni `save()` riscrive il file intero (tmp + fsync + rename), così dopo un
+crash si trova sempre l'ultima versione completa.
+"""
+
+import logging
+import os
+import threading
+
+import codec
+
+log = logging.getLogger(__name__)
+
+
+class StateSnapshot:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def load(self):
+        """Stato salvato ({} se assente o illeggibile); diventa la base dei save successivi."""
+        try:
+            with open(self.path, 'rb') as f:
+                state = codec.loads(f.read())
+        except FileNotFoundError:
+            state = {}
+        except Exception as e:
+            log.warning(f"Snapshot di stato illeggibile ({self.path}): {e}")
+            state = {}
+        with self._lock:
+            self._state = dict(state)
+        return state
+
+    def save(self, **parts):
+        with self._lock:
+            self._state.update(parts)
+            data = codec.dumps(self._state)
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                tmp = f"{self.path}.tmp"
+                with open(tmp, 'w') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except Exception as e:
+                log.error(f"Errore salvataggio snapshot di stato: {e}")
@@ -0,0 +1,62 @@
+"""
+symbol_registry.py - Registro dei simboli seguiti dal producer
+
+Il registro è un file JSON (SYMBOL_REGISTRY, default symbols.json) con una
+voce per sensore:
+  {"sensor_id": "A1", "binance": "btcusdt", "coinbase": "BTC-USD", "coingecko": "bitcoin"}
+Le chiavi di sorgente sono opzionali. `reload_if_changed()` rilegge il file
+quando cambia la modificationTime; le viste vengono sostituite in blocco
+(riassegnazione dei riferimenti), quindi i lettori non prendono lock.
+"""
+
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+
+class SymbolRegistry:
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self.unified_map = {}
+        self.binance_symbols = []
+        self.coinbase_pairs = []
+        self.coingecko_ids = []
+        self.reload_if_changed()
+
+    def reload_if_changed(self):
+        """Ritorna True se il registro è stato ricaricato."""
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return False
+            with open(self.path) as f:
+                entries = json.load(f)
+        except Exception as e:
+            log.error(f"Registro simboli non leggibile ({self.path}): {e}")
+            return False
+
+        unified = {}
+        binance, coinbase, coingecko = [], [], []
+        for e in entries:
+            sid = e["sensor_id"]
+            if e.get("binance"):
+                unified[e["binance"].lower()] = sid
+                binance.append(e["binance"].lower())
+            if e.get("coinbase"):
+                unified[e["coinbase"]] = sid
+                coinbase.append(e["coinbase"])
+            if e.get("coingecko"):
+                unified[e["coingecko"]] = sid
+                coingecko.append(e["coingecko"])
+
+        self.unified_map = unified
+        self.binance_symbols = binance
+        self.coinbase_pairs = coinbase
+        self.coingecko_ids = coingecko
+        self._mtime = mtime
+        log.info(f"📒 Registro simboli: {len(entries)} sensori, {len(binance)} stream Binance")
+        return True
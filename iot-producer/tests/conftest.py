@@ -0,0 +1,7 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Moduli del producer e moduli condivisi del Batch Layer, come nel container
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.append(os.path.join(HERE, '..', '..', 'hadoop-job'))
@@ -0,0 +1,53 @@
+from dedup import DedupIndex
+
+
+def trade(src, sid, p, ts=1000, eid=None):
+    item = {"src": src, "sid": sid, "p": p, "ts": ts}
+    if eid is not None:
+        item["eid"] = eid
+    return item
+
+
+def test_same_event_id_is_a_duplicate_within_the_window():
+    index = DedupIndex(window=10.0)
+    assert not index.is_duplicate(trade("Binance", "S1", 1.0, eid=7), now=0.0)
+    assert index.is_duplicate(trade("Binance", "S1", 2.0, eid=7), now=5.0)
+    # Stesso id su un altro sensore o un'altra sorgente: evento diverso
+    assert not index.is_duplicate(trade("Binance", "S2", 1.0, eid=7), now=5.0)
+    assert not index.is_duplicate(trade("CoinGecko", "S1", 1.0, eid=7), now=5.0)
+    assert index.duplicates == 1
+
+
+def test_timestamp_is_the_key_without_event_id():
+    index = DedupIndex()
+    assert not index.is_duplicate(trade("CoinGecko", "S1", 1.0, ts=100), now=0.0)
+    assert index.is_duplicate(trade("CoinGecko", "S1", 1.0, ts=100), now=0.0)
+    assert not index.is_duplicate(trade("CoinGecko", "S1", 1.0, ts=101), now=0.0)
+
+
+def test_keys_expire_after_the_window():
+    index = DedupIndex(window=10.0)
+    assert not index.is_duplicate(trade("Binance", "S1", 1.0, eid=1), now=0.0)
+    assert not index.is_duplicate(trade("Binance", "S1", 1.0, eid=1), now=11.0)
+    assert len(index) == 1
+
+
+def test_max_entries_evicts_the_oldest_keys():
+    index = DedupIndex(max_entries=2, window=100.0)
+    for eid in (1, 2, 3):
+        assert not index.is_duplicate(trade("Binance", "S1", 1.0, eid=eid), now=0.0)
+    assert len(index) == 2
+    assert not index.is_duplicate(trade("Binance", "S1", 1.0, eid=1), now=0.0)
+    assert index.is_duplicate(trade("Binance", "S1", 1.0, eid=3), now=0.0)
+
+
+def test_price_only_sources_drop_only_consecutive_repeats():
+    index = DedupIndex()
+    prices = [10.0, 10.0, 11.0, 10.0, 10.0]
+    kept = [p for p in prices if not index.is_duplicate(trade("Coinbase", "S1", p, ts=0))]
+    # Il ritorno A->B->A del prezzo e' un evento nuovo, la ripetizione immediata no
+    assert kept == [10.0, 11.0, 10.0]
+    assert index.duplicates == 2
+    # L'ultimo prezzo e' per sensore
+    assert not index.is_duplicate(trade("Coinbase", "S2", 10.0, ts=0))
+    assert len(index) == 0
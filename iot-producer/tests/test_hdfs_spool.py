@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+from hdfs import InsecureClient
+
+from hdfs_spool import HdfsSpool, SpoolReplayer
+from webhdfs_standin import WebHdfsStandin
+
+
+def records(spool):
+    return [(name, content) for _seg, _pos, _end, name, content in spool.read_from(*spool.load_checkpoint())]
+
+
+def test_roundtrip_across_segment_rotation(tmp_path):
+    spool = HdfsSpool(str(tmp_path), segment_bytes=64)
+    batches = [("batch_{}".format(i), "riga {}\n".format(i) * 5) for i in range(6)]
+    for name, content in batches:
+        spool.append(name, content)
+
+    assert len(spool.segments()) > 1
+    assert records(spool) == batches
+
+
+def test_truncated_tail_stops_the_segment(tmp_path):
+    spool = HdfsSpool(str(tmp_path))
+    spool.append("batch_1", "a\n")
+    spool.append("batch_2", "b\n")
+    spool.close()
+
+    # Crash a meta' scrittura: header completo, contenuto troncato
+    seg = os.path.join(str(tmp_path), spool.segments()[-1])
+    with open(seg, 'ab') as f:
+        f.write(b'IOTB batch_3 100 12345\npartial')
+
+    reopened = HdfsSpool(str(tmp_path))
+    assert records(reopened) == [("batch_1", "a\n"), ("batch_2", "b\n")]
+
+
+def test_crc_mismatch_stops_the_segment(tmp_path):
+    spool = HdfsSpool(str(tmp_path))
+    spool.append("batch_1", "a\n")
+    spool.append("batch_2", "bbbb\n")
+    spool.close()
+
+    seg = os.path.join(str(tmp_path), spool.segments()[-1])
+    with open(seg, 'rb') as f:
+        data = f.read()
+    with open(seg, 'wb') as f:
+        f.write(data.replace(b'bbbb', b'bxbb'))
+
+    assert records(HdfsSpool(str(tmp_path))) == [("batch_1", "a\n")]
+
+
+def test_restart_resumes_from_checkpoint_and_drops_replayed_segments(tmp_path):
+    spool = HdfsSpool(str(tmp_path))
+    spool.append("batch_1", "a\n")
+    spool.append("batch_2", "b\n")
+    first = list(spool.read_from(*spool.load_checkpoint()))
+    seg, _pos, end, _name, _content = first[0]
+    spool.commit(seg, end)
+    spool.close()
+
+    # Il riavvio apre un segmento nuovo; si riparte dal primo record non confermato
+    reopened = HdfsSpool(str(tmp_path))
+    reopened.append("batch_3", "c\n")
+    assert records(reopened) == [("batch_2", "b\n"), ("batch_3", "c\n")]
+
+    # Confermato tutto il primo segmento: il commit sul successivo lo elimina
+    position = reopened.next_position(seg, end + len(b'IOTB batch_2 2 0\nb\n\n'))
+    assert position[0] > seg
+    reopened.commit(*position)
+    assert seg not in reopened.segments()
+    assert records(reopened) == [("batch_3", "c\n")]
+
+
+def test_missing_checkpoint_starts_from_first_segment(tmp_path):
+    spool = HdfsSpool(str(tmp_path))
+    spool.append("batch_1", "a\n")
+    spool.close()
+    with open(os.path.join(str(tmp_path), 'checkpoint.json'), 'w') as f:
+        f.write('{corrotto')
+
+    reopened = HdfsSpool(str(tmp_path))
+    assert reopened.load_checkpoint() == (reopened.segments()[0], 0)
+    assert records(reopened) == [("batch_1", "a\n")]
+
+
+def test_next_position_skips_truncated_tail_of_closed_segment(tmp_path):
+    spool = HdfsSpool(str(tmp_path))
+    spool.append("batch_1", "a\n")
+    spool.close()
+    seg = spool.segments()[0]
+    with open(os.path.join(str(tmp_path), seg), 'ab') as f:
+        f.write(b'IOTB batch_2 50 1\ntronc')
+
+    reopened = HdfsSpool(str(tmp_path))
+    reopened.append("batch_3", "c\n")
+    _s, _p, end, _n, _c = next(iter(reopened.read_from(seg, 0)))
+    # Il segmento chiuso non ha altri record completi: si passa al successivo
+    assert reopened.next_position(seg, end) == (reopened.segments()[1], 0)
+
+
+def wait_until(cond, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cond():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def standin():
+    s = WebHdfsStandin()
+    port = s.start()
+    yield s, InsecureClient("http://127.0.0.1:{}".format(port), user='root', timeout=5)
+    s.stop()
+
+
+def test_replay_survives_webhdfs_outage_in_spool_order(tmp_path, standin):
+    server, client = standin
+    server.down = True
+
+    def upload(name, content):
+        with client.write('/iot-data/incoming/_' + name, encoding='utf-8', overwrite=True) as w:
+            w.write(content)
+
+    published = []
+
+    def publish(name):
+        client.rename('/iot-data/incoming/_' + name, '/iot-data/incoming/' + name)
+        published.append(name)
+
+    spool = HdfsSpool(str(tmp_path))
+    replayer = SpoolReplayer(spool, upload, workers=3, backoff_base=0.01, backoff_max=0.05, publish=publish)
+    threading.Thread(target=replayer.run, daemon=True).start()
+
+    names = ["batch_{:03d}".format(i) for i in range(12)]
+    for name in names:
+        spool.append(name, name + "\n")
+
+    assert wait_until(lambda: replayer.stats()["failures"] > 0)
+    assert server.snapshot() == {}
+
+    server.down = False
+    assert wait_until(lambda: len(published) == len(names))
+    assert published == names
+    assert server.snapshot() == {'/iot-data/incoming/' + n: (n + "\n").encode() for n in names}
+
+    # Tutto confermato: un riavvio non ha nulla da rigiocare
+    assert wait_until(lambda: replayer.stats()["in_flight"] == 0)
+    with open(os.path.join(str(tmp_path), 'checkpoint.json')) as f:
+        checkpoint = json.load(f)
+    assert list(spool.read_from(checkpoint["segment"], checkpoint["offset"])) == []
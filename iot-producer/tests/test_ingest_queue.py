@@ -0,0 +1,95 @@
+import queue
+import threading
+
+import pytest
+
+from ingest_queue import IngestQueue, parse_policies
+
+
+def trade(src, sid, p):
+    return {"src": src, "sid": sid, "p": p}
+
+
+def drain(q):
+    out = []
+    while not q.empty():
+        out.append(q.get_nowait())
+    return out
+
+
+def test_parse_policies():
+    assert parse_policies("Binance=coalesce, Coinbase = block,") == {"Binance": "coalesce", "Coinbase": "block"}
+    assert parse_policies(None) == {}
+    with pytest.raises(ValueError):
+        parse_policies("Binance=lifo")
+    with pytest.raises(ValueError):
+        IngestQueue(1, default_policy="lifo")
+
+
+def test_block_waits_for_space():
+    q = IngestQueue(1)
+    q.put(trade("CoinGecko", "S1", 1.0))
+    with pytest.raises(queue.Full):
+        q.put(trade("CoinGecko", "S1", 2.0), timeout=0.01)
+    with pytest.raises(queue.Full):
+        q.put_nowait(trade("CoinGecko", "S1", 2.0))
+
+    producer = threading.Thread(target=q.put, args=(trade("CoinGecko", "S1", 3.0),))
+    producer.start()
+    assert q.get(timeout=1)["p"] == 1.0
+    producer.join(timeout=1)
+    assert not producer.is_alive()
+    assert q.get(timeout=1)["p"] == 3.0
+    assert q.stats()["dropped"] == {}
+
+
+def test_drop_oldest_keeps_the_newest_items():
+    q = IngestQueue(2, default_policy="drop_oldest")
+    for p in (1.0, 2.0, 3.0):
+        q.put(trade("Binance", "S1", p))
+    assert [i["p"] for i in drain(q)] == [2.0, 3.0]
+    assert q.stats()["dropped"] == {"Binance": 1}
+
+
+def test_drop_newest_keeps_the_queued_items():
+    q = IngestQueue(2, {"Binance": "drop_newest"})
+    for p in (1.0, 2.0, 3.0):
+        q.put(trade("Binance", "S1", p))
+    assert [i["p"] for i in drain(q)] == [1.0, 2.0]
+    assert q.stats()["dropped"] == {"Binance": 1}
+
+
+def test_coalesce_replaces_the_queued_price_of_the_same_sensor():
+    q = IngestQueue(2, {"Binance": "coalesce"})
+    q.put(trade("Binance", "S1", 1.0))
+    q.put(trade("Binance", "S2", 2.0))
+    q.put(trade("Binance", "S1", 1.5))
+    # Stesso posto in coda, prezzo piu' recente
+    assert [(i["sid"], i["p"]) for i in drain(q)] == [("S1", 1.5), ("S2", 2.0)]
+    assert q.stats()["coalesced"] == {"Binance": 1}
+    assert q.stats()["dropped"] == {}
+
+
+def test_coalesce_falls_back_to_drop_oldest():
+    q = IngestQueue(2, {"Binance": "coalesce"})
+    q.put(trade("Binance", "S1", 1.0))
+    q.put(trade("Binance", "S2", 2.0))
+    q.put(trade("Binance", "S3", 3.0))
+    assert [i["sid"] for i in drain(q)] == ["S2", "S3"]
+    assert q.stats()["dropped"] == {"Binance": 1}
+
+    # Un elemento uscito dalla coda non si coalesce piu'
+    q.put(trade("Binance", "S2", 4.0))
+    q.put(trade("Binance", "S3", 5.0))
+    q.put(trade("Binance", "S2", 6.0))
+    assert [(i["sid"], i["p"]) for i in drain(q)] == [("S2", 6.0), ("S3", 5.0)]
+
+
+def test_policies_are_per_source():
+    q = IngestQueue(1, {"Binance": "drop_newest"}, default_policy="drop_oldest")
+    q.put(trade("Coinbase", "S1", 1.0))
+    q.put(trade("Binance", "S1", 2.0))
+    q.put(trade("Coinbase", "S1", 3.0))
+    assert [i["p"] for i in drain(q)] == [3.0]
+    assert q.stats()["dropped"] == {"Binance": 1, "Coinbase": 1}
+    assert q.stats()["max_depth"] == 1
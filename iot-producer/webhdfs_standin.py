@@ -0,0 +1,219 @@
+"""
+webhdfs_standin.py - WebHDFS in memoria per provare il producer senza Hadoop
+
+Implementa le operazioni usate dal client `hdfs` del producer e del
+model_loader (CREATE con redirect al "DataNode", OPEN, GETFILESTATUS,
+LISTSTATUS, MKDIRS, RENAME, DELETE) su un filesystem in memoria, e si può
+spegnere a comando per simulare un NameNode irraggiungibile:
+
+  POST /standin/down    ogni chiamata WebHDFS risponde 503 (StandbyException)
+  POST /standin/up      servizio ripristinato
+  GET  /standin/files   {percorso: byte} dei file presenti
+
+Uso:
+  python webhdfs_standin.py --port 9870
+  HDFS_HOST=localhost HDFS_PORT=9870 python producer_unified.py
+  curl -X POST localhost:9870/standin/down     # ... e poi /standin/up
+
+Dai test: `standin = WebHdfsStandin(); port = standin.start()` lo avvia su
+un thread (porta libera), `standin.down = True` lo spegne, `standin.stop()`.
+"""
+
+import argparse
+import asyncio
+import posixpath
+import threading
+import time
+
+from aiohttp import web
+
+PREFIX = '/webhdfs/v1'
+
+
+def _error(status, exception, message):
+    return web.json_response({"RemoteException": {"exception": exception, "message": message,
+                                                  "javaClassName": "org.apache.hadoop." + exception}},
+                             status=status)
+
+
+class WebHdfsStandin:
+
+    def __init__(self):
+        self.files = {}          # percorso -> (bytes, modificationTime ms)
+        self.dirs = {'/'}
+        self.down = False
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    # --- Filesystem ---
+    def _mkdirs(self, path):
+        while path not in self.dirs:
+            if path in self.files:
+                return False
+            self.dirs.add(path)
+            path = posixpath.dirname(path)
+        return True
+
+    def _status(self, path):
+        if path in self.files:
+            data, mtime = self.files[path]
+            return {"type": "FILE", "length": len(data), "modificationTime": mtime,
+                    "pathSuffix": "", "permission": "644", "replication": 1}
+        if path in self.dirs:
+            return {"type": "DIRECTORY", "length": 0, "modificationTime": 0,
+                    "pathSuffix": "", "permission": "755", "replication": 0}
+        return None
+
+    def _children(self, path):
+        prefix = path.rstrip('/') + '/'
+        names = [p for p in list(self.files) + list(self.dirs)
+                 if p != path and p.startswith(prefix) and '/' not in p[len(prefix):]]
+        return sorted(names)
+
+    def snapshot(self):
+        """{percorso: contenuto} dei file presenti."""
+        with self._lock:
+            return {p: data for p, (data, _m) in self.files.items()}
+
+    # --- HTTP ---
+    async def _handle(self, request):
+        if self.down:
+            return _error(503, 'StandbyException', 'WebHDFS stand-in spento')
+        self.requests += 1
+        path = posixpath.normpath('/' + request.match_info['path'])
+        op = request.query.get('op', '').upper()
+        body = await request.read() if request.method in ('PUT', 'POST') else b''
+
+        with self._lock:
+            status = self._status(path)
+
+            if op == 'GETFILESTATUS':
+                if status is None:
+                    return _error(404, 'FileNotFoundException', 'File does not exist: ' + path)
+                return web.json_response({"FileStatus": status})
+
+            if op == 'LISTSTATUS':
+                if status is None:
+                    return _error(404, 'FileNotFoundException', 'File does not exist: ' + path)
+                if status["type"] == 'FILE':
+                    return web.json_response({"FileStatuses": {"FileStatus": [status]}})
+                entries = []
+                for child in self._children(path):
+                    entry = self._status(child)
+                    entry["pathSuffix"] = posixpath.basename(child)
+                    entries.append(entry)
+                return web.json_response({"FileStatuses": {"FileStatus": entries}})
+
+            if op == 'MKDIRS':
+                return web.json_response({"boolean": self._mkdirs(path)})
+
+            if op == 'CREATE':
+                if 'data' not in request.query:
+                    # Primo passo (NameNode): controlli e redirect al "DataNode"
+                    if path in self.dirs:
+                        return _error(403, 'FileAlreadyExistsException', path + ' is a directory')
+                    if path in self.files and request.query.get('overwrite', 'false').lower() != 'true':
+                        return _error(403, 'FileAlreadyExistsException', path + ' already exists')
+                    location = str(request.url.update_query({'data': 'true'}))
+                    return web.Response(status=307, headers={'Location': location})
+                if not self._mkdirs(posixpath.dirname(path)):
+                    return _error(403, 'ParentNotDirectoryException', path)
+                self.files[path] = (body, int(time.time() * 1000))
+                return web.Response(status=201)
+
+            if op == 'OPEN':
+                if status is None or status["type"] != 'FILE':
+                    return _error(404, 'FileNotFoundException', 'File does not exist: ' + path)
+                return web.Response(body=self.files[path][0], content_type='application/octet-stream')
+
+            if op == 'RENAME':
+                dst = posixpath.normpath(request.query.get('destination', ''))
+                if dst in self.dirs:
+                    dst = posixpath.join(dst, posixpath.basename(path))
+                # Come HDFS: la destinazione non deve esistere e il padre si'
+                if status is None or dst in self.files or dst in self.dirs \
+                        or posixpath.dirname(dst) not in self.dirs:
+                    return web.json_response({"boolean": False})
+                if path in self.files:
+                    self.files[dst] = self.files.pop(path)
+                else:
+                    prefix = path.rstrip('/') + '/'
+                    for p in [p for p in self.files if p.startswith(prefix)]:
+                        self.files[dst + p[len(path):]] = self.files.pop(p)
+                    for d in [d for d in self.dirs if d == path or d.startswith(prefix)]:
+                        self.dirs.discard(d)
+                        self.dirs.add(dst + d[len(path):])
+                return web.json_response({"boolean": True})
+
+            if op == 'DELETE':
+                if status is None:
+                    return web.json_response({"boolean": False})
+                if status["type"] == 'DIRECTORY':
+                    children = self._children(path)
+                    if children and request.query.get('recursive', 'false').lower() != 'true':
+                        return _error(403, 'PathIsNotEmptyDirectoryException', path + ' is non empty')
+                    prefix = path.rstrip('/') + '/'
+                    for p in [p for p in self.files if p.startswith(prefix)]:
+                        del self.files[p]
+                    self.dirs = {d for d in self.dirs if d != path and not d.startswith(prefix)} | {'/'}
+                else:
+                    del self.files[path]
+                return web.json_response({"boolean": True})
+
+        return _error(400, 'UnsupportedOperationException', 'op non supportata: ' + op)
+
+    async def _control(self, request):
+        action = request.match_info['action']
+        if action == 'files':
+            return web.json_response({p: len(data) for p, data in self.snapshot().items()})
+        if action not in ('up', 'down'):
+            raise web.HTTPNotFound()
+        self.down = action == 'down'
+        return web.json_response({"down": self.down})
+
+    def app(self):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_route('*', PREFIX + '/{path:.*}', self._handle)
+        app.router.add_route('*', '/standin/{action}', self._control)
+        return app
+
+    # --- Avvio su thread (test) ---
+    def start(self, host='127.0.0.1', port=0):
+        """Avvia il server su un thread daemon e ritorna la porta effettiva."""
+        self._loop = asyncio.new_event_loop()
+        self._runner = web.AppRunner(self.app())
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, host, port)
+        self._loop.run_until_complete(site.start())
+        port = site._server.sockets[0].getsockname()[1]
+        self._thread = threading.Thread(target=self._loop.run_forever, name='webhdfs-standin', daemon=True)
+        self._thread.start()
+        return port
+
+    def stop(self):
+        if not self._loop:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+        self._loop = None
+
+
+def main():
+    p = argparse.ArgumentParser(description="WebHDFS in memoria, spegnibile (test del producer)")
+    p.add_argument('--host', default='0.0.0.0')
+    p.add_argument('--port', type=int, default=9870)
+    p.add_argument('--down', action='store_true', help="Parte spento (POST /standin/up per accenderlo)")
+    args = p.parse_args()
+
+    standin = WebHdfsStandin()
+    standin.down = args.down
+    web.run_app(standin.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+worker_pool.py - Modalità multi-processo del producer
+
+Il processo principale (supervisore) esegue solo l'ingestion: la sorgente
+riempie la sua data_queue e un thread di routing distribuisce i record ai
+worker partizionando per sensor_id (crc32 % N), così ogni sensore è sempre
+servito dallo stesso processo. I record viaggiano su una multiprocessing.Pipe
+per worker, a blocchi (`batch_size` record o `batch_interval` secondi) per
+ammortizzare il pickling.
+
+Ogni worker è un processo separato (contesto 'spawn': nessun lock ereditato
+dai thread del supervisore) che possiede aggregazione, filtro e batching
+HDFS della propria partizione. Il supervisore controlla i processi e
+riavvia quelli terminati con backoff. Mentre un worker è giù i suoi record
+restano nel buffer del router (al massimo `max_buffered`, oltre si scartano
+i più vecchi, contati in `lost`); i record già scritti nella Pipe di un
+worker morto si perdono, i batch già nel suo spool vengono ripresi dal
+processo riavviato.
+"""
+
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+
+log = logging.getLogger(__name__)
+
+
+def partition(sid, workers):
+    """Partizione stabile (indipendente da PYTHONHASHSEED) del sensore."""
+    return zlib.crc32(str(sid).encode('utf-8')) % workers
+
+
+class _Worker:
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.connected = False
+        self.buffer = []
+        self.retired = []  # Pipe dei processi morti: le chiude il router, unico a usarle
+        self.routed = 0
+        self.restarts = 0
+        self.next_start = 0.0
+
+
+class WorkerSupervisor:
+    """
+    `target(index, conn)` è la funzione eseguita in ogni worker (top-level,
+    importabile): riceve dalla Pipe liste di record e deve girare per sempre.
+    """
+
+    def __init__(self, target, workers, batch_size=256, batch_interval=0.05, max_buffered=100000,
+                 restart_backoff=1.0, restart_backoff_max=30.0):
+        self.target = target
+        self.workers = [_Worker(i) for i in range(workers)]
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_buffered = max_buffered
+        self.restart_backoff = restart_backoff
+        self.restart_backoff_max = restart_backoff_max
+
+        self._ctx = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()  # Protegge conn/process durante i riavvii (mai tenuto durante un send)
+        self.lost = 0
+
+    # --- Processi ---
+    def start(self):
+        for w in self.workers:
+            self._spawn(w)
+        threading.Thread(target=self._monitor, daemon=True, name='worker-monitor').start()
+
+    def _spawn(self, w):
+        recv_conn, send_conn = self._ctx.Pipe(duplex=False)
+        p = self._ctx.Process(target=self.target, args=(w.index, recv_conn),
+                              name=f'producer-worker-{w.index}', daemon=True)
+        p.start()
+        recv_conn.close()  # Il lato di lettura resta solo nel worker
+        w.process, w.conn, w.connected = p, send_conn, True
+        log.info(f"👷 Worker {w.index} avviato (pid {p.pid})")
+
+    def _monitor(self):
+        while True:
+            time.sleep(1)
+            for w in self.workers:
+                with self._lock:
+                    if w.process.is_alive():
+                        continue
+                    w.connected = False  # Il router tiene i record nel buffer fino al riavvio
+                    now = time.monotonic()
+                    if w.next_start == 0.0:
+                        # Backoff esponenziale sui riavvii ravvicinati
+                        delay = min(self.restart_backoff_max, self.restart_backoff * (2 ** min(w.restarts, 10)))
+                        w.next_start = now + delay
+                        log.error(f"💥 Worker {w.index} terminato (exit {w.process.exitcode}), riavvio tra {delay:.0f}s")
+                    if now < w.next_start:
+                        continue
+                    # Niente close qui: il router potrebbe essere dentro un send sulla stessa Pipe
+                    w.retired.append(w.conn)
+                    w.restarts += 1
+                    w.next_start = 0.0
+                    self._spawn(w)
+
+    # --- Routing ---
+    def run_router(self, in_queue):
+        """Legge da `in_queue` e invia i record ai worker; bloccante."""
+        n = len(self.workers)
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = in_queue.get(timeout=self.batch_interval)
+                w = self.workers[partition(item['sid'], n)]
+                w.buffer.append(item)
+                if len(w.buffer) >= self.batch_size and w.connected:
+                    self._send(w)
+            except queue.Empty:
+                pass
+
+            if time.monotonic() - last_flush >= self.batch_interval:
+                for w in self.workers:
+                    if w.retired: self._close_retired(w)
+                    if w.buffer and w.connected: self._send(w)
+                    elif len(w.buffer) > self.max_buffered:
+                        # Worker giù da troppo: scarta i record più vecchi
+                        excess = len(w.buffer) - self.max_buffered
+                        del w.buffer[:excess]
+                        self.lost += excess
+                last_flush = time.monotonic()
+
+    def _send(self, w):
+        batch, w.buffer = w.buffer, []
+        with self._lock:
+            conn = w.conn
+        try:
+            # Fuori dal lock: un worker lento blocca solo il router (la data_queue del
+            # supervisore si riempie e applica le politiche di sovraccarico), non il
+            # monitor e i riavvii degli altri worker
+            conn.send(batch)
+            w.routed += len(batch)
+        except (OSError, ValueError):
+            # Worker morto: il batch torna nel buffer finché il monitor non lo riavvia
+            # (se nel frattempo l'ha già riavviato, la nuova Pipe resta connessa)
+            with self._lock:
+                if w.conn is conn: w.connected = False
+            w.buffer = batch + w.buffer
+
+    def _close_retired(self, w):
+        with self._lock:
+            conns, w.retired = w.retired, []
+        for conn in conns:
+            conn.close()
+
+    def stats(self):
+        return {
+            "workers": [{"index": w.index, "pid": w.process.pid, "alive": w.process.is_alive(),
+                         "routed": w.routed, "buffered": len(w.buffer), "restarts": w.restarts} for w in self.workers],
+            "lost": self.lost,
+        }
+
+
+def receive_into(conn, out_queue):
+    """Lato worker: sposta i blocchi dalla Pipe nella data_queue locale; ritorna se il supervisore muore."""
+    while True:
+        try:
+            batch = conn.recv()
+        except (EOFError, OSError):
+            log.error("Pipe dal supervisore chiusa")
+            return
+        for item in batch:
+            out_queue.put(item)
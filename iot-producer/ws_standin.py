@@ -0,0 +1,172 @@
+"""
+ws_standin.py - Stand-in locale dello stream WebSocket di Binance
+
+Server aiohttp che parla il protocollo dello stream combinato usato da
+SourceEngine: accetta SUBSCRIBE/UNSUBSCRIBE ({"method", "params", "id"})
+e invia messaggi {"stream": "<simbolo>@trade", "data": {"e": "trade", ...}}
+a rotazione sui simboli sottoscritti. Ogni connessione è limitata a
+`rate` messaggi al secondo, come il tetto per connessione di Binance:
+è il limite che lo sharding su più connessioni deve superare.
+
+Comandi:
+  python ws_standin.py serve --port 9443 --rate 2000
+      BINANCE_WS_URL=ws://localhost:9443/stream python producer_unified.py
+  python ws_standin.py bench --connections 1 2 4 --symbols 200 --duration 10
+      Avvia lo stand-in e un SourceEngine per ogni numero di connessioni,
+      stampa una riga JSON con i record/s ricevuti (scaling dello sharding).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+
+from aiohttp import web
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault('HADOOP_JOB_DIR', os.path.join(HERE, '..', 'hadoop-job'))
+sys.path.append(os.environ['HADOOP_JOB_DIR'])  # codec, per source_engine nel bench
+
+TICK = 0.01  # Secondi tra due raffiche di invio
+
+
+class WsStandin:
+
+    def __init__(self, rate=2000.0):
+        self.rate = rate
+        self.connections = 0
+        self.sent = 0
+
+    async def _stream(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        symbols = []
+        sender = asyncio.ensure_future(self._send_loop(ws, symbols))
+        try:
+            async for msg in ws:
+                if msg.type != web.WSMsgType.TEXT:
+                    continue
+                req = json.loads(msg.data)
+                params = [p.split('@', 1)[0] for p in req.get("params", [])]
+                if req.get("method") == "SUBSCRIBE":
+                    symbols.extend(p for p in params if p not in symbols)
+                elif req.get("method") == "UNSUBSCRIBE":
+                    symbols[:] = [s for s in symbols if s not in params]
+                await ws.send_str(json.dumps({"result": None, "id": req.get("id")}))
+        finally:
+            sender.cancel()
+            self.connections -= 1
+        return ws
+
+    async def _send_loop(self, ws, symbols):
+        trade_id = 0
+        budget = 0.0
+        last = time.monotonic()
+        while not ws.closed:
+            await asyncio.sleep(TICK)
+            now = time.monotonic()
+            budget = min(self.rate, budget + (now - last) * self.rate)
+            last = now
+            if not symbols:
+                continue
+            n = int(budget)
+            budget -= n
+            event_ms = int(time.time() * 1000)
+            for _ in range(n):
+                sym = symbols[trade_id % len(symbols)]
+                trade_id += 1
+                data = {"e": "trade", "E": event_ms, "s": sym.upper(), "t": trade_id,
+                        "p": "{:.2f}".format(100 + trade_id % 100 / 100.0), "q": "0.01"}
+                await ws.send_str(json.dumps({"stream": sym + "@trade", "data": data}))
+            self.sent += n
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/stream', self._stream)
+        return app
+
+    def start(self, host='127.0.0.1', port=0):
+        """Avvia il server su un thread daemon e ritorna la porta effettiva."""
+        loop = asyncio.new_event_loop()
+        runner = web.AppRunner(self.app())
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, host, port)
+        loop.run_until_complete(site.start())
+        threading.Thread(target=loop.run_forever, name='ws-standin', daemon=True).start()
+        return site._server.sockets[0].getsockname()[1]
+
+
+def bench(connections, symbols, duration, rate):
+    """Record/s ricevuti da SourceEngine per ogni numero di connessioni."""
+    from source_engine import SourceEngine
+    from symbol_registry import SymbolRegistry
+
+    standin = WsStandin(rate)
+    port = standin.start()
+    url = "ws://127.0.0.1:{}/stream".format(port)
+
+    registry_path = os.path.join(tempfile.mkdtemp(prefix='ws-bench-'), 'symbols.json')
+    with open(registry_path, 'w') as f:
+        json.dump([{"sensor_id": "S{}".format(i), "binance": "sym{}usdt".format(i)} for i in range(symbols)], f)
+
+    results = []
+    for n in connections:
+        out = queue.Queue()
+        engine = SourceEngine(out, SymbolRegistry(registry_path), url, "http://127.0.0.1:9/{}", "http://127.0.0.1:9/",
+                              ws_connections=n, ws_max_streams=max(1, -(-symbols // n)), registry_poll=3600)
+        runner = threading.Thread(target=engine.run, daemon=True)
+        runner.start()
+        time.sleep(2)  # Connessione e SUBSCRIBE
+        while not out.empty():
+            out.get_nowait()
+
+        received = 0
+        started = time.monotonic()
+        while time.monotonic() - started < duration:
+            try:
+                out.get(timeout=0.1)
+                received += 1
+            except queue.Empty:
+                pass
+        elapsed = time.monotonic() - started
+        row = {"connections": n, "shards": len(engine.shards), "records_per_s": round(received / elapsed, 1),
+               "per_connection_cap": rate}
+        print(json.dumps(row), flush=True)
+        results.append(row)
+        engine.stop()  # Le connessioni di questo giro non pesano sul successivo
+        runner.join(timeout=10)
+    os.remove(registry_path)
+    os.rmdir(os.path.dirname(registry_path))
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Stand-in dello stream WebSocket di Binance")
+    sub = p.add_subparsers(dest='cmd')
+    p_serve = sub.add_parser('serve')
+    p_serve.add_argument('--host', default='0.0.0.0')
+    p_serve.add_argument('--port', type=int, default=9443)
+    p_serve.add_argument('--rate', type=float, default=2000.0, help="Messaggi/s per connessione")
+    p_bench = sub.add_parser('bench')
+    p_bench.add_argument('--connections', type=int, nargs='+', default=[1, 2, 4])
+    p_bench.add_argument('--symbols', type=int, default=200)
+    p_bench.add_argument('--duration', type=float, default=10.0)
+    p_bench.add_argument('--rate', type=float, default=2000.0, help="Messaggi/s per connessione")
+    args = p.parse_args()
+
+    if args.cmd == 'serve':
+        web.run_app(WsStandin(args.rate).app(), host=args.host, port=args.port)
+    elif args.cmd == 'bench':
+        bench(args.connections, args.symbols, args.duration, args.rate)
+    else:
+        p.print_help()
+
+
+if __name__ == "__main__":
+    main()